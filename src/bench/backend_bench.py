@@ -0,0 +1,131 @@
+"""Compare the selectors and asyncio backends under the same channel load
+
+Run from the root of the repo: `poetry run python src/bench/backend_bench.py`
+
+For every backend a daemon is started on a free port. `--clients` connections
+register and join one channel, then each of them sends `--messages` PRIVMSGs
+to the channel. The benchmark measures how long it takes until every member
+has received every message broadcast by the others.
+"""
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+
+DAEMON = "src/daemon/daemon.py"
+CHANNEL = "#bench"
+END_OF_NAMES = b" 366 "
+
+
+def parse_args() -> Namespace:
+    """Parse command line arguments"""
+    parser = ArgumentParser("pyircd backend benchmark")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument(
+        "--backends", nargs="+", default=["selectors", "asyncio"], type=str
+    )
+    return parser.parse_args()
+
+
+def get_free_port() -> int:
+    """Ask the kernel for a port that is currently free on loopback"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_daemon(backend: str, port: int) -> subprocess.Popen:
+    """Start a daemon and wait until it accepts connections"""
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            DAEMON,
+            "--port",
+            str(port),
+            "--backend",
+            backend,
+            # Every client sends all of its messages at once
+            "--flood-rate",
+            "0",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return proc
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{backend} daemon did not start")
+
+
+def wait_for(
+    selector: selectors.BaseSelector, counts: dict, marker: bytes, expected: int
+):
+    """Read from every client until each has seen `marker` `expected` times"""
+    buffers = {key.fd: b"" for key in selector.get_map().values()}
+    while any(count < expected for count in counts.values()):
+        for key, _ in selector.select(timeout=10):
+            data = key.fileobj.recv(65536)
+            if not data:
+                raise RuntimeError("Daemon closed a benchmark connection")
+            lines = (buffers[key.fd] + data).split(b"\r\n")
+            buffers[key.fd] = lines.pop()
+            counts[key.fd] += sum(marker in line for line in lines)
+
+
+def run(backend: str, clients: int, messages: int) -> float:
+    """Return the seconds taken to deliver all channel messages on a backend"""
+    port = get_free_port()
+    proc = start_daemon(backend, port)
+    selector = selectors.DefaultSelector()
+    try:
+        sockets = []
+        for i in range(clients):
+            sock = socket.create_connection(("127.0.0.1", port))
+            sock.sendall(
+                f"NICK bench{i}\r\nUSER bench{i} 0 * :bench\r\n"
+                f"JOIN {CHANNEL}\r\n".encode()
+            )
+            selector.register(sock, selectors.EVENT_READ)
+            sockets.append(sock)
+
+        wait_for(selector, {s.fileno(): 0 for s in sockets}, END_OF_NAMES, 1)
+
+        payload = f"PRIVMSG {CHANNEL} :{'x' * 64}\r\n".encode() * messages
+        counts = {s.fileno(): 0 for s in sockets}
+
+        start = time.perf_counter()
+        for sock in sockets:
+            sock.sendall(payload)
+        wait_for(selector, counts, b" PRIVMSG ", messages * (clients - 1))
+        return time.perf_counter() - start
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> None:
+    """Run the benchmark for every requested backend and print a summary"""
+    args = parse_args()
+    deliveries = args.clients * args.messages * (args.clients - 1)
+
+    print(f"{args.clients} clients x {args.messages} messages: {deliveries} deliveries")
+    for backend in args.backends:
+        elapsed = run(backend, args.clients, args.messages)
+        print(
+            f"{backend:>10}: {elapsed:.3f}s, {deliveries / elapsed:,.0f} deliveries/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Measure JOIN and NAMES as one channel grows to `--members` members
+
+Run from the root of the repo: `poetry run python src/bench/channel_bench.py`
+
+Clients on fake connections are registered in this process, then join one
+channel one after the other. Output every member queued is drained after each
+JOIN, as the event loop flushes it. Reported are JOINs per second over all
+joins and over the last `--window` of them, the NAMES replies the last client
+received, and the cost of a membership check against a copy of the member
+list, as the daemon made one before membership was checked in the dict.
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "daemon"))
+
+import constants  # noqa: E402
+from client import Client  # noqa: E402
+from connection import Connection, TransportKey  # noqa: E402
+from message import Message  # noqa: E402
+
+CHANNEL = "#bench"
+CHECKS = 1000
+
+
+def parse_args() -> Namespace:
+    """Parse command line arguments"""
+    parser = ArgumentParser("pyircd channel benchmark")
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--window", type=int, default=1000)
+    return parser.parse_args()
+
+
+def send(client: Client, command: str, *parameters):
+    client.handle_message(
+        Message(client.address, "HANDLE", b"", client.key, command, list(parameters))
+    )
+
+
+def create_clients(num_clients: int, dirty_keys: list) -> list:
+    """Register num_clients whose connections append to dirty_keys"""
+    clients = []
+    for number in range(num_clients):
+        address = ("127.0.0.1", number)
+        connection = Connection(address, dirty_keys.append, None)
+        client = Client(address, TransportKey(None, connection))
+        send(client, "NICK", f"member{number}")
+        send(client, "USER", f"member{number}", "0", "*", "Member")
+        clients.append(client)
+    return clients
+
+
+def flush(dirty_keys: list) -> list:
+    """Drain the output of every dirty connection, return the chunks"""
+    chunks = []
+    for key in dirty_keys:
+        key.data.is_dirty = False
+        chunks.extend(key.data.out_queue.drain())
+    dirty_keys.clear()
+    return chunks
+
+
+def main() -> None:
+    args = parse_args()
+    dirty_keys = []
+    clients = create_clients(args.members, dirty_keys)
+    flush(dirty_keys)
+
+    window_started_at = None
+    started_at = time.perf_counter()
+    for number, client in enumerate(clients):
+        if number == len(clients) - args.window:
+            window_started_at = time.perf_counter()
+        send(client, "JOIN", CHANNEL)
+        chunks = flush(dirty_keys)
+    finished_at = time.perf_counter()
+
+    names = [chunk for chunk in chunks if b" 353 " in chunk]
+    channel = Client.channels[CHANNEL]
+    address = clients[-1].address
+    checked_at = time.perf_counter()
+    for _ in range(CHECKS):
+        channel.has_member(address)
+    dict_check = time.perf_counter() - checked_at
+    checked_at = time.perf_counter()
+    for _ in range(CHECKS):
+        address in list(channel._members)
+    list_check = time.perf_counter() - checked_at
+
+    result = {
+        "joins_per_second": round(args.members / (finished_at - started_at)),
+        "last_joins_per_second": round(
+            min(args.window, args.members) / (finished_at - window_started_at)
+        )
+        if window_started_at is not None
+        else None,
+        "names_lines": len(names),
+        "names_bytes": sum(map(len, names)),
+        "longest_names_line": max(map(len, names)),
+        "line_limit": constants.MAX_LINE_LENGTH,
+        "dict_check_us": round(dict_check * 1e6 / CHECKS, 3),
+        "list_copy_check_us": round(list_check * 1e6 / CHECKS, 3),
+    }
+    print(f"{args.members} members: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Compare event loop backends with many connections active at once
+
+Run from the root of the repo:
+
+    poetry run python src/bench/epoll_bench.py --clients 10000 50000
+
+For every backend and number of clients a daemon is started on a free port and
+`--clients` connections register. Then every connection sends a PING in each of
+`--rounds` rounds, a round ends once every PONG has been received. Every round
+wakes the daemon for thousands of ready sockets at once, the per event cost of
+the backend dominates its CPU time. Reported are PONGs per second of wall time
+and per second of daemon CPU time.
+
+Both the daemon and the benchmark hold a file descriptor per connection, so
+the hard limit of open files must exceed the number of clients. Larger runs
+are skipped when it does not.
+"""
+import resource
+import selectors
+import socket
+import time
+from argparse import ArgumentParser, Namespace
+
+from backend_bench import get_free_port
+from load_gen import END_OF_MOTD, get_process_stats, start_daemon
+
+PONG = b" PONG "
+
+
+def parse_args() -> Namespace:
+    """Parse command line arguments"""
+    parser = ArgumentParser("pyircd epoll benchmark")
+    parser.add_argument("--clients", nargs="+", type=int, default=[10000, 50000])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--backends", nargs="+", default=["selectors", "epoll"], type=str
+    )
+    return parser.parse_args()
+
+
+class Tail:
+    """Unterminated line received last on a connection"""
+
+    __slots__ = ("tail",)
+
+    def __init__(self):
+        self.tail = b""
+
+
+def read_until(selector: selectors.BaseSelector, marker: bytes, expected: int):
+    """Read from every ready connection until marker was received expected times
+
+    Lines may be split between reads, so the tail of each read is kept in the
+    data of its key
+    """
+    count = 0
+    while count < expected:
+        for key, _ in selector.select(timeout=30):
+            data = key.fileobj.recv(65536)
+            if not data:
+                raise RuntimeError("Daemon closed a connection")
+            lines = (key.data.tail + data).split(b"\r\n")
+            key.data.tail = lines.pop()
+            count += sum(marker in line for line in lines)
+
+
+def measure(backend: str, num_clients: int, num_rounds: int) -> dict:
+    """Return PONGs per second and per daemon CPU second of backend"""
+    port = get_free_port()
+    proc = start_daemon(port, ["--backend", backend, "--flood-rate", "0"])
+    selector = selectors.DefaultSelector()
+    connections = []
+    try:
+        for i in range(num_clients):
+            connection = socket.create_connection(("127.0.0.1", port))
+            connection.sendall(f"NICK c{i}\r\nUSER c{i} 0 * :bench\r\n".encode())
+            connection.setblocking(False)
+            selector.register(connection, selectors.EVENT_READ, Tail())
+            connections.append(connection)
+        read_until(selector, END_OF_MOTD, num_clients)
+
+        before = get_process_stats(proc.pid)
+        started_at = time.perf_counter()
+        for _ in range(num_rounds):
+            for connection in connections:
+                connection.send(b"PING :bench\r\n")
+            read_until(selector, PONG, num_clients)
+        seconds = time.perf_counter() - started_at
+        after = get_process_stats(proc.pid)
+    finally:
+        for connection in connections:
+            connection.close()
+        selector.close()
+        proc.terminate()
+        proc.wait()
+
+    pongs = num_clients * num_rounds
+    result = {"pongs_per_second": round(pongs / seconds)}
+    if before is not None:
+        cpu_seconds = after["cpu_seconds"] - before["cpu_seconds"]
+        result["pongs_per_cpu_second"] = round(pongs / max(cpu_seconds, 0.01))
+        result["rss_kib"] = after["rss_kib"]
+    return result
+
+
+def main() -> None:
+    args = parse_args()
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+    for num_clients in args.clients:
+        # The daemon holds as many as the benchmark, plus a few of its own
+        if num_clients + 100 > hard_limit:
+            print(f"{num_clients:>6} clients: skipped, open file limit {hard_limit}")
+            continue
+        for backend in args.backends:
+            result = measure(backend, num_clients, args.rounds)
+            print(f"{num_clients:>6} clients {backend:>9}: {result}")
+
+
+if __name__ == "__main__":
+    main()
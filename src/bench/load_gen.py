@@ -0,0 +1,493 @@
+"""Generate load against the daemon and report throughput, latency and usage
+
+Run from the root of the repo:
+
+    poetry run python src/bench/load_gen.py --clients 2000 --output new.json
+    poetry run python src/bench/load_gen.py --compare old.json new.json
+
+A daemon is started on a free port, unless `--connect HOST:PORT` points the
+generator at a running one. `--clients` connections register with NICK/USER,
+then the scenarios run in this order:
+
+    chatter     Clients are spread over `--channels` channels and each sends
+                `--messages` PRIVMSGs to its channel
+    privmsg     Each client sends `--messages` PRIVMSGs to the next client
+    joinpart    Each client JOINs and PARTs a channel of its own `--messages`
+                times, latency is measured until the server echoes the command
+    disconnect  An observer joins every chatter channel, then every client
+                drops its connection at once, latency is measured until the
+                observer sees the PART of a client
+
+Every PRIVMSG carries the time it was written at, so delivery latency is
+measured end to end by the generator. Messages per second count deliveries.
+Daemon CPU time and RSS are read from /proc for the daemon and its workers,
+they are left out when /proc is not available or with `--connect`.
+
+`--output` saves the results as JSON. `--compare OLD NEW` prints the change of
+every metric and exits with status 1 if any of them regressed by more than
+`--threshold` percent.
+"""
+import json
+import os
+import platform
+import resource
+import selectors
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from collections import deque
+
+from backend_bench import DAEMON, get_free_port
+
+SCENARIOS = ["chatter", "privmsg", "joinpart", "disconnect"]
+PERCENTILES = {"p50": 0.5, "p99": 0.99, "p999": 0.999}
+
+# Key: metric compared by --compare, Value: True if a higher value is worse
+COMPARED_METRICS = {
+    "messages_per_second": False,
+    "p50_ms": True,
+    "p99_ms": True,
+    "p999_ms": True,
+    "cpu_seconds": True,
+    "peak_rss_kib": True,
+}
+
+WRITE_BATCH = 64  # Lines written per connection and writable event
+TIMESTAMP = "{t}"  # Replaced by the time a line is written at, in ns
+END_OF_MOTD = b" 376 "
+END_OF_NAMES = b" 366 "
+
+
+def parse_args() -> Namespace:
+    """Parse command line arguments"""
+    parser = ArgumentParser("pyircd load generator")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument(
+        "--channels", type=int, default=0, help="Defaults to one per 50 clients"
+    )
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Lines per second sent by all clients together, 0 sends at once",
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS, type=str
+    )
+    parser.add_argument(
+        "--daemon-args",
+        type=str,
+        default="--flood-rate 0",
+        help="Arguments of the started daemon, e.g. '--backend asyncio'",
+    )
+    parser.add_argument("--connect", type=str, help="HOST:PORT of a running daemon")
+    parser.add_argument("--timeout", type=float, default=60, help="Per scenario")
+    parser.add_argument("--output", type=str, help="Save results as JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument(
+        "--threshold", type=float, default=10, help="Percent allowed by --compare"
+    )
+    args = parser.parse_args()
+    args.channels = args.channels or max(1, args.clients // 50)
+    return args
+
+
+def get_process_stats(pid: int):
+    """Return CPU seconds, RSS and peak RSS in KiB of pid and its children
+
+    Returns None if /proc is not available
+    """
+    if pid is None or not os.path.exists(f"/proc/{pid}/stat"):
+        return None
+
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if entry.isdigit() and int(entry) != pid:
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # Fields after the command name: state, ppid, ...
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+
+    stats = {"cpu_seconds": 0.0, "rss_kib": 0, "peak_rss_kib": 0}
+    for process in pids:
+        try:
+            with open(f"/proc/{process}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{process}/status") as f:
+                status = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        # utime and stime are the 14th and 15th field of stat
+        stats["cpu_seconds"] += (int(fields[11]) + int(fields[12])) / os.sysconf(
+            "SC_CLK_TCK"
+        )
+        stats["rss_kib"] += int(status["VmRSS"].split()[0])
+        stats["peak_rss_kib"] += int(status["VmHWM"].split()[0])
+    return stats
+
+
+def summarize(latencies: list, seconds: float, expected: int, before, after):
+    """Return the metrics of a scenario"""
+    latencies.sort()
+    result = {
+        "deliveries": len(latencies),
+        "expected": expected,
+        "seconds": round(seconds, 3),
+        "messages_per_second": round(len(latencies) / seconds),
+    }
+    for name, quantile in PERCENTILES.items():
+        index = min(len(latencies) - 1, int(quantile * len(latencies)))
+        result[f"{name}_ms"] = round(latencies[index] / 1e6, 3) if latencies else None
+    if before is not None and after is not None:
+        result["cpu_seconds"] = round(after["cpu_seconds"] - before["cpu_seconds"], 2)
+        result["rss_kib"] = after["rss_kib"]
+        result["peak_rss_kib"] = after["peak_rss_kib"]
+    return result
+
+
+class LoadClient:
+    """A non-blocking client connection driven by the Runner's selector"""
+
+    def __init__(self, name: str, address: tuple):
+        self.nick = name
+        self.socket = socket.create_connection(address)
+        self.socket.setblocking(False)
+        self.pending = deque()  # Lines to write, TIMESTAMP is filled in on write
+        self.out_buffer = b""
+        self.in_buffer = b""
+        self.sent_at = deque()  # Write time of lines whose echo is awaited
+
+
+class Runner:
+    """Drives every LoadClient from a single selector loop"""
+
+    def __init__(self, args: Namespace, address: tuple, pid: int = None):
+        self._args = args
+        self._pid = pid
+        self._selector = selectors.DefaultSelector()
+        self._clients = []
+        self._observer = None
+        self._chatter_channels = {}  # Key: channel name, Value: list of clients
+        self._on_line = None
+        self._latencies = []
+        self._count = 0  # Setup replies received
+        self._phase_start = 0
+        self._track_echoes = False
+        self._schedule = []
+        self._num_scheduled = 0
+
+        for i in range(args.clients):
+            self._clients.append(self._connect(f"load{i}", address))
+        self._observer = self._connect("observer", address)
+        self._setup(
+            [
+                (client, f"NICK {client.nick}\r\nUSER {client.nick} 0 * :load\r\n")
+                for client in self._clients + [self._observer]
+            ],
+            END_OF_MOTD,
+        )
+
+    def close(self):
+        """Close every connection that is still open"""
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+
+    def _connect(self, name: str, address: tuple) -> LoadClient:
+        client = LoadClient(name, address)
+        self._selector.register(client.socket, selectors.EVENT_READ, client)
+        return client
+
+    def _enqueue(self, client: LoadClient, line: str):
+        if not client.pending and not client.out_buffer:
+            self._selector.modify(
+                client.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, client
+            )
+        client.pending.append(line)
+
+    def _write(self, client: LoadClient):
+        if not client.out_buffer:
+            now = time.perf_counter_ns()
+            batch = [
+                client.pending.popleft()
+                for _ in range(min(WRITE_BATCH, len(client.pending)))
+            ]
+            client.out_buffer = "".join(batch).replace(TIMESTAMP, str(now)).encode()
+            if self._track_echoes:
+                client.sent_at.extend([now] * len(batch))
+
+        sent = client.socket.send(client.out_buffer)
+        client.out_buffer = client.out_buffer[sent:]
+        if not client.pending and not client.out_buffer:
+            self._selector.modify(client.socket, selectors.EVENT_READ, client)
+
+    def _read(self, client: LoadClient):
+        try:
+            data = client.socket.recv(65536)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b""
+        if not data:
+            raise RuntimeError(f"Daemon closed the connection of {client.nick}")
+
+        lines = (client.in_buffer + data).split(b"\r\n")
+        client.in_buffer = lines.pop()
+        now = time.perf_counter_ns()
+        for line in lines:
+            self._on_line(client, line, now)
+
+    def _feed(self):
+        """Enqueue every scheduled line whose time has come"""
+        if self._num_scheduled == len(self._schedule):
+            return
+        due = len(self._schedule)
+        if self._args.rate:
+            elapsed = (time.perf_counter_ns() - self._phase_start) / 1e9
+            due = min(due, int(elapsed * self._args.rate) + 1)
+        for client, line in self._schedule[self._num_scheduled : due]:
+            self._enqueue(client, line)
+        self._num_scheduled = due
+
+    def _pump(self, is_done: callable) -> bool:
+        """Run the loop until is_done returns True or the timeout passed"""
+        deadline = time.monotonic() + self._args.timeout
+        # Wake up in time to feed the next line when sending at --rate
+        timeout = min(0.05, 1 / self._args.rate) if self._args.rate else 0.05
+        while not is_done() and time.monotonic() < deadline:
+            self._feed()
+            for key, event_mask in self._selector.select(timeout=timeout):
+                if event_mask & selectors.EVENT_READ:
+                    self._read(key.data)
+                if event_mask & selectors.EVENT_WRITE:
+                    self._write(key.data)
+        return is_done()
+
+    def _count_marker(self, marker: bytes) -> callable:
+        def on_line(_: LoadClient, line: bytes, __: int):
+            if marker in line:
+                self._count += 1
+
+        return on_line
+
+    def _setup(self, lines: list, marker: bytes):
+        """Send (client, line) pairs and wait until marker was received per line"""
+        self._count = 0
+        self._on_line = self._count_marker(marker)
+        for client, line in lines:
+            self._enqueue(client, line)
+        if not self._pump(lambda: self._count >= len(lines)):
+            raise RuntimeError(f"Timed out waiting for {marker} during setup")
+
+    def _measure(self, schedule: list, on_line: callable, expected: int, start=None):
+        """Run a scenario and return its metrics
+
+        start: Called once the clock started, instead of scheduling lines
+        """
+        self._latencies = []
+        self._on_line = on_line
+        self._schedule, self._num_scheduled = schedule, 0
+        before = get_process_stats(self._pid)
+        self._phase_start = time.perf_counter_ns()
+        if start is not None:
+            start()
+        self._pump(lambda: len(self._latencies) >= expected)
+        seconds = (time.perf_counter_ns() - self._phase_start) / 1e9
+        return summarize(
+            self._latencies, seconds, expected, before, get_process_stats(self._pid)
+        )
+
+    def _on_privmsg(self, _: LoadClient, line: bytes, now: int):
+        index = line.find(b":t=")
+        if index != -1:
+            sent_at = int(line[index + 3 : line.index(b" ", index)])
+            self._latencies.append(now - sent_at)
+
+    def _on_echo(self, client: LoadClient, line: bytes, now: int):
+        if b" JOIN " in line or b" PART " in line:
+            self._latencies.append(now - client.sent_at.popleft())
+
+    def _on_observed_part(self, client: LoadClient, line: bytes, now: int):
+        if client is self._observer and b" PART " in line:
+            self._latencies.append(now - self._phase_start)
+
+    def _join_chatter_channels(self):
+        if self._chatter_channels:
+            return
+        for i, client in enumerate(self._clients):
+            name = f"#chatter{i % self._args.channels}"
+            self._chatter_channels.setdefault(name, []).append(client)
+        self._setup(
+            [
+                (client, f"JOIN {name}\r\n")
+                for name, members in self._chatter_channels.items()
+                for client in members
+            ],
+            END_OF_NAMES,
+        )
+
+    def run_chatter(self) -> dict:
+        self._join_chatter_channels()
+        schedule = []
+        for _ in range(self._args.messages):
+            for name, members in self._chatter_channels.items():
+                for client in members:
+                    line = f"PRIVMSG {name} :t={TIMESTAMP} chat\r\n"
+                    schedule.append((client, line))
+        expected = self._args.messages * sum(
+            len(members) * (len(members) - 1)
+            for members in self._chatter_channels.values()
+        )
+        return self._measure(schedule, self._on_privmsg, expected)
+
+    def run_privmsg(self) -> dict:
+        clients = self._clients
+        schedule = [
+            (client, f"PRIVMSG {target.nick} :t={TIMESTAMP} pm\r\n")
+            for _ in range(self._args.messages)
+            for client, target in zip(clients, clients[1:] + clients[:1])
+        ]
+        return self._measure(schedule, self._on_privmsg, len(schedule))
+
+    def run_joinpart(self) -> dict:
+        schedule = []
+        for _ in range(self._args.messages):
+            for client in self._clients:
+                schedule.append((client, f"JOIN #{client.nick}\r\n"))
+                schedule.append((client, f"PART #{client.nick}\r\n"))
+        self._track_echoes = True
+        try:
+            return self._measure(schedule, self._on_echo, len(schedule))
+        finally:
+            self._track_echoes = False
+
+    def run_disconnect(self) -> dict:
+        self._join_chatter_channels()
+        self._setup(
+            [(self._observer, f"JOIN {name}\r\n") for name in self._chatter_channels],
+            END_OF_NAMES,
+        )
+
+        def disconnect_everyone():
+            for client in self._clients:
+                self._selector.unregister(client.socket)
+                client.socket.close()
+
+        return self._measure(
+            [], self._on_observed_part, len(self._clients), disconnect_everyone
+        )
+
+
+def start_daemon(port: int, daemon_args: list) -> subprocess.Popen:
+    """Start a daemon and wait until it accepts connections"""
+    proc = subprocess.Popen(
+        [sys.executable, DAEMON, "--port", str(port)] + daemon_args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return proc
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Daemon did not start")
+
+
+def run(args: Namespace) -> dict:
+    """Run every requested scenario and return the results"""
+    # Thousands of connections need as many file descriptors, for both sides
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+    proc = None
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+        address = (host, int(port))
+    else:
+        address = ("127.0.0.1", get_free_port())
+        proc = start_daemon(address[1], shlex.split(args.daemon_args))
+
+    results = {
+        "meta": {
+            "clients": args.clients,
+            "channels": args.channels,
+            "messages": args.messages,
+            "rate": args.rate,
+            "daemon_args": None if args.connect else args.daemon_args,
+            "python": platform.python_version(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scenarios": {},
+    }
+    runner = None
+    try:
+        runner = Runner(args, address, proc.pid if proc is not None else None)
+        for scenario in SCENARIOS:
+            if scenario in args.scenarios:
+                result = getattr(runner, f"run_{scenario}")()
+                results["scenarios"][scenario] = result
+                print(f"{scenario:>10}: {json.dumps(result)}")
+    finally:
+        if runner is not None:
+            runner.close()
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    return results
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """Print the change of every metric, return 1 if any of them regressed"""
+    with open(old_path) as f:
+        old_results = json.load(f)
+    with open(new_path) as f:
+        new_results = json.load(f)
+
+    for setting in ("clients", "channels", "messages", "rate"):
+        if old_results["meta"][setting] != new_results["meta"][setting]:
+            print(f"Warning: results were generated with different --{setting}")
+    old, new = old_results["scenarios"], new_results["scenarios"]
+
+    regressions = 0
+    print(f"{'scenario':>10} {'metric':>20} {'old':>12} {'new':>12} {'change':>8}")
+    for scenario in SCENARIOS:
+        if scenario not in old or scenario not in new:
+            continue
+        for metric, is_higher_worse in COMPARED_METRICS.items():
+            old_value, new_value = old[scenario].get(metric), new[scenario].get(metric)
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value * 100
+            is_regression = (change if is_higher_worse else -change) > threshold
+            regressions += is_regression
+            print(
+                f"{scenario:>10} {metric:>20} {old_value:>12} {new_value:>12}"
+                f" {change:>+7.1f}%{'  REGRESSION' if is_regression else ''}"
+            )
+    return 1 if regressions else 0
+
+
+def main() -> None:
+    """Compare earlier results or generate load and print the results"""
+    args = parse_args()
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
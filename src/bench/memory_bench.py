@@ -0,0 +1,131 @@
+"""Measure the memory held per idle connection and per in-flight message
+
+Run from the root of the repo: `poetry run python src/bench/memory_bench.py`
+
+Idle connections: for every backend a daemon is started on a free port and
+`--clients` connections register with NICK/USER, then stay idle. The growth of
+the daemon's RSS divided by the number of connections is reported. RSS is read
+from /proc, so this part is skipped where /proc is not available.
+
+In-flight messages: `--messages` received lines are wrapped in Messages and
+parsed in this process the way Server and Parser do, then kept alive.
+tracemalloc reports the bytes they hold, the received line included.
+"""
+import os
+import resource
+import selectors
+import socket
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from types import SimpleNamespace
+
+from backend_bench import get_free_port
+from load_gen import get_process_stats, start_daemon
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "daemon"))
+
+from message import Message  # noqa: E402
+from parser import Parser  # noqa: E402
+
+END_OF_MOTD = b" 376 "
+LINE = b"PRIVMSG #bench :hello everyone, how is it going today?\r\n"
+SETTLE_SECONDS = 1  # Time given to the daemon to finish its work before reading RSS
+
+
+def parse_args() -> Namespace:
+    """Parse command line arguments"""
+    parser = ArgumentParser("pyircd memory benchmark")
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument(
+        "--backends", nargs="+", default=["selectors", "asyncio"], type=str
+    )
+    return parser.parse_args()
+
+
+def register_clients(port: int, num_clients: int) -> list:
+    """Connect and register num_clients, return their sockets once welcomed"""
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for i in range(num_clients):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(f"NICK idle{i}\r\nUSER idle{i} 0 * :Idle {i}\r\n".encode())
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, data=bytearray())
+        sockets.append(sock)
+
+    num_waiting = num_clients
+    deadline = time.monotonic() + 60
+    while num_waiting and time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=1):
+            received = key.data
+            received += key.fileobj.recv(65536)
+            if END_OF_MOTD in received:
+                selector.unregister(key.fileobj)
+                num_waiting -= 1
+    selector.close()
+    if num_waiting:
+        raise RuntimeError(f"{num_waiting} clients were not welcomed")
+    return sockets
+
+
+def measure_connections(backend: str, num_clients: int):
+    """Return RSS bytes per idle registered connection of a daemon on backend"""
+    port = get_free_port()
+    proc = start_daemon(port, ["--backend", backend, "--flood-rate", "0"])
+    sockets = []
+    try:
+        time.sleep(SETTLE_SECONDS)
+        before = get_process_stats(proc.pid)
+        if before is None:
+            return None
+
+        sockets = register_clients(port, num_clients)
+        time.sleep(SETTLE_SECONDS)
+        after = get_process_stats(proc.pid)
+        return (after["rss_kib"] - before["rss_kib"]) * 1024 / num_clients
+    finally:
+        for sock in sockets:
+            sock.close()
+        proc.terminate()
+        proc.wait()
+
+
+def measure_messages(num_messages: int) -> float:
+    """Return bytes held per received and parsed Message"""
+    parsed = []
+    parser = Parser(parsed.append)
+    key = SimpleNamespace(data=None)
+    address = ("127.0.0.1", 6667)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for _ in range(num_messages):
+        # Server copies every line out of the connection's input buffer
+        parser.dispatch(Message(address, "PARSE", bytes(bytearray(LINE)), key))
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / num_messages
+
+
+def main() -> None:
+    """Run the benchmark"""
+    args = parse_args()
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+    for backend in args.backends:
+        per_connection = measure_connections(backend, args.clients)
+        if per_connection is None:
+            print(f"{backend:>9}: RSS is not available without /proc")
+        else:
+            print(f"{backend:>9}: {per_connection:,.0f} bytes per idle connection")
+
+    per_message = measure_messages(args.messages)
+    print(f"  message: {per_message:,.0f} bytes per in-flight message")
+
+
+if __name__ == "__main__":
+    main()
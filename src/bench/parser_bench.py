@@ -0,0 +1,155 @@
+"""Compare the parser against the implementation it replaced
+
+Run from the root of the repo: `poetry run python src/bench/parser_bench.py`
+
+Every line of the parser test corpus in `src/test/parser_tests`, plus a few
+lines typical of a busy server, is parsed `--rounds` times by both parsers.
+LegacyParser is the str based parser the daemon used before it parsed bytes
+in a single pass, kept here unchanged as the baseline.
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "daemon"))
+
+import constants  # noqa: E402
+from message import Message  # noqa: E402
+from parser import Parser  # noqa: E402
+
+CORPUS = "src/test/parser_tests/parser_tests.yaml"
+TYPICAL_LINES = [
+    "PRIVMSG #bench :hello everyone, how is it going today?",
+    "PING :1234567890",
+    "JOIN #bench",
+    "@time=2023-01-01T00:00:00.000Z :nick!user@host PRIVMSG #a :tagged",
+]
+
+
+def parse_args() -> Namespace:
+    """Parse command line arguments"""
+    parser = ArgumentParser("pyircd parser benchmark")
+    parser.add_argument("--rounds", type=int, default=20000)
+    return parser.parse_args()
+
+
+def load_lines() -> list:
+    """Return every raw line of the corpus and the typical lines"""
+    with open(CORPUS) as f:
+        tests = yaml.safe_load(f)["tests"]
+    lines = [line for test in tests for line in test["message"]] + TYPICAL_LINES
+    return [line.encode() + constants.IRC_TERMINATION_DELIMITER for line in lines]
+
+
+class LegacyParser:
+    """The parser as it was before it was rewritten, without logging"""
+
+    def _parse_parameters(self, parameters: list):
+        """Return a list of parsed parameters.
+        If there are any bad parameters, return None"""
+        for i in range(len(parameters)):
+            for forbidden_sequence in ["\0", "\r", "\n", "::"]:
+                if forbidden_sequence in parameters[i]:
+                    return None
+        return parameters
+
+    def _parse_message(self, message: Message):
+        """Parse message according to IRC spec
+        If parse is successful, forward message to EventBus
+        Otherwise, drop message"""
+
+        # Decode message
+        try:
+            message_str = message.message.decode("utf-8")
+        except UnicodeDecodeError:
+            return
+
+        # Remove EOL delimiter
+        delimiter_length = len(constants.IRC_TERMINATION_DELIMITER)
+        stripped_message = message_str[:-delimiter_length].lstrip()
+
+        # Accept messages that exceed MAX_LINE_LENGTH, but slice them
+        # https://modern.ircdocs.horse/#compatibility-with-incorrect-software
+        if len(stripped_message) > constants.MAX_LINE_LENGTH - delimiter_length:
+            stripped_message = stripped_message[
+                : constants.MAX_LINE_LENGTH - delimiter_length
+            ]
+
+        # Find colon in message, if exists
+        aggregated_param = None
+        colon_index = stripped_message.find(":")
+        if colon_index > -1 and colon_index < len(stripped_message):
+            aggregated_param = self._parse_parameters(
+                [stripped_message[colon_index + 1 :]]
+            )
+            if aggregated_param is None:
+                return
+            stripped_message = stripped_message[:colon_index].rstrip()
+
+        # Split message by space
+        split_message = stripped_message.split(" ")
+
+        # Inspect contents (assume no tags and source for now)
+        if len(split_message) < 1 and aggregated_param is None:
+            return
+
+        command = split_message[0].upper()
+        parameters = self._parse_parameters(split_message[1:])
+        for param in parameters:
+            if param == "":
+                parameters.remove(param)
+        if aggregated_param is not None:
+            parameters.append(aggregated_param[0])
+
+        if (command not in constants.VALID_ALPHA_COMMANDS) or parameters is None:
+            return
+
+        # Return parsed message
+        parsed_message = Message(
+            message.client_address,
+            "HANDLE",
+            message.message,
+            message.key,
+            command,
+            parameters,
+        )
+
+        return parsed_message
+
+
+def run(parse: callable, lines: list, rounds: int) -> float:
+    """Return the seconds taken to parse every line rounds times
+
+    The current parser fills in the Message it is given, so the same messages
+    can be parsed again in every round
+    """
+    messages = [Message("localhost", "PARSE", line, None) for line in lines]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            parse(message)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Run both parsers and print their throughput"""
+    args = parse_args()
+    lines = load_lines()
+    parsers = {
+        "legacy": LegacyParser()._parse_message,
+        "current": Parser(lambda message: None)._parse_message,
+    }
+
+    num_lines = len(lines) * args.rounds
+    print(f"{len(lines)} lines x {args.rounds} rounds")
+    results = {name: run(parse, lines, args.rounds) for name, parse in parsers.items()}
+    for name, elapsed in results.items():
+        print(f"{name:>8}: {elapsed:.3f}s, {num_lines / elapsed:,.0f} lines/s")
+    print(f"speedup: {results['legacy'] / results['current']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
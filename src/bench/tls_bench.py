@@ -0,0 +1,153 @@
+"""Compare the cost of plaintext, full TLS and resumed TLS connections
+
+Run from the root of the repo:
+
+    poetry run python src/bench/tls_bench.py --connections 500
+
+A self-signed certificate with an RSA key, or a P-256 key with `--key ec`, is
+generated with the openssl command line tool and a daemon is started with a
+plaintext and a TLS listener. For every mode
+`--connections` clients connect one after the other, register and disconnect
+once they were welcomed. Reported are connections per second, p50/p99 latency
+from connect until the welcome and the daemon CPU time per connection. Resumed
+connections present the session ticket of the connection before them.
+"""
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+
+from backend_bench import get_free_port
+from load_gen import PERCENTILES, get_process_stats, start_daemon
+
+WELCOME = b" 001 "
+MODES = ["plaintext", "tls", "tls-resumed"]
+KEY_OPTIONS = {
+    "rsa": ["-newkey", "rsa:2048"],
+    "ec": ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"],
+}
+
+
+def parse_args() -> Namespace:
+    """Parse command line arguments"""
+    parser = ArgumentParser("pyircd TLS benchmark")
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--backend", type=str, default="selectors")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--key", choices=KEY_OPTIONS, default="rsa")
+    return parser.parse_args()
+
+
+def create_certificate(directory: str, key: str) -> str:
+    """Write a self-signed certificate and its key to one file, return its path"""
+    path = os.path.join(directory, "bench.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509"]
+        + KEY_OPTIONS[key]
+        + [
+            "-nodes",
+            "-subj",
+            "/CN=localhost",
+            "-days",
+            "1",
+            "-keyout",
+            path,
+            "-out",
+            path + ".crt",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    with open(path + ".crt") as f:
+        certificate = f.read()
+    with open(path, "a") as f:
+        f.write(certificate)
+    return path
+
+
+def connect(port: int, number: int, context=None, session=None):
+    """Register a client and wait for the welcome, return the TLS session"""
+    sock = socket.create_connection(("127.0.0.1", port))
+    if context is not None:
+        sock = context.wrap_socket(sock, server_hostname="localhost", session=session)
+    with sock:
+        sock.sendall(f"NICK t{number}\r\nUSER t{number} 0 * :bench\r\n".encode())
+        received = b""
+        while WELCOME not in received:
+            data = sock.recv(65536)
+            if not data:
+                raise RuntimeError("Daemon closed the connection")
+            received += data
+        return sock.session if context is not None else None
+
+
+def measure(mode: str, port: int, num_connections: int, context, pid: int) -> dict:
+    """Return connection rate, latency and daemon CPU time of mode"""
+    session = None
+    if mode == "tls-resumed":
+        # The first connection receives the ticket the next one resumes with
+        session = connect(port, 0, context)
+
+    latencies = []
+    before = get_process_stats(pid)
+    started_at = time.perf_counter()
+    for number in range(num_connections):
+        connected_at = time.perf_counter()
+        if mode == "plaintext":
+            connect(port, number)
+        elif mode == "tls":
+            connect(port, number, context)
+        else:
+            session = connect(port, number, context, session)
+        latencies.append(time.perf_counter() - connected_at)
+    seconds = time.perf_counter() - started_at
+    after = get_process_stats(pid)
+
+    latencies.sort()
+    result = {"connections_per_second": round(num_connections / seconds)}
+    for name, quantile in PERCENTILES.items():
+        index = min(len(latencies) - 1, int(quantile * len(latencies)))
+        result[f"{name}_ms"] = round(latencies[index] * 1000, 3)
+    if before is not None:
+        cpu_seconds = after["cpu_seconds"] - before["cpu_seconds"]
+        result["daemon_cpu_ms"] = round(cpu_seconds * 1000 / num_connections, 3)
+    return result
+
+
+def main() -> None:
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        certificate = create_certificate(directory, args.key)
+        context = ssl.create_default_context(cafile=certificate)
+
+        port, tls_port = get_free_port(), get_free_port()
+        proc = start_daemon(
+            port,
+            [
+                "--backend",
+                args.backend,
+                "--flood-rate",
+                "0",
+                "--listen",
+                f"127.0.0.1:{port}",
+                "--listen",
+                f"127.0.0.1:{tls_port},tls",
+                "--tls-cert",
+                certificate,
+            ],
+        )
+        try:
+            for mode in args.modes:
+                mode_port = port if mode == "plaintext" else tls_port
+                result = measure(mode, mode_port, args.connections, context, proc.pid)
+                print(f"{mode:>11}: {result}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
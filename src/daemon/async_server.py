@@ -0,0 +1,319 @@
+"""Asyncio server module, an alternative transport to the selectors based Server"""
+import asyncio
+import logging
+import socket
+
+import config
+import constants
+from connection import Connection, TransportKey
+from listener import Listener
+from message import Message
+from metrics import Metrics
+
+
+class IrcProtocol(asyncio.Protocol):
+    """Protocol instance created by the event loop for every client connection
+
+    It mirrors the per connection state kept by Server so that Client can write
+    to out_queue and mark it dirty without knowing which backend is in use.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    __slots__ = (
+        "_dispatch",
+        "_mark_dirty",
+        "_close_connection",
+        "_schedule_tick",
+        "_listener",
+        "_transport",
+        "_key",
+    )
+
+    def __init__(
+        self,
+        dispatch: callable,
+        mark_dirty: callable,
+        close_connection: callable,
+        schedule_tick: callable,
+        listener: Listener,
+    ):
+        self._dispatch = dispatch
+        self._mark_dirty = mark_dirty
+        self._close_connection = close_connection
+        self._schedule_tick = schedule_tick
+        self._listener = listener
+        self._transport = None
+        self._key = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        """Create connection state once the client has connected"""
+        self._transport = transport
+        address = self._listener.get_client_address(
+            transport.get_extra_info("peername")
+        )
+
+        self._logger.info(f"Accepted connection from {address}")
+
+        # The event loop completed the TLS handshake before, without timing it
+        ssl_object = transport.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            Metrics.observe_tls_handshake(None, ssl_object.session_reused)
+
+        # Message expects a key with a data attribute, same as a SelectorKey
+        self._key = TransportKey(
+            transport, Connection(address, self._mark_dirty, self._close_connection)
+        )
+        self._dispatch(
+            Message(
+                address,
+                constants.SERVER_EVENTS.CONNECT,
+                b"",
+                self._key,
+                command=constants.SERVER_EVENTS.CONNECT,
+            )
+        )
+        self._schedule_tick()
+
+    def data_received(self, data: bytes):
+        """Buffer data and dispatch every IRC delimited message to the parser"""
+        key = self._key
+        self._logger.debug(
+            "Received the following data from %s: %r", key.data.address, data
+        )
+
+        key.data.in_buffer.extend(data)
+        Metrics.num_bytes_received += len(data)
+        self._schedule_tick()
+        for message in key.data.in_buffer.lines():
+            self._dispatch(Message(key.data.address, "PARSE", message, key))
+            if key.data.unregister_socket:
+                return
+
+        if key.data.in_buffer.is_overflowing():
+            self._logger.info(f"Input buffer of {key.data.address} overflowed, closing")
+            self._transport.close()
+
+    def pause_writing(self):
+        """Transport buffer is full, keep output in out_queue"""
+        self._key.data.is_waiting_for_write = True
+
+    def resume_writing(self):
+        """Transport buffer drained, flush out_queue again"""
+        key = self._key
+        key.data.is_waiting_for_write = False
+        if (key.data.out_queue or key.data.refill) and not key.data.is_dirty:
+            key.data.mark_dirty(key)
+
+    def connection_lost(self, exc: Exception):
+        """Signal a disconnect unless the client already quit"""
+        self._logger.info(f"Closing connection to {self._key.data.address}")
+        self._dispatch_on_disconnect(constants.DEFAULT_DISCONNECT_REASON)
+
+    def close_connection(self, reason: str):
+        """Signal a disconnect with reason and drop the connection"""
+        self._dispatch_on_disconnect(reason)
+        self._transport.abort()
+
+    def _dispatch_on_disconnect(self, reason: str):
+        """Signal a disconnect unless the client already quit or disconnected"""
+        key = self._key
+        if key.data.unregister_socket:
+            return
+
+        key.data.unregister_socket = True
+        message = Message(
+            key.data.address,
+            constants.SERVER_EVENTS.DISCONNECT,
+            b"",
+            key,
+            command=constants.SERVER_EVENTS.DISCONNECT,
+            parameters=[reason],
+        )
+        self._dispatch(message)
+
+
+class AsyncServer:
+    """Server backed by asyncio Protocols and Transports
+
+    Received messages are dispatched exactly like Server does, so the parser,
+    message bus and client handlers are shared between both backends.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        dispatch: callable,
+        reuse_port: bool = False,
+        readers: list = (),
+        tick: callable = None,
+        listeners: list = None,
+    ) -> None:
+        """Start the server
+
+        reuse_port: Share the port with other workers through SO_REUSEPORT
+        readers: Objects with fileno() and handle_readable() to serve alongside
+            clients, like the BrokerLink in worker mode. The server stops if
+            handle_readable raises ConnectionError
+        tick: Called after data was received, returns seconds until it must be
+            called again or None to wait for more data
+        listeners: Listeners to accept clients on instead of host and port.
+            asyncio accepts as many clients per wakeup as their backlog
+        """
+        self._host = host
+        self._port = port
+        self._reuse_port = reuse_port
+        self._listeners = listeners or [Listener(socket.AF_INET, (host, port))]
+        self._readers = readers
+        self._tick = tick
+        self._tick_handle = None
+        self._is_tick_scheduled = False
+        self._logger = logging.getLogger(__name__)
+        self._dispatch = dispatch
+        self._stopped = None
+        # Keys of connections that queued output during this loop iteration
+        self._dirty_keys = []
+        self._start_server()
+
+    def _mark_dirty(self, key: TransportKey):
+        """Flush out_queue of key once the current loop iteration is done
+
+        Shared by every connection, Client calls it through key.data.mark_dirty
+        """
+        if not self._dirty_keys:
+            asyncio.get_running_loop().call_soon(self._flush_dirty_connections)
+        key.data.is_dirty = True
+        self._dirty_keys.append(key)
+
+    def _flush_dirty_connections(self):
+        """Hand queued output to the transports, which write it when possible
+
+        While a transport's buffer is full output stays in out_queue, which is
+        subject to the same SendQ limits as in Server.
+        """
+        # The loop itself is not instrumented, count the iterations that flush
+        Metrics.num_wakeups += 1
+        dirty_keys, self._dirty_keys = self._dirty_keys, []
+        for key in dirty_keys:
+            key.data.is_dirty = False
+            transport, out_queue = key.fileobj, key.data.out_queue
+            if transport.is_closing():
+                continue
+
+            if not key.data.is_waiting_for_write:
+                self._logger.debug("Sending %d bytes", len(out_queue))
+                Metrics.num_bytes_sent += len(out_queue)
+                transport.writelines(out_queue.drain())
+                # What the refill queues is flushed in the next loop iteration
+                if key.data.refill is not None and not key.data.is_waiting_for_write:
+                    key.data.refill()
+
+            if len(out_queue) > config.SENDQ_HIGH_WATERMARK:
+                self._logger.info(
+                    f"{constants.SENDQ_EXCEEDED} by {key.data.address}, closing"
+                )
+                transport.get_protocol().close_connection(constants.SENDQ_EXCEEDED)
+                continue
+
+            if not out_queue and key.data.unregister_socket:
+                # close() flushes whatever the transport still has buffered
+                transport.close()
+                continue
+
+            # Stop reading from a client that does not read what it is sent
+            if len(out_queue) > config.SENDQ_LOW_WATERMARK:
+                transport.pause_reading()
+            elif not transport.is_reading():
+                transport.resume_reading()
+
+    def _close_connection(self, key: TransportKey, reason: str):
+        """Close the connection of key, its channels are told reason
+
+        Shared by every connection, called through key.data.close_connection
+        """
+        key.fileobj.get_protocol().close_connection(reason)
+
+    def _schedule_tick(self):
+        """Run tick once the current loop iteration is done"""
+        if self._tick is None or self._is_tick_scheduled:
+            return
+
+        self._is_tick_scheduled = True
+        if self._tick_handle is not None:
+            self._tick_handle.cancel()
+        self._tick_handle = asyncio.get_running_loop().call_soon(self._run_tick)
+
+    def _run_tick(self):
+        """Run tick and schedule it again after the delay it asks for"""
+        self._is_tick_scheduled = False
+        self._tick_handle = None
+        delay = self._tick()
+        if delay is not None:
+            self._tick_handle = asyncio.get_running_loop().call_later(
+                delay, self._run_tick
+            )
+
+    def _start_server(self):
+        """Run the asyncio event loop until the server is stopped"""
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            self._logger.info("Shutting down")
+
+    async def _serve(self):
+        """Listen for connections and serve them until stopped"""
+        loop = asyncio.get_running_loop()
+        self._stopped = loop.create_future()
+        # Bound once, so protocols share them instead of holding bound methods each
+        protocol_arguments = (
+            self._dispatch,
+            self._mark_dirty,
+            self._close_connection,
+            self._schedule_tick,
+        )
+        servers = []
+        for listener in self._listeners:
+            if listener.socket is None:
+                listener.listen(self._reuse_port)
+            create_server = (
+                loop.create_unix_server
+                if listener.family == socket.AF_UNIX
+                else loop.create_server
+            )
+            tls_arguments = {}
+            if listener.tls is not None:
+                tls_arguments = {
+                    "ssl": listener.tls.context,
+                    "ssl_handshake_timeout": constants.TLS_HANDSHAKE_TIMEOUT,
+                }
+            servers.append(
+                await create_server(
+                    lambda listener=listener: IrcProtocol(
+                        *protocol_arguments, listener
+                    ),
+                    sock=listener.socket,
+                    backlog=listener.backlog,
+                    **tls_arguments,
+                )
+            )
+            self._logger.info(f"Listening on {listener}")
+
+        for reader in self._readers:
+            loop.add_reader(reader.fileno(), self._handle_reader, reader)
+
+        try:
+            await self._stopped
+        finally:
+            for server in servers:
+                server.close()
+                await server.wait_closed()
+
+    def _handle_reader(self, reader):
+        """Let reader handle its data, stop serving if it lost its connection"""
+        try:
+            reader.handle_readable()
+        except ConnectionError as e:
+            self._logger.info(f"Stopping server: {e}")
+            asyncio.get_running_loop().remove_reader(reader.fileno())
+            self._stopped.set_result(None)
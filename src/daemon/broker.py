@@ -0,0 +1,291 @@
+"""This module shares state between worker processes in multi-process mode
+
+Every worker accepts its own clients and keeps its own Client.clients and
+Client.channels. The Broker is the only process that knows about every worker.
+It keeps nicks unique across workers, relays channel broadcasts to the workers
+that have members in the channel and routes private messages to the worker
+that owns the target nick.
+
+Workers and broker exchange newline delimited JSON objects over a Unix socket.
+"""
+import json
+import logging
+import selectors
+import socket
+from types import SimpleNamespace
+
+import utils
+from buffers import OutputQueue
+from client import Client
+
+BROKER_DELIMITER = b"\n"
+RECEIVE_LENGTH = 65536
+
+
+def encode(**fields) -> bytes:
+    """Serialize a broker message"""
+    return json.dumps(fields).encode() + BROKER_DELIMITER
+
+
+def decode(in_buffer: bytes):
+    """Return (list of decoded messages, unconsumed remainder of in_buffer)"""
+    *lines, remainder = in_buffer.split(BROKER_DELIMITER)
+    return [json.loads(line) for line in lines], remainder
+
+
+class Broker:
+    """Holds state shared by every worker and relays messages between them
+
+    Workers are identified by the file descriptor of their connection.
+    The broker never blocks on a worker, writes are buffered until the
+    worker's socket is writable.
+
+    Only nick claims, channel broadcasts and private messages pass the broker.
+    Channel topics, channel membership and client counts stay in the worker
+    that holds them: a client that joins a channel on one worker receives the
+    messages of members on other workers, but does not see a topic set on
+    another worker, and NAMES, WHO, LIST and LUSERS leave out clients of other
+    workers.
+    """
+
+    def __init__(self, path: str):
+        """Listen on a Unix socket at path"""
+        self._logger = logging.getLogger(__name__)
+        self._selector = selectors.DefaultSelector()
+        self._nicks = {}  # Key: casefolded nick, Value: (worker, address)
+        self._owners = {}  # Key: (worker, address), Value: nick
+        self._channels = {}  # Key: channel_name, Value: set of workers
+        self._workers = {}  # Key: worker, Value: connection state
+        self._handlers = {
+            "claim": self._handle_claim,
+            "release": self._handle_release,
+            "subscribe": self._handle_subscribe,
+            "unsubscribe": self._handle_unsubscribe,
+            "publish": self._handle_publish,
+            "route": self._handle_route,
+        }
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ)
+
+    def close(self):
+        """Release the broker's sockets, used by workers after fork"""
+        self._selector.close()
+        self._listener.close()
+
+    def serve_forever(self):
+        """Accept workers and handle their messages"""
+        self._logger.info(f"Broker listening on {self._listener.getsockname()}")
+        while True:
+            for key, event_mask in self._selector.select(timeout=None):
+                if key.fileobj is self._listener:
+                    self._accept_worker()
+                    continue
+                if event_mask & selectors.EVENT_READ:
+                    self._receive(key.data)
+                if event_mask & selectors.EVENT_WRITE and key.data.id in self._workers:
+                    self._flush(key.data)
+
+    def _accept_worker(self):
+        """Register a newly connected worker"""
+        connection, _ = self._listener.accept()
+        connection.setblocking(False)
+        worker = SimpleNamespace(
+            id=connection.fileno(),
+            socket=connection,
+            in_buffer=b"",
+            out_queue=OutputQueue(),
+        )
+        self._workers[worker.id] = worker
+        self._selector.register(connection, selectors.EVENT_READ, data=worker)
+        self._logger.info(f"Worker {worker.id} connected")
+
+    def _receive(self, worker: SimpleNamespace):
+        """Read from a worker and handle every complete message"""
+        try:
+            received_data = worker.socket.recv(RECEIVE_LENGTH)
+        except ConnectionError:
+            received_data = b""
+
+        if not received_data:
+            self._drop_worker(worker)
+            return
+
+        messages, worker.in_buffer = decode(worker.in_buffer + received_data)
+        for message in messages:
+            self._handlers[message.pop("op")](worker.id, **message)
+
+    def _send(self, worker_id: int, **fields):
+        """Queue a message for a worker and wait for write readiness"""
+        worker = self._workers.get(worker_id)
+        if worker is None:
+            return
+        if not worker.out_queue:
+            self._selector.modify(
+                worker.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, worker
+            )
+        worker.out_queue.append(encode(**fields))
+
+    def _flush(self, worker: SimpleNamespace):
+        """Write as much of a worker's out_queue as the socket accepts"""
+        try:
+            worker.out_queue.send(worker.socket)
+        except ConnectionError:
+            self._drop_worker(worker)
+            return
+
+        if not worker.out_queue:
+            self._selector.modify(worker.socket, selectors.EVENT_READ, worker)
+
+    def _drop_worker(self, worker: SimpleNamespace):
+        """Forget a worker and everything it owned"""
+        self._logger.info(f"Worker {worker.id} disconnected")
+        for owner in [owner for owner in self._owners if owner[0] == worker.id]:
+            self._nicks.pop(self._owners.pop(owner))
+        for workers in self._channels.values():
+            workers.discard(worker.id)
+        self._workers.pop(worker.id)
+        self._selector.unregister(worker.socket)
+        worker.socket.close()
+
+    def _handle_claim(self, worker_id: int, address: list, nick: str):
+        """Grant nick to a client unless another client already holds it"""
+        owner = (worker_id, tuple(address))
+        nick_key = utils.irc_lower(nick)
+        holder = self._nicks.get(nick_key)
+        is_granted = holder is None or holder == owner
+
+        if is_granted:
+            self._handle_release(worker_id, address)
+            self._nicks[nick_key] = owner
+            self._owners[owner] = nick_key
+
+        self._send(worker_id, op="claimed", address=address, nick=nick, ok=is_granted)
+
+    def _handle_release(self, worker_id: int, address: list):
+        """Release the nick held by a client"""
+        nick = self._owners.pop((worker_id, tuple(address)), None)
+        if nick is not None:
+            self._nicks.pop(nick)
+
+    def _handle_subscribe(self, worker_id: int, channel: str):
+        """Worker has local members in channel"""
+        self._channels.setdefault(channel, set()).add(worker_id)
+
+    def _handle_unsubscribe(self, worker_id: int, channel: str):
+        """Worker has no local members left in channel"""
+        workers = self._channels.get(channel, set())
+        workers.discard(worker_id)
+        if not workers:
+            self._channels.pop(channel, None)
+
+    def _handle_publish(self, worker_id: int, channel: str, line: str, command: str):
+        """Relay a channel broadcast to every other worker in the channel"""
+        for subscriber in self._channels.get(channel, ()):
+            if subscriber != worker_id:
+                self._send(
+                    subscriber,
+                    op="channel",
+                    channel=channel,
+                    line=line,
+                    command=command,
+                )
+
+    def _handle_route(self, worker_id: int, sender: str, target: str, fields: dict):
+        """Route a private message to the worker that owns the target nick"""
+        holder = self._nicks.get(utils.irc_lower(target))
+        if holder is None:
+            self._send(worker_id, op="nosuchnick", sender=sender, target=target)
+            return
+        self._send(holder[0], op="deliver", target=target, fields=fields)
+
+
+class BrokerLink:
+    """A worker's connection to the Broker
+
+    Messages to the broker are written with a blocking sendall, the broker
+    always reads them promptly. Messages from the broker are handled by
+    handle_readable, which the server calls when the link is readable.
+    """
+
+    def __init__(self, path: str):
+        """Connect to the broker listening at path"""
+        self._logger = logging.getLogger(__name__)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._in_buffer = b""
+        self._handlers = {
+            "claimed": self._handle_claimed,
+            "channel": self._handle_channel,
+            "deliver": self._handle_deliver,
+            "nosuchnick": self._handle_no_such_nick,
+        }
+
+    def fileno(self) -> int:
+        """Return file descriptor so the link can be registered with a selector"""
+        return self._socket.fileno()
+
+    def _send(self, **fields):
+        self._socket.sendall(encode(**fields))
+
+    def claim(self, address: tuple, nick: str):
+        """Ask the broker for nick, answered by Client.complete_nick_change"""
+        self._send(op="claim", address=address, nick=nick)
+
+    def release(self, address: tuple):
+        """Release the nick held by the client at address"""
+        self._send(op="release", address=address)
+
+    def subscribe(self, channel_name: str):
+        """Receive broadcasts to channel_name from other workers"""
+        self._send(op="subscribe", channel=channel_name)
+
+    def unsubscribe(self, channel_name: str):
+        """Stop receiving broadcasts to channel_name"""
+        self._send(op="unsubscribe", channel=channel_name)
+
+    def publish(self, channel_name: str, line: bytes, command: str):
+        """Relay an encoded channel broadcast and its command to the other
+        workers
+        """
+        self._send(
+            op="publish", channel=channel_name, line=line.decode(), command=command
+        )
+
+    def route(self, sender: str, target: str, fields: dict):
+        """Deliver a message to a nick connected to another worker"""
+        self._send(op="route", sender=sender, target=target, fields=fields)
+
+    def handle_readable(self):
+        """Handle messages from the broker, raise if the broker went away"""
+        received_data = self._socket.recv(RECEIVE_LENGTH)
+        if not received_data:
+            raise ConnectionError("Lost connection to broker")
+
+        messages, self._in_buffer = decode(self._in_buffer + received_data)
+        for message in messages:
+            self._logger.debug(message)
+            self._handlers[message.pop("op")](**message)
+
+    def _handle_claimed(self, address: list, nick: str, ok: bool):
+        client = Client.clients.get(tuple(address))
+        if client is not None:
+            client.complete_nick_change(nick, ok)
+
+    def _handle_channel(self, channel: str, line: str, command: str):
+        target_channel = Client.channels.get(channel)
+        if target_channel is not None:
+            target_channel.send_to_members(line.encode(), command=command)
+
+    def _handle_deliver(self, target: str, fields: dict):
+        client = Client.get_client(target)
+        if client is not None:
+            client.send_message(**fields)
+
+    def _handle_no_such_nick(self, sender: str, target: str):
+        client = Client.get_client(sender)
+        if client is not None:
+            client.send_no_such_nick(target)
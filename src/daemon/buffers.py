@@ -0,0 +1,202 @@
+"""This module holds the buffers used by the server to frame connection data"""
+import os
+import socket
+import ssl
+from collections import deque
+from itertools import islice
+
+import constants
+
+# Most buffers a single sendmsg call accepts
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+
+
+class InputBuffer:
+    """Receive buffer of a connection that splits data into IRC delimited lines
+
+    Received data is appended to a bytearray. The delimiter scan resumes where
+    the previous scan stopped instead of searching from the start again, and
+    consumed lines are only compacted away once they make up most of the buffer.
+    """
+
+    __slots__ = (
+        "_buffer",
+        "_start",
+        "_scan",
+        "_limit",
+        "num_bytes_received",
+        "num_lines_received",
+    )
+
+    def __init__(self, limit: int = constants.MAX_IN_BUFFER_LENGTH):
+        """limit: Maximum number of unterminated bytes the buffer may hold"""
+        self._buffer = bytearray()
+        self._start = 0  # Index of the first byte that was not yet consumed
+        self._scan = 0  # Index from which to resume searching for a delimiter
+        self._limit = limit
+        self.num_bytes_received = 0
+        self.num_lines_received = 0
+
+    def __len__(self) -> int:
+        """Return number of buffered bytes that were not yet consumed"""
+        return len(self._buffer) - self._start
+
+    def extend(self, data) -> None:
+        """Append received bytes, data may be a bytes-like object or memoryview"""
+        self._compact()
+        self._buffer += data
+        self.num_bytes_received += len(data)
+
+    def lines(self):
+        """Generator to retrieve all IRC delimited lines from the buffer"""
+        buffer = self._buffer
+        while (
+            delimiter_position := buffer.find(
+                constants.IRC_TERMINATION_DELIMITER, self._scan
+            )
+        ) != constants.NOT_FOUND:
+            end = delimiter_position + constants.DELIMITER_END_OFFSET
+            line = bytes(buffer[self._start : end])
+            self._start = self._scan = end
+            self.num_lines_received += 1
+            yield line
+
+        # The last byte may be the \r of a delimiter that is still incomplete
+        self._scan = max(self._start, len(buffer) - 1)
+
+    def get_unconsumed(self) -> bytes:
+        """Return buffered bytes that were not yet consumed, leaving them buffered"""
+        return bytes(self._buffer[self._start :])
+
+    def is_overflowing(self) -> bool:
+        """Return True if more unterminated data is buffered than allowed"""
+        return len(self) > self._limit
+
+    def _compact(self):
+        """Drop consumed bytes once they make up at least half of the buffer"""
+        if self._start == 0 or self._start < len(self._buffer) // 2:
+            return
+
+        del self._buffer[: self._start]
+        self._scan -= self._start
+        self._start = 0
+
+
+class OutputQueue:
+    """Send queue of a connection holding chunks of bytes that are ready to send
+
+    Chunks are written with sendmsg in batches of up to IOV_MAX chunks. A partial
+    write advances an offset into the first chunk instead of copying its rest.
+    TLS connections cannot sendmsg, they are sent joined chunks instead.
+    """
+
+    __slots__ = (
+        "_chunks",
+        "_offset",
+        "_size",
+        "_retry_length",
+        "num_bytes_sent",
+        "num_chunks_sent",
+    )
+
+    def __init__(self):
+        self._chunks = deque()
+        self._offset = 0  # Bytes of the first chunk that were already sent
+        self._size = 0  # Queued bytes that were not yet sent
+        self._retry_length = 0  # Bytes of a TLS write that would have blocked
+        self.num_bytes_sent = 0
+        self.num_chunks_sent = 0
+
+    def __len__(self) -> int:
+        """Return number of queued bytes that were not yet sent"""
+        return self._size
+
+    def append(self, chunk: bytes) -> None:
+        """Queue chunk to be sent after every chunk queued before it"""
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+
+    def send(self, connection: socket.socket) -> int:
+        """Send as much as connection accepts without blocking
+
+        Return number of bytes sent, raises ConnectionError like socket.send
+        """
+        if isinstance(connection, ssl.SSLSocket):
+            return self._send_records(connection)
+
+        num_bytes_sent = 0
+        while self._chunks:
+            batch = list(islice(self._chunks, IOV_MAX))
+            if self._offset:
+                batch[0] = memoryview(batch[0])[self._offset :]
+
+            try:
+                num_bytes_sent_in_batch = connection.sendmsg(batch)
+            except BlockingIOError:
+                break
+
+            num_bytes_sent += num_bytes_sent_in_batch
+            self._consume(num_bytes_sent_in_batch)
+
+            # Socket buffer is full, wait for the next write readiness
+            if num_bytes_sent_in_batch < sum(map(len, batch)):
+                break
+
+        return num_bytes_sent
+
+    def _send_records(self, connection: ssl.SSLSocket) -> int:
+        """Send like send, in writes of up to TLS_WRITE_LENGTH joined bytes
+
+        A TLS write that would block must be retried with the same bytes, the
+        queue keeps them at its front until then
+        """
+        num_bytes_sent = 0
+        while self._chunks:
+            length = self._retry_length or min(self._size, constants.TLS_WRITE_LENGTH)
+            data = bytearray()
+            offset = self._offset
+            for chunk in self._chunks:
+                data += memoryview(chunk)[offset : offset + length - len(data)]
+                offset = 0
+                if len(data) == length:
+                    break
+
+            try:
+                num_bytes_sent_in_write = connection.send(data)
+            except (ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                self._retry_length = length
+                break
+            except ssl.SSLError as e:
+                raise ConnectionError(e) from e
+
+            self._retry_length = 0
+            num_bytes_sent += num_bytes_sent_in_write
+            self._consume(num_bytes_sent_in_write)
+
+        return num_bytes_sent
+
+    def get_unsent(self) -> bytes:
+        """Return queued bytes that were not yet sent, leaving them queued"""
+        return b"".join(self._chunks)[self._offset :]
+
+    def drain(self) -> list:
+        """Remove and return every chunk that was not yet sent"""
+        chunks = list(self._chunks)
+        if self._offset:
+            chunks[0] = memoryview(chunks[0])[self._offset :]
+        self.num_bytes_sent += self._size
+        self.num_chunks_sent += len(chunks)
+        self._chunks.clear()
+        self._offset = self._size = 0
+        return chunks
+
+    def _consume(self, num_bytes: int):
+        """Drop num_bytes from the front of the queue"""
+        self._size -= num_bytes
+        self.num_bytes_sent += num_bytes
+        num_bytes += self._offset
+        chunks = self._chunks
+        while chunks and num_bytes >= len(chunks[0]):
+            num_bytes -= len(chunks.popleft())
+            self.num_chunks_sent += 1
+        self._offset = num_bytes
@@ -1,50 +1,104 @@
+import config
 import constants
+import utils
 
 
 class Channel:
     def __init__(self, channel_name):
         self._channel_name = channel_name
         self._channel_topic = ""
-        self._client_nicks = {}  # Key = <Address>, Value = nickname
-        self._clients = {}  # Key = <Address>, Value = send_message_callback
+        self._members = {}  # Key = <Address>, Value = Client
         # <Address> = ("client_address", "client_port")
+        # Members connected to linked servers, Key: address, Value: RemoteUser
+        self._remote_members = {}
+        # ChannelIndex holding the channel, told when the member count changes
+        self.index = None
+
+    def register(self, client) -> bool:
+        """Registers a client, returns False if it was already on the channel
 
-    def register(self, address: tuple, send_msg: callable, nickname: str):
-        """Registers a client and returns the following:
-            - broadcast method
-            - channel topic
-            - topic reply code
-            - list of clients currently in channel
         Reasoning: https://modern.ircdocs.horse/#join-message
         """
+        if client.address in self._members:
+            return False
 
-        broadcast = self.get_broadcast(address)
-
-        if address not in self._clients:
-            self._clients[address] = send_msg
-            self._client_nicks[address] = nickname
+        if not self._members and config.BROKER_LINK is not None:
+            config.BROKER_LINK.subscribe(self._channel_name.lower())
+        self._members[client.address] = client
+        self._resized(-1)
 
-        else:  # Client already on channel, return None
-            return None
+        return True
 
-        return broadcast
+    def has_member(self, address: tuple) -> bool:
+        """Return True if the local or remote client at address is on the
+        channel
+        """
+        return address in self._members or address in self._remote_members
 
     def unregister(self, address: tuple):
         """Unregister a client from the channel"""
-        if address in self._clients:
-            self._clients.pop(address)
-            self._client_nicks.pop(address)
-
-    def get_broadcast(self, address: tuple):
-        """Returns a callable for the client to broadcast
-        a message to all clients on the channel but themselves"""
+        if address in self._members:
+            self._members.pop(address)
+            self._resized(1)
+            if not self._members and config.BROKER_LINK is not None:
+                config.BROKER_LINK.unsubscribe(self._channel_name.lower())
+
+    def add_remote_member(self, user):
+        """Add a RemoteUser, returns False if it was already on the channel"""
+        if user.address in self._remote_members:
+            return False
+        self._remote_members[user.address] = user
+        self._resized(-1)
+        return True
+
+    def remove_remote_member(self, address: tuple):
+        """Remove a RemoteUser from the channel"""
+        if self._remote_members.pop(address, None) is not None:
+            self._resized(1)
+
+    def _resized(self, change: int):
+        """Tell the index that the member count changed, by -change"""
+        if self.index is not None:
+            self.index.resize(self, self.get_member_count() + change)
+
+    def get_remote_members(self):
+        """Get the RemoteUsers on the channel"""
+        return self._remote_members.values()
+
+    def has_members(self) -> bool:
+        """Return True if a local or remote client is on the channel"""
+        return bool(self._members or self._remote_members)
+
+    def get_member_count(self) -> int:
+        """Get number of local and remote members"""
+        return len(self._members) + len(self._remote_members)
+
+    def broadcast(
+        self, numeric: str, message: str, source: str, exclude: tuple = None
+    ) -> bytes:
+        """Send a message to all clients on the channel but exclude
+
+        The message is formatted and encoded once, every member queues the
+        same bytes. In worker mode it is also relayed to members connected
+        to other workers. Return the encoded message.
+        """
+        line = utils.encode_message(numeric, message, source)
+        self.send_to_members(line, exclude, numeric)
+        if config.BROKER_LINK is not None:
+            config.BROKER_LINK.publish(self._channel_name.lower(), line, numeric)
+        return line
 
-        def broadcast(*args, **kwargs):
-            for client_address, send_msg in self._clients.items():
-                if not (client_address == address):
-                    send_msg(*args, **kwargs)
+    def send_to_members(self, line: bytes, exclude: tuple = None, command: str = None):
+        """Queue an encoded message for every local member but exclude
 
-        return broadcast
+        command: Command or numeric of the message, kept in the channel's
+            history if it is one of HISTORY_COMMANDS
+        """
+        for address, member in self._members.items():
+            if address != exclude:
+                member.send_raw(line)
+        if config.HISTORY is not None and command in constants.HISTORY_COMMANDS:
+            config.HISTORY.record(self._channel_name.lower(), line)
 
     # https://modern.ircdocs.horse/#topic-message
     def change_topic(self, new_topic):
@@ -55,25 +109,62 @@ class Channel:
         else:
             reply_code = constants.IRC_REPLIES.TOPIC
 
-        for send_msg in self._clients.values():  # Announce topic change to all clients
-            send_msg(
-                numeric=reply_code,
-                message=f"New topic is: {new_topic}",
-                include_nick=False,
-            )
+        # Announce topic change to all clients
+        self.broadcast(reply_code, f"New topic is: {new_topic}", config.SERVER_NAME)
 
     def get_members(self):
-        """Get members in a channel"""
-        return [x for x in self._client_nicks.values()]
+        """Get members in a channel, remote members last"""
+        return list(self.iter_nicks())
+
+    def iter_nicks(self):
+        """Yield the nick of every member, remote members last"""
+        for member in self.iter_members():
+            yield member.nick
+
+    def iter_members(self):
+        """Yield every Client and RemoteUser on the channel, remote members
+        last
+        """
+        yield from self._members.values()
+        yield from self._remote_members.values()
+
+    def iter_names_lines(self, prefix: bytes):
+        """Yield NAMES replies holding every nick, each within MAX_LINE_LENGTH
+
+        prefix: Encoded start of every reply, up to and including the " :"
+            that starts the nicks
+        """
+        nicks = (nick.encode() for nick in self.iter_nicks())
+        return utils.iter_joined_lines(prefix, nicks)
 
     def get_topic(self):
         """Get topic of a channel"""
         return self._channel_topic
 
-    def get_client_addresses(self):
-        """Get client address in channel"""
-        return [x for x in self._clients.keys()]
-
     def get_channel_name(self):
         """Get name of channel"""
         return self._channel_name
+
+    def get_snapshot(self) -> dict:
+        """Return the state of this channel to be restored by restore"""
+        return {
+            "name": self._channel_name,
+            "topic": self._channel_topic,
+            "members": list(self._members),
+        }
+
+    @classmethod
+    def restore(cls, snapshot: dict, clients: dict):
+        """Recreate a channel from get_snapshot in a hot restarted daemon
+
+        clients: Restored clients, Key: address, Value: Client
+        """
+        channel = cls(snapshot["name"])
+        channel._channel_topic = snapshot["topic"]
+        for address in map(tuple, snapshot["members"]):
+            client = clients.get(address)
+            if client is None:
+                continue
+            channel._members[address] = client
+            client.joined_channels[channel._channel_name.lower()] = channel
+        return channel
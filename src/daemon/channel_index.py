@@ -0,0 +1,126 @@
+"""This module indexes channels by name and by member count for LIST
+
+Client.channels is a ChannelIndex. Besides the mapping of lower case channel
+name to Channel it keeps the names sorted, like any SortedIndex, so channels
+whose names start alike are found by bisection, and the channels grouped by
+their number of members, so LIST >N does not look at smaller channels. Channels
+tell the index about their member count changes.
+
+LIST runs over several loop iterations while channels come and go. Searches
+are generators that find their place again after every channel they yield.
+"""
+import config
+from sorted_index import SortedIndex, compile_mask, get_prefix
+
+
+class ChannelIndex(SortedIndex):
+    """Channels by lower case name, with their names sorted and their keys
+    grouped by member count
+
+    Only item assignment, del, pop and clear keep the index, like Client uses
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._sizes = {}  # Key: member count, Value: dict of key to Channel
+
+    def __setitem__(self, key: str, channel):
+        previous = self.get(key)
+        if previous is not None:
+            self._forget(key, previous)
+        super().__setitem__(key, channel)
+        channel.index = self
+        self._sizes.setdefault(channel.get_member_count(), {})[key] = channel
+
+    def pop(self, key: str, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        channel = super().pop(key)
+        self._forget(key, channel)
+        # A channel created later with the same name does not see its history
+        if config.HISTORY is not None:
+            config.HISTORY.forget(key)
+        return channel
+
+    def clear(self):
+        for channel in self.values():
+            channel.index = None
+        super().clear()
+        self._sizes.clear()
+
+    def _forget(self, key: str, channel):
+        """Remove channel from the member count groups"""
+        channel.index = None
+        count = channel.get_member_count()
+        group = self._sizes[count]
+        del group[key]
+        if not group:
+            del self._sizes[count]
+
+    def resize(self, channel, old_count: int):
+        """Move channel to the group of its current member count"""
+        key = channel.get_channel_name().lower()
+        group = self._sizes[old_count]
+        del group[key]
+        if not group:
+            del self._sizes[old_count]
+        self._sizes.setdefault(channel.get_member_count(), {})[key] = channel
+
+    def search(
+        self,
+        masks: list = (),
+        excluded_masks: list = (),
+        min_members: int = 0,
+        max_members: int = None,
+    ):
+        """Yield channels matching any of masks and none of excluded_masks,
+        with at least min_members and at most max_members members
+
+        Masks are matched case insensitively, * matches any characters and ?
+        any single one. Without masks any name matches. Channels are yielded
+        by name when masks start with a fixed prefix or no member count is
+        given, else the largest first. Channels that were
+        created while the search was suspended may be left out.
+        """
+        masks = [mask.lower() for mask in masks]
+        excluded = [compile_mask(mask.lower()) for mask in excluded_masks]
+        included = [compile_mask(mask) for mask in masks]
+        prefixes = [get_prefix(mask) for mask in masks]
+
+        if masks and all(prefixes):
+            keys = self.iter_prefixes(prefixes)
+        elif not masks and (min_members > 0 or max_members is not None):
+            keys = self._iter_sizes(min_members, max_members)
+        else:
+            keys = self.iter_prefixes([""])
+
+        for key in keys:
+            channel = self.get(key)
+            if channel is None:
+                continue
+            count = channel.get_member_count()
+            if (
+                count >= min_members
+                and (max_members is None or count <= max_members)
+                and (not included or any(mask(key) for mask in included))
+                and not any(mask(key) for mask in excluded)
+            ):
+                yield channel
+
+    def _iter_sizes(self, min_members: int, max_members: int = None):
+        """Yield keys of channels with between min_members and max_members
+        members, the largest first
+        """
+        counts = sorted(
+            (
+                count
+                for count in self._sizes
+                if min_members <= count
+                and (max_members is None or count <= max_members)
+            ),
+            reverse=True,
+        )
+        for count in counts:
+            # Channels change groups while the search is suspended
+            yield from list(self._sizes.get(count, ()))
+
@@ -1,14 +1,20 @@
 """This module represents a client and defines client message handlers"""
+import hmac
+import itertools
 import logging
+import time
+from functools import lru_cache
 from selectors import SelectorKey
-from typing import List
 
 import channel
 import config
 import constants
 import utils
+from channel_index import ChannelIndex
 from constants import IRC_COMMANDS, IRC_ERRORS, IRC_REPLIES, SERVER_EVENTS
 from message import Message
+from metrics import Metrics
+from sorted_index import SortedIndex
 
 
 class Client:
@@ -19,47 +25,111 @@ class Client:
 
     clients = {}  # Key: Address (tuple), Value: Client
 
-    channels = {}  # Key: channel_name, Value:Channel()
+    # Key: nick casefolded with utils.irc_lower, Value: Client
+    # Holds every client that has a nick, registered or not, sorted for WHO
+    nicks = SortedIndex()
+
+    registered_count = 0  # Number of registered clients
+
+    # References of the batches CHATHISTORY replies are sent in
+    _batch_references = itertools.count(1)
+
+    channels = ChannelIndex()  # Key: channel_name, Value:Channel()
+
+    _logger = logging.getLogger(__name__)
+
+    __slots__ = (
+        "_is_registered",
+        "nick",
+        "_nick_key",
+        "nick_ts",
+        "_realname",
+        "_username",
+        "_key",
+        "_is_operator",
+        "address",
+        "joined_channels",
+        "_pending_nick",
+        "_held_messages",
+        "_password",
+        "_streamed_replies",
+        "_stream_end",
+    )
 
     def __init__(self, address: tuple, key: SelectorKey):
-        self._logger = logging.getLogger(__name__)
         self._is_registered = False
         self.nick = ""
+        self._nick_key = None  # Casefolded nick, key of this client in `nicks`
+        # Unix time the nick was taken, the older of two equal nicks is kept
+        # when linked servers introduce both
+        self.nick_ts = 0
         self._realname = ""
         self._username = ""
         self._key = key
+        self._is_operator = False
         self.address = address
-        self.joined_channels = {}  # Key=channel_name, Value=broadcast:callable
+        self.joined_channels = {}  # Key=channel_name, Value=Channel
+        # Worker mode: nick claimed from the broker and messages received
+        # before the broker answered, replayed once registration completes
+        self._pending_nick = None
+        self._held_messages = []
+        self._password = None  # Sent with PASS by a server that links
+        # Replies of a LIST or WHO that are not queued yet, and its last reply
+        self._streamed_replies = None
+        self._stream_end = None
 
         Client.clients[self.address] = self
 
-        self._handlers = {
-            IRC_COMMANDS.PING: self._handle_ping,
-            IRC_COMMANDS.USER: self._handle_user,
-            IRC_COMMANDS.NICK: self._handle_nick,
-            IRC_COMMANDS.QUIT: self._handle_quit,
-            IRC_COMMANDS.JOIN: self._handle_join,
-            IRC_COMMANDS.PART: self._handle_part,
-            IRC_COMMANDS.LUSERS: self._handle_lusers,
-            IRC_COMMANDS.PRIVMSG: self._handle_privmsg,
-            IRC_COMMANDS.MOTD: self._handle_motd,
-            IRC_COMMANDS.LIST: self._handle_list,
-        }
-
-    @classmethod
-    def get_registered_nicks(cls) -> List[str]:
-        """Return list of registered nicks"""
-        return [
-            client.nick for client in Client.clients.values() if client.is_registered
-        ]
-
     @classmethod
     def get_client(cls, target_nick: str):
         """Return client instance if exists or else None"""
-        target = [
-            client for client in Client.clients.values() if client.nick == target_nick
-        ]
-        return target[0] if len(target) else None
+        return Client.nicks.get(utils.irc_lower(target_nick))
+
+    @classmethod
+    def is_nick_in_use(cls, nick: str, client=None) -> bool:
+        """Return True if nick is held by a client other than client"""
+        holder = Client.nicks.get(utils.irc_lower(nick))
+        return holder is not None and holder is not client
+
+    @property
+    def key(self):
+        """Get the key of this client's connection"""
+        return self._key
+
+    @property
+    def username(self):
+        """Get value of _username"""
+        return self._username
+
+    @property
+    def realname(self):
+        """Get value of _realname"""
+        return self._realname
+
+    @property
+    def is_operator(self):
+        """Get value of _is_operator"""
+        return self._is_operator
+
+    @property
+    def host(self):
+        """Get the host shown to other clients, the address of the client"""
+        host = self.address[0]
+        if "/" in host:  # Path of a Unix socket listener
+            return "localhost"
+        # An IPv6 address may start with a colon, which starts the last
+        # parameter of a reply
+        return f"0{host}" if host.startswith(":") else host
+
+    @property
+    def server_name(self):
+        """Get the name of the server of the client, this one"""
+        return config.SERVER_NAME
+
+    @property
+    def hopcount(self):
+        """Get the number of links between this server and that of the client"""
+        return 0
 
     @property
     def is_registered(self):
@@ -69,7 +139,13 @@ class Client:
     @is_registered.setter
     def is_registered(self, is_registered: bool):
         """Set value of is_registered, call success handler if is_registered"""
+        if is_registered and not self._is_registered:
+            Client.registered_count += 1
+        elif self._is_registered and not is_registered:
+            Client.registered_count -= 1
+
         self._is_registered = is_registered
+        self._key.data.is_registered = is_registered
         if is_registered:
             self._send_registration_success()
 
@@ -78,18 +154,53 @@ class Client:
 
         https://modern.ircdocs.horse/#connection-registration
         """
-        self.send_message(IRC_REPLIES.WELCOME, f":Welcome to {config.SERVER_NAME}")
-        self.send_message(
-            IRC_REPLIES.YOURHOST,
-            ":This daemon was developed by Efkan, Mohammad and Vigaash.",
-        )
-        self.send_message(IRC_REPLIES.CREATED, ":This server was started recently")
-        self.send_message(IRC_REPLIES.MYINFO, f":{config.SERVER_NAME} Version 1")
-        self._send_motd()
+        burst = Client._get_welcome_burst(config.SERVER_NAME, utils.motd)
+        self.send_raw(self.nick.encode().join(burst))
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _get_welcome_burst(server_name: str, motd: str) -> tuple:
+        """Return the welcome numerics and MOTD compiled by utils.compile_replies
+
+        Compiled again only when the server name or MOTD change
+        """
+        replies = [
+            (IRC_REPLIES.WELCOME, f":Welcome to {server_name}"),
+            (
+                IRC_REPLIES.YOURHOST,
+                ":This daemon was developed by Efkan, Mohammad and Vigaash.",
+            ),
+            (IRC_REPLIES.CREATED, ":This server was started recently"),
+            (IRC_REPLIES.MYINFO, f":{server_name} Version 1"),
+        ]
+        replies.extend(Client._get_motd_replies(server_name, motd))
+        return utils.compile_replies(replies, server_name)
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _get_motd_burst(server_name: str, motd: str) -> tuple:
+        """Return the MOTD numerics compiled by utils.compile_replies"""
+        replies = Client._get_motd_replies(server_name, motd)
+        return utils.compile_replies(replies, server_name)
+
+    @staticmethod
+    def _get_motd_replies(server_name: str, motd: str) -> list:
+        """Return (numeric, message) of every MOTD line"""
+        replies = [
+            (IRC_REPLIES.MOTDSTART, f":- {server_name} You have now entered...  ")
+        ]
+        replies.extend((IRC_REPLIES.MOTD, f":{line}") for line in motd.split("\n"))
+        replies.append((IRC_REPLIES.ENDOFMOTD, ":End of MOTD"))
+        return replies
 
     def handle_message(self, message: Message):
         """Invoke appropriate handler for message"""
-        self._logger.debug(f"{self.address} - {message}")
+        self._logger.debug("%s - %s", self.address, message)
+
+        # A connection handed over by a hot restart has a new key
+        if message.action == SERVER_EVENTS.CONNECT:
+            self._key = message.key
+            return
 
         # Any client can disconnect, whether registered or unregistered
         if message.command == SERVER_EVENTS.DISCONNECT:
@@ -99,21 +210,73 @@ class Client:
             self._handle_registration_flow(message)
             return
 
-        if message.command in self._handlers.keys():
-            handler = self._handlers[message.command]
-            handler(message)
+        handler = Client._handlers.get(message.command)
+        if handler is not None:
+            handler(self, message)
+
+    def get_snapshot(self) -> dict:
+        """Return the state of this client to be restored by restore"""
+        return {
+            "address": self.address,
+            "nick": self.nick,
+            "username": self._username,
+            "realname": self._realname,
+            "is_registered": self._is_registered,
+            "is_operator": self._is_operator,
+        }
+
+    @classmethod
+    def restore(cls, snapshot: dict, key) -> "Client":
+        """Recreate a client from get_snapshot in a hot restarted daemon
+
+        Its channels are restored by Channel.restore
+        """
+        client = cls(tuple(snapshot["address"]), key)
+        if snapshot["nick"]:
+            client._change_nick(snapshot["nick"])
+        client._username = snapshot["username"]
+        client._realname = snapshot["realname"]
+        client._is_operator = snapshot["is_operator"]
+        if snapshot["is_registered"]:
+            # The is_registered setter would welcome the client once more
+            client._is_registered = key.data.is_registered = True
+            Client.registered_count += 1
+        return client
 
     def _handle_registration_flow(self, message: Message):
         """Handle registration state and send reply on success"""
+        if self._pending_nick is not None and message.command not in (
+            IRC_COMMANDS.NICK,
+            IRC_COMMANDS.USER,
+        ):
+            if len(self._held_messages) < constants.MAX_HELD_MESSAGES:
+                self._held_messages.append(message)
+            return
+
+        if message.command == IRC_COMMANDS.PASS and message.parameters:
+            self._password = message.parameters[0]
+
+        # The connection is a server that links with this one
+        if message.command == IRC_COMMANDS.SERVER and config.NETWORK is not None:
+            self._release_nick()
+            config.NETWORK.accept_link(self._key, self._password, message)
+            return
+
         if message.command == IRC_COMMANDS.NICK:
             self._handle_nick(message)
 
         if message.command == IRC_COMMANDS.USER:
             self._handle_user(message)
 
+        self._try_complete_registration()
+
+    def _try_complete_registration(self):
+        """Register client once both NICK and USER were accepted"""
         # user_name implies realname is present
-        if self._username and self.nick:
+        if not self._is_registered and self._username and self.nick:
             self.is_registered = True
+            if config.NETWORK is not None:
+                config.NETWORK.introduce(self)
 
     def _handle_nick(self, message: Message):
         """Handle NICK command"""
@@ -124,20 +287,59 @@ class Client:
             self.send_message(IRC_ERRORS.NO_NICKNAME_GIVEN, ":No nickname given")
             return
 
-        if candidate_nick in Client.get_registered_nicks():
-            self.send_message(
-                IRC_ERRORS.NICKNAME_IN_USE,
-                f"{candidate_nick}:Nickname is already in use",
-            )
+        if Client.is_nick_in_use(candidate_nick, self):
+            self.send_nickname_in_use(candidate_nick)
+            return
+
+        if config.BROKER_LINK is not None:
+            # Nicks are unique across workers, the broker answers the claim
+            # through complete_nick_change
+            self._pending_nick = candidate_nick
+            config.BROKER_LINK.claim(self.address, candidate_nick)
             return
 
+        self._change_nick(candidate_nick)
+
+    def complete_nick_change(self, candidate_nick: str, is_granted: bool):
+        """Apply or refuse a nick claimed from the broker"""
+        if candidate_nick == self._pending_nick:
+            self._pending_nick = None
+        held_messages, self._held_messages = self._held_messages, []
+
+        if not is_granted:
+            self.send_nickname_in_use(candidate_nick)
+            return
+
+        self._change_nick(candidate_nick)
+        self._try_complete_registration()
+
+        for message in held_messages:
+            self.handle_message(message)
+
+    def _change_nick(self, candidate_nick: str):
+        """Set nick and announce the change to a registered client"""
         old_nick = self.nick
+        self._release_nick()
         self.nick = candidate_nick
+        self._nick_key = utils.irc_lower(candidate_nick)
+        self.nick_ts = int(time.time())
+        Client.nicks[self._nick_key] = self
 
         if self._is_registered:
             self.send_message(
                 IRC_COMMANDS.NICK, self.nick, include_nick=False, source=old_nick
             )
+            if config.NETWORK is not None:
+                config.NETWORK.change_nick(self, old_nick)
+
+    def lose_nick(self):
+        """Give up the nick of an unregistered client, a client on a linked
+        server took it first
+        """
+        nick = self.nick
+        self._release_nick()
+        self.nick = ""
+        self.send_nickname_in_use(nick)
 
     def _handle_user(self, message: Message):
         """Handle USER command"""
@@ -182,14 +384,14 @@ class Client:
         """Handle QUIT command"""
         reason = message.parameters[0] if message.parameters else ""
 
-        self._leave_all_channels(True)
+        self._leave_all_channels(True, constants.DEFAULT_DISCONNECT_REASON)
 
         # Signal to Server to unregister after sending QUIT
         self._key.data.unregister_socket = True
 
         self.send_message(IRC_COMMANDS.ERROR, f"QUIT: {reason}")
 
-        Client.clients.pop(self.address)
+        self._remove_client(reason)
 
     def _handle_join(self, message: Message):
         """Handle JOIN command"""
@@ -212,55 +414,41 @@ class Client:
                 return
             if len(channel_name) < 1 or channel_name[0] != "#":
                 return
-            if channel_name not in Client.channels:  # If not exists, create new channel
+            joined_channel = Client.channels.get(channel_name.lower())
+            if joined_channel is None:  # If not exists, create new channel
                 for x in constants.FORBIDDEN_CHANNELNAME_CHARS:
                     if x in channel_name:
                         self.send_message(
                             IRC_ERRORS.BADCHANMASK, "Invalid channel name!"
                         )
                         return
-                new_channel = channel.Channel(channel_name)
-                Client.channels[channel_name.lower()] = new_channel
+                joined_channel = channel.Channel(channel_name)
+                Client.channels[channel_name.lower()] = joined_channel
 
-            # Check whether client is already in channel
-            if (
-                self.address
-                in Client.channels[channel_name.lower()].get_client_addresses()
-            ):
+            # Register with channel, unless client is already in channel
+            if not joined_channel.register(self):
                 self.send_message(
                     numeric=constants.IRC_ERRORS.USERONCHANNEL,
                     message=f" \
-                        {Client.channels[channel_name.lower()].get_channel_name()} \
+                        {joined_channel.get_channel_name()} \
                         :is already on channel",
                     include_nick=True,
                 )
                 return
 
-            # Register and get broadcast function from channel
-            broadcast = Client.channels[channel_name.lower()].register(
-                self.address, self.send_message, self.nick
-            )
-
-            # Add channel to joined_channels with broadcast function as value
-            self.joined_channels[channel_name.lower()] = broadcast
+            # Add channel to joined_channels
+            self.joined_channels[channel_name.lower()] = joined_channel
 
             # Send JOIN message to channel members and client
-            self.broadcast_arrival(broadcast, channel_name)
+            self.broadcast_arrival(joined_channel, channel_name)
+            if config.NETWORK is not None:
+                config.NETWORK.join(self, channel_name)
 
             # Send topic in reply only if there is a topic
             self.send_topic(channel_name)
 
             # Send list of users in channel
-            members = Client.channels[channel_name.lower()].get_members()
-            members_str = ", ".join(members)
-            self.send_message(
-                IRC_REPLIES.NAMREPLY,
-                message=f"= {channel_name} :{members_str}",
-                include_nick=True,
-            )
-            self.send_message(
-                IRC_REPLIES.ENDOFNAMES, message=f"{channel_name} :End of /NAMES list"
-            )
+            self.send_names(joined_channel, channel_name)
 
     def _handle_part(self, message: Message, reason: str = ""):
         """Handle PART command"""
@@ -285,39 +473,44 @@ class Client:
             if channel_name.lower() not in Client.channels:
                 self.send_no_such_channel(channel_name)
                 return
-            if (
-                channel_name.lower() not in self.joined_channels
-                or self.address
-                not in Client.channels[channel_name.lower()].get_client_addresses()
+            if channel_name.lower() not in self.joined_channels or not (
+                Client.channels[channel_name.lower()].has_member(self.address)
             ):
                 self.send_not_on_channel(channel_name, include_nick=False)
                 return
 
             # Announce departure to channel
-            broadcast = self.joined_channels[channel_name.lower()]
-            self.broadcast_departure(broadcast, self.nick, channel_name, reason)
+            joined_channel = self.joined_channels[channel_name.lower()]
+            self.broadcast_departure(joined_channel, self.nick, channel_name, reason)
+            if config.NETWORK is not None:
+                config.NETWORK.part(self, channel_name, reason)
 
             # Unregister from channel
             Client.channels[channel_name.lower()].unregister(self.address)
             self.joined_channels.pop(channel_name.lower())
 
             # Delete channel if it is empty
-            if not len(Client.channels[channel_name.lower()].get_client_addresses()):
+            if not Client.channels[channel_name.lower()].has_members():
                 Client.channels.pop(channel_name.lower())
 
     def _handle_lusers(self, _: Message):
         """Handle LUSERS command"""
-        # We do not support invisible clients and other servers
-        # joining, thus we set those to 0.
-        num_users = len(Client.get_registered_nicks())
+        # We do not support invisible clients, thus we set those to 0.
+        num_clients = num_users = Client.registered_count
+        num_servers, num_links = 1, 0
+        if config.NETWORK is not None:
+            num_users += config.NETWORK.get_user_count()
+            num_servers += config.NETWORK.get_server_count()
+            num_links = config.NETWORK.get_link_count()
         self.send_message(
             numeric=IRC_REPLIES.LUSERCLIENT,
-            message=f":There are {num_users} users and 0 invisible on 0 servers",
+            message=f":There are {num_users} users and 0 invisible on "
+            f"{num_servers} servers",
             include_nick=True,
         )
         self.send_message(
             numeric=IRC_REPLIES.LUSERME,
-            message=f":I have {num_users} clients and 0 servers",
+            message=f":I have {num_clients} clients and {num_links} servers",
             include_nick=True,
         )
 
@@ -360,25 +553,31 @@ class Client:
                     self.send_not_on_channel(target)
                     return
                 # Broadcast to channel
-                broadcast = self.joined_channels[target.lower()]
-                broadcast(
-                    numeric=IRC_COMMANDS.PRIVMSG,
-                    message=message_to_send,
-                    include_nick=False,
+                target_channel = self.joined_channels[target.lower()]
+                line = target_channel.broadcast(
+                    IRC_COMMANDS.PRIVMSG,
+                    message_to_send,
                     source=self.nick,
+                    exclude=self.address,
                 )
+                if config.NETWORK is not None:
+                    config.NETWORK.send_to_channel(target_channel, line)
                 return
             else:  # Target is a single client
-                target_client = Client.get_client(target)
-                if not target_client:
-                    self.send_no_such_nick(target)
-                    return
-                target_client.send_message(
+                privmsg = dict(
                     numeric=IRC_COMMANDS.PRIVMSG,
                     message=message_to_send,
                     include_nick=False,
                     source=self.nick,
                 )
+                target_client = Client.get_client(target)
+                if target_client:
+                    target_client.send_message(**privmsg)
+                elif config.BROKER_LINK is not None:
+                    # Target may be connected to another worker
+                    config.BROKER_LINK.route(self.nick, target, privmsg)
+                else:
+                    self.send_no_such_nick(target)
 
     def _handle_motd(self, message: Message):
         """Handle MOTD command"""
@@ -391,66 +590,511 @@ class Client:
 
     def _send_motd(self):
         """Send MOTD message"""
-        self.send_message(
-            IRC_REPLIES.MOTDSTART, f":- {config.SERVER_NAME} You have now entered...  "
+        burst = Client._get_motd_burst(config.SERVER_NAME, utils.motd)
+        self.send_raw(self.nick.encode().join(burst))
+
+    def _handle_oper(self, message: Message):
+        """Handle OPER command"""
+        if len(message.parameters) < 2:
+            self.send_need_more_params(IRC_COMMANDS.OPER)
+            return
+
+        name, password = message.parameters[0], message.parameters[1]
+        expected_password = config.OPERATORS.get(name)
+        if expected_password is None or not hmac.compare_digest(
+            password.encode(), expected_password.encode()
+        ):
+            self.send_message(IRC_ERRORS.PASSWDMISMATCH, ":Password incorrect")
+            return
+
+        self._is_operator = True
+        self.send_message(IRC_REPLIES.YOUREOPER, ":You are now an IRC operator")
+
+    def _handle_stats(self, message: Message):
+        """Handle STATS command
+
+        Queries are restricted to operators:
+            l: SendQ and traffic of every connection
+            f: How often every connection was throttled by flood control
+            m: Number of times each command was handled and how long it took
+            z: Event loop, traffic, client and channel metrics
+        """
+        queries = {
+            "l": self._get_link_stats,
+            "f": self._get_flood_stats,
+            "m": self._get_command_stats,
+            "z": self._get_debug_stats,
+        }
+        query = message.parameters[0] if message.parameters else ""
+        if query in queries:
+            if not self._is_operator:
+                self.send_no_privileges()
+                return
+            for numeric, reply in queries[query]():
+                self.send_message(numeric, reply)
+
+        self.send_message(IRC_REPLIES.ENDOFSTATS, f"{query} :End of STATS report")
+
+    def _handle_links(self, _: Message):
+        """Handle LINKS command, list this server and every linked server"""
+        servers = [(config.SERVER_NAME, config.SERVER_NAME, 0)]
+        if config.NETWORK is not None:
+            servers.extend(config.NETWORK.get_servers())
+        for name, uplink, hopcount in servers:
+            self.send_message(IRC_REPLIES.LINKS, f"{name} {uplink} :{hopcount} pyircd")
+        self.send_message(IRC_REPLIES.ENDOFLINKS, "* :End of LINKS list")
+
+    def _handle_connect(self, message: Message):
+        """Handle CONNECT command, link with the server at host and port"""
+        if not self._is_operator:
+            self.send_no_privileges()
+            return
+        parameters = message.parameters
+        port = utils.parse_port(parameters[1]) if len(parameters) > 1 else None
+        if port is None:
+            self.send_need_more_params(IRC_COMMANDS.CONNECT)
+            return
+
+        host = message.parameters[0]
+        if config.NETWORK is None:
+            self.send_message(IRC_ERRORS.NOSUCHSERVER, f"{host} :Linking is disabled")
+            return
+        try:
+            config.NETWORK.connect((host, port))
+        except OSError as e:
+            self.send_message(
+                IRC_COMMANDS.NOTICE, f":Could not connect to {host}:{port}: {e}"
+            )
+            return
+        self.send_message(IRC_COMMANDS.NOTICE, f":Connecting to {host}:{port}")
+
+    def _handle_squit(self, message: Message):
+        """Handle SQUIT command, unlink a server linked with this one"""
+        if not self._is_operator:
+            self.send_no_privileges()
+            return
+        if not message.parameters:
+            self.send_need_more_params(IRC_COMMANDS.SQUIT)
+            return
+
+        name = message.parameters[0]
+        reason = message.parameters[1] if len(message.parameters) > 1 else self.nick
+        if config.NETWORK is None or not config.NETWORK.unlink(name, reason):
+            self.send_message(
+                IRC_ERRORS.NOSUCHSERVER, f"{name} :No such server is linked"
+            )
+
+    def _get_link_stats(self) -> list:
+        return [
+            (IRC_REPLIES.STATSLINKINFO, client.get_link_info())
+            for client in Client.clients.values()
+        ]
+
+    def _get_flood_stats(self) -> list:
+        return [
+            (IRC_REPLIES.STATSDEBUG, client.get_flood_info())
+            for client in Client.clients.values()
+        ]
+
+    def _get_command_stats(self) -> list:
+        """<command> <count> :<average, p99 upper bound> in microseconds"""
+        return [
+            (
+                IRC_REPLIES.STATSCOMMANDS,
+                f"{command} {histogram.count}"
+                f" :avg {histogram.sum / histogram.count * 1e6:.0f}us"
+                f" p99 {histogram.get_quantile(0.99) * 1e6:.0f}us",
+            )
+            for command, histogram in sorted(Metrics.commands.items())
+        ]
+
+    def _get_debug_stats(self) -> list:
+        return [
+            (IRC_REPLIES.STATSDEBUG, f":{name} {value}")
+            for name, value in Metrics.get_summary()
+        ]
+
+    def _get_link_name(self) -> str:
+        """Return nick and address identifying this client in STATS replies"""
+        return f"{self.nick or '*'}[{self.address[0]}:{self.address[1]}]"
+
+    def get_sendq(self) -> int:
+        """Return number of bytes queued for this client"""
+        return len(self._key.data.out_queue)
+
+    def get_link_info(self) -> str:
+        """Return the STATS l line of this client
+
+        <linkname> <sendq> <sent messages> <sent KiB> <received messages>
+        <received KiB> :<seconds connected>
+        """
+        key_data = self._key.data
+        out_queue, in_buffer = key_data.out_queue, key_data.in_buffer
+        seconds_connected = int(time.monotonic() - key_data.connected_at)
+        return (
+            f"{self._get_link_name()} {self.get_sendq()} {out_queue.num_chunks_sent}"
+            f" {out_queue.num_bytes_sent // 1024} {in_buffer.num_lines_received}"
+            f" {in_buffer.num_bytes_received // 1024} :{seconds_connected}"
         )
-        for line in utils.motd.split("\n"):
-            self.send_message(IRC_REPLIES.MOTD, f":{line}")
-        self.send_message(IRC_REPLIES.ENDOFMOTD, ":End of MOTD")
 
-    def _handle_disconnect(self, _: Message):
+    def get_flood_info(self) -> str:
+        """Return the STATS f line of this client"""
+        flood = self._key.data.flood
+        return (
+            f"{self._get_link_name()} :throttled {flood.num_throttled}"
+            f" dropped {flood.num_dropped} held {len(flood.held or ())}"
+        )
+
+    def _handle_disconnect(self, message: Message):
         """Handle client disconnect"""
-        self._leave_all_channels(False)
+        reason = (
+            message.parameters[0]
+            if message.parameters
+            else constants.DEFAULT_DISCONNECT_REASON
+        )
+        self._leave_all_channels(False, reason)
+        self._remove_client(reason)
+
+    def _remove_client(self, reason: str):
+        """Forget client and release its nick, linked servers are told reason"""
+        if config.NETWORK is not None:
+            config.NETWORK.quit(self, reason)
         Client.clients.pop(self.address)
+        self._release_nick()
+        self.is_registered = False
+        if config.BROKER_LINK is not None:
+            config.BROKER_LINK.release(self.address)
+
+    def _release_nick(self):
+        """Remove client's nick from the nick index"""
+        if self._nick_key is not None and Client.nicks.get(self._nick_key) is self:
+            Client.nicks.pop(self._nick_key)
+        self._nick_key = None
 
     def _handle_list(self, message: Message):
-        """Handle LIST command"""
-        self.send_message(IRC_REPLIES.LISTSTART, "Channel :Users")
-        for client_channels in Client.channels:
-            self.send_message(
+        """Handle LIST command, with the ELIST conditions M, N and U
+
+        Channels are given as masks, !mask leaves channels out and >N and <N
+        ask for channels with more or fewer than N users, all comma separated.
+        Replies are queued as the ones before were sent, see _continue_stream
+        https://modern.ircdocs.horse/#list-message
+        """
+        masks, excluded_masks, min_members, max_members = [], [], 0, None
+        for parameter in message.parameters[:2]:
+            for condition in parameter.split(","):
+                operator, operand = condition[:1], condition[1:]
+                if operator == ">" and utils.is_number(operand):
+                    min_members = max(min_members, int(operand) + 1)
+                elif operator == "<" and utils.is_number(operand):
+                    limit = int(operand) - 1
+                    if max_members is None or limit < max_members:
+                        max_members = limit
+                elif operator == "!" and operand:
+                    excluded_masks.append(operand)
+                elif condition:
+                    masks.append(condition)
+
+        # A LIST or WHO in progress ends where the next one starts
+        self._end_stream()
+        self.send_message(IRC_REPLIES.LISTSTART, "Channel :Users Name")
+        self._stream_replies(
+            self._iter_list_replies(
+                Client.channels.search(masks, excluded_masks, min_members, max_members)
+            ),
+            utils.encode_message(
+                IRC_REPLIES.LISTEND, ":End of /LIST", config.SERVER_NAME, self.nick
+            ),
+        )
+
+    def _iter_list_replies(self, channels):
+        """Yield the encoded LIST reply of every one of channels"""
+        for list_channel in channels:
+            yield utils.encode_message(
                 IRC_REPLIES.LIST,
-                f"{Client.channels[client_channels]._channel_name}"
-                + f" {len(Client.channels[client_channels]._clients)}",
+                f"{list_channel.get_channel_name()} {list_channel.get_member_count()}"
+                f" :{list_channel.get_topic()}",
+                config.SERVER_NAME,
+                self.nick,
+            )
+
+    def _handle_who(self, message: Message):
+        """Handle WHO command, list the users on a channel or the users whose
+        nick matches a mask, only operators with the o flag
+
+        Nicks are found in the sorted Client.nicks by the part of the mask
+        before its first wildcard. Replies are queued as the ones before were
+        sent, see _continue_stream
+        https://modern.ircdocs.horse/#who-message
+        """
+        mask = message.parameters[0] if message.parameters else "*"
+        operators_only = message.parameters[1:2] == ["o"]
+        who_channel = Client.channels.get(mask.lower())
+        if who_channel is not None:
+            # Members that leave while the replies are queued are skipped
+            users = list(who_channel.iter_members())
+            channel_name = who_channel.get_channel_name()
+        else:
+            nick_mask = "*" if mask == "0" else utils.irc_lower(mask)
+            users = map(Client.nicks.get, Client.nicks.iter_matching([nick_mask]))
+            channel_name = "*"
+
+        self._stream_replies(
+            self._iter_who_replies(users, who_channel, channel_name, operators_only),
+            utils.encode_message(
+                IRC_REPLIES.ENDOFWHO,
+                f"{mask} :End of WHO list",
+                config.SERVER_NAME,
+                self.nick,
+            ),
+        )
+
+    def _iter_who_replies(
+        self, users, who_channel, channel_name: str, operators_only: bool
+    ):
+        """Yield the encoded WHO reply of every one of users that is still
+        registered, and on who_channel unless it is None
+        """
+        for user in users:
+            if (
+                user is None
+                or not user.is_registered
+                or (operators_only and not user.is_operator)
+                or (
+                    who_channel is not None
+                    and not who_channel.has_member(user.address)
+                )
+            ):
+                continue
+            flags = "H*" if user.is_operator else "H"
+            yield utils.encode_message(
+                IRC_REPLIES.WHOREPLY,
+                f"{channel_name} {user.username} {user.host} {user.server_name}"
+                f" {user.nick} {flags} :{user.hopcount} {user.realname}",
+                config.SERVER_NAME,
+                self.nick,
+            )
+
+    def _handle_whois(self, message: Message):
+        """Handle WHOIS command, for comma separated nicks
+
+        A server given before the nicks is ignored, every user of the network
+        is known to this server
+        https://modern.ircdocs.horse/#whois-message
+        """
+        if not message.parameters:
+            self.send_message(IRC_ERRORS.NO_NICKNAME_GIVEN, ":No nickname given")
+            return
+
+        for nick in message.parameters[-1].split(","):
+            user = Client.get_client(nick)
+            if user is None or not user.is_registered:
+                self.send_no_such_nick(nick)
+            else:
+                self._send_whois(user)
+            self.send_message(IRC_REPLIES.ENDOFWHOIS, f"{nick} :End of /WHOIS list")
+
+    def _send_whois(self, user):
+        """Send what WHOIS tells about user, a Client or RemoteUser"""
+        nick = user.nick
+        self.send_message(
+            IRC_REPLIES.WHOISUSER,
+            f"{nick} {user.username} {user.host} * :{user.realname}",
+        )
+        self.send_message(IRC_REPLIES.WHOISSERVER, f"{nick} {user.server_name} :pyircd")
+        if user.is_operator:
+            self.send_message(IRC_REPLIES.WHOISOPERATOR, f"{nick} :is an IRC operator")
+        prefix = (
+            f":{config.SERVER_NAME} {IRC_REPLIES.WHOISCHANNELS} {self.nick} {nick} :"
+        )
+        channel_names = (
+            joined_channel.get_channel_name().encode()
+            for joined_channel in user.joined_channels.values()
+        )
+        for line in utils.iter_joined_lines(prefix.encode(), channel_names):
+            self.send_raw(line)
+
+    def _handle_names(self, message: Message):
+        """Handle NAMES command, for comma separated channels
+
+        Channels that do not exist only get ENDOFNAMES. Without channels only
+        ENDOFNAMES is sent, rather than every nick of the server
+        https://modern.ircdocs.horse/#names-message
+        """
+        if not message.parameters:
+            self.send_message(IRC_REPLIES.ENDOFNAMES, "* :End of /NAMES list")
+            return
+
+        for channel_name in message.parameters[0].split(","):
+            names_channel = Client.channels.get(channel_name.lower())
+            if names_channel is None:
+                self.send_message(
+                    IRC_REPLIES.ENDOFNAMES, f"{channel_name} :End of /NAMES list"
+                )
+            else:
+                self.send_names(names_channel, names_channel.get_channel_name())
+
+    def _handle_chathistory(self, message: Message):
+        """Handle CHATHISTORY command, replay recent events of a channel the
+        client is on with the BEFORE, AFTER and LATEST subcommands
+
+        Events are sent in a chathistory batch, tagged with their time and
+        message id. Capabilities are not negotiated, the tags are sent to any
+        client that asks for history.
+        https://ircv3.net/specs/extensions/chathistory
+        """
+        parameters = message.parameters
+        if len(parameters) < 4:
+            self._send_fail(
+                IRC_COMMANDS.CHATHISTORY, "NEED_MORE_PARAMS", ":Missing parameters"
             )
-        self.send_message(IRC_REPLIES.LISTEND, ":End of /LIST")
+            return
 
-    def _leave_all_channels(self, send_to_self: bool):
+        subcommand, target, reference, limit = parameters[:4]
+        subcommand = subcommand.upper()
+        if subcommand not in ("BEFORE", "AFTER", "LATEST"):
+            self._send_fail(
+                IRC_COMMANDS.CHATHISTORY,
+                "UNKNOWN_COMMAND",
+                f"{subcommand} :Unknown subcommand",
+            )
+            return
+        parsed_reference = self._parse_history_reference(reference)
+        if not utils.is_number(limit) or (
+            parsed_reference is None and (subcommand != "LATEST" or reference != "*")
+        ):
+            self._send_fail(
+                IRC_COMMANDS.CHATHISTORY,
+                "INVALID_PARAMS",
+                f"{subcommand} :Invalid message reference or limit",
+            )
+            return
+        history_channel = self.joined_channels.get(target.lower())
+        if history_channel is None:
+            self._send_fail(
+                IRC_COMMANDS.CHATHISTORY,
+                "INVALID_TARGET",
+                f"{subcommand} {target} :Messages could not be retrieved",
+            )
+            return
+        if config.HISTORY is None:
+            self._send_fail(
+                IRC_COMMANDS.CHATHISTORY,
+                "MESSAGE_ERROR",
+                f"{subcommand} {target} :Messages could not be retrieved",
+            )
+            return
+
+        history = config.HISTORY.get(target.lower())
+        events = []
+        if history is not None:
+            select = {
+                "BEFORE": history.before,
+                "AFTER": history.after,
+                "LATEST": history.latest,
+            }[subcommand]
+            events = select(
+                parsed_reference, min(int(limit), constants.CHATHISTORY_MAX_LIMIT)
+            )
+
+        batch = next(Client._batch_references)
+        self.send_message(
+            IRC_COMMANDS.BATCH,
+            f"+{batch} chathistory {history_channel.get_channel_name()}",
+            include_nick=False,
+        )
+        for msgid, timestamp, line in events:
+            tags = (
+                f"@batch={batch};time={utils.format_server_time(timestamp)}"
+                f";msgid={msgid} "
+            )
+            self.send_raw(tags.encode() + line)
+        self.send_message(IRC_COMMANDS.BATCH, f"-{batch}", include_nick=False)
+
+    @staticmethod
+    def _parse_history_reference(reference: str):
+        """Return ("msgid", id) or ("timestamp", Unix time in milliseconds) for
+        a CHATHISTORY message reference, None if it is neither
+        """
+        kind, _, value = reference.partition("=")
+        if kind == "msgid" and utils.is_number(value):
+            return kind, int(value)
+        if kind == "timestamp":
+            timestamp = utils.parse_server_time(value)
+            if timestamp is not None:
+                return kind, timestamp
+        return None
+
+    def _send_fail(self, command: str, code: str, description: str):
+        """Send an IRCv3 standard reply FAIL about command to client
+
+        https://ircv3.net/specs/extensions/standard-replies
+        """
+        self.send_message(
+            IRC_COMMANDS.FAIL, f"{command} {code} {description}", include_nick=False
+        )
+
+    def _stream_replies(self, replies, end_line: bytes):
+        """Queue replies as the ones before were sent, then end_line
+
+        replies: Iterator of encoded replies, advanced as they are queued
+        """
+        self._end_stream()
+        self._streamed_replies = replies
+        self._stream_end = end_line
+        self._continue_stream()
+
+    def _continue_stream(self):
+        """Queue the next STREAMED_REPLIES_PER_REFILL replies of a LIST or WHO,
+        called by the server once the ones before were sent, and queue its
+        last reply once every reply was queued
+        """
+        num_queued = 0
+        for line in itertools.islice(
+            self._streamed_replies, constants.STREAMED_REPLIES_PER_REFILL
+        ):
+            self.send_raw(line)
+            num_queued += 1
+
+        if num_queued < constants.STREAMED_REPLIES_PER_REFILL:
+            self._end_stream()
+        else:
+            self._key.data.refill = self._continue_stream
+
+    def _end_stream(self):
+        """Queue the last reply of a LIST or WHO in progress, leaving out the
+        replies that are not queued yet
+        """
+        if self._streamed_replies is None:
+            return
+        self.send_raw(self._stream_end)
+        self._streamed_replies = self._stream_end = None
+        self._key.data.refill = None
+
+    def _leave_all_channels(self, send_to_self: bool, reason: str):
         """leave all channels that client is a part of
 
         send_to_self: Set to true if PART messages should be echoed
             to client that is leaving
+        reason: Reason sent along with the PART messages
         """
-        for channel_name, broadcast in self.joined_channels.items():
-            original_channel_name = Client.channels[channel_name].get_channel_name()
+        for joined_channel in self.joined_channels.values():
             self.broadcast_departure(
-                broadcast,
+                joined_channel,
                 self.nick,
-                original_channel_name,
-                "Disconnected",
+                joined_channel.get_channel_name(),
+                reason,
                 send_to_self,
             )
-            Client.channels[channel_name].unregister(self.address)
+            joined_channel.unregister(self.address)
 
-    def broadcast_arrival(self, broadcast: callable, channel_name: str):
+    def broadcast_arrival(self, joined_channel: channel.Channel, channel_name: str):
         """Send JOIN messages announcing that user has arrived"""
-        # Send JOIN message to channel
-        broadcast(
-            numeric=IRC_COMMANDS.JOIN,
-            message=f"{channel_name}",
-            include_nick=False,
-            source=self.nick,
-        )
-        # Send JOIN message to client
-        self.send_message(
-            IRC_COMMANDS.JOIN,
-            message=f"{channel_name}",
-            include_nick=False,
-            source=self.nick,
-        )
+        # Send JOIN message to channel and client
+        joined_channel.broadcast(IRC_COMMANDS.JOIN, channel_name, source=self.nick)
 
     def broadcast_departure(
         self,
-        broadcast: callable,
+        joined_channel: channel.Channel,
         nick: str,
         channel_name: str,
         reason: str,
@@ -459,23 +1103,15 @@ class Client:
         """Send PART messages announcing that user is leaving"""
         if reason != "":
             reason = ":" + reason
-        # Send PART message to channel
-        broadcast(
-            numeric=IRC_COMMANDS.PART,
+        # Send PART message to channel, and to client if send_to_self
+        joined_channel.broadcast(
+            IRC_COMMANDS.PART,
             # https://modern.ircdocs.horse/#part-message
             # message=f"{nick} is leaving the channel {channel_name} {reason}",
-            message=f"{channel_name} {reason}",  # This version passes tests
-            include_nick=False,
+            f"{channel_name} {reason}",  # This version passes tests
             source=self.nick,
+            exclude=None if send_to_self else self.address,
         )
-        if send_to_self:
-            # Send PART message to client
-            self.send_message(
-                IRC_COMMANDS.PART,
-                message=f"{channel_name} {reason}",
-                include_nick=False,
-                source=self.nick,
-            )
 
     def send_topic(self, channel_name):
         """Send topic to client"""
@@ -484,6 +1120,22 @@ class Client:
             topic_code = IRC_REPLIES.TOPIC
             self.send_message(topic_code, message=f": {topic}", include_nick=False)
 
+    def send_names(self, names_channel: channel.Channel, channel_name: str):
+        """Send the nicks of every member of names_channel to client, in as
+        many NAMREPLY lines as they fill
+
+        https://modern.ircdocs.horse/#rplnamreply-353
+        """
+        prefix = (
+            f":{config.SERVER_NAME} {IRC_REPLIES.NAMREPLY} {self.nick}"
+            f" = {channel_name} :"
+        )
+        for line in names_channel.iter_names_lines(prefix.encode()):
+            self.send_raw(line)
+        self.send_message(
+            IRC_REPLIES.ENDOFNAMES, message=f"{channel_name} :End of /NAMES list"
+        )
+
     def send_no_such_channel(self, channel_name: str, include_nick: bool = True):
         """Send NOSUCHCHANNEL error to client"""
         self.send_message(
@@ -516,33 +1168,70 @@ class Client:
             include_nick=include_nick,
         )
 
+    def send_no_privileges(self):
+        """Send NOPRIVILEGES error to client"""
+        self.send_message(
+            IRC_ERRORS.NOPRIVILEGES,
+            ":Permission Denied- You're not an IRC operator",
+        )
+
+    def send_nickname_in_use(self, nick: str):
+        """Send NICKNAME_IN_USE error to client"""
+        self.send_message(
+            IRC_ERRORS.NICKNAME_IN_USE,
+            f"{nick}:Nickname is already in use",
+        )
+
     def send_message(
         self,
         numeric: str,
         message: str,
         include_nick: bool = True,
-        source: str = config.SERVER_NAME,
+        source: str = None,
     ):
-        """Write message to the out buffer of this client instance
+        """Write message to the out queue of this client instance
 
-        Constructs message according to spec below
-        https://modern.ircdocs.horse/#numeric-replies
         numeric: 3 digit code per docs
         message: utf-8 string, optionally terminated with \r\n
         include_nick: Whether to set the target as the current client
-        source: Value to use as source of message
+        source: Value to use as source of message, defaults to the server name
         """
-        message_source = f":{source}"
-        if include_nick:
-            constructed_messsage = f"{message_source} {numeric} {self.nick} {message}"
-        else:
-            constructed_messsage = f"{message_source} {numeric} {message}"
-
-        message_as_bytes = constructed_messsage.encode()
-
-        if not message_as_bytes.endswith(constants.IRC_TERMINATION_DELIMITER):
-            message_as_bytes += constants.IRC_TERMINATION_DELIMITER
+        self.send_raw(
+            utils.encode_message(
+                numeric,
+                message,
+                source if source is not None else config.SERVER_NAME,
+                self.nick if include_nick else None,
+            )
+        )
 
-        self._key.data.out_buffer += message_as_bytes
-        # Set event loop selector to listen for write readiness on socket
-        self._key.data.toggle_writable(self._key.data, True)
+    def send_raw(self, line: bytes):
+        """Write an encoded message to the out queue of this client instance"""
+        key_data = self._key.data
+        key_data.out_queue.append(line)
+        # Have the event loop flush the out queue once per iteration
+        if not key_data.is_dirty:
+            key_data.mark_dirty(self._key)
+
+    # Key: command, Value: handler shared by every client, called with the client
+    _handlers = {
+        IRC_COMMANDS.PING: _handle_ping,
+        IRC_COMMANDS.USER: _handle_user,
+        IRC_COMMANDS.NICK: _handle_nick,
+        IRC_COMMANDS.QUIT: _handle_quit,
+        IRC_COMMANDS.JOIN: _handle_join,
+        IRC_COMMANDS.PART: _handle_part,
+        IRC_COMMANDS.LUSERS: _handle_lusers,
+        IRC_COMMANDS.PRIVMSG: _handle_privmsg,
+        IRC_COMMANDS.MOTD: _handle_motd,
+        IRC_COMMANDS.LIST: _handle_list,
+        IRC_COMMANDS.OPER: _handle_oper,
+        IRC_COMMANDS.STATS: _handle_stats,
+        IRC_COMMANDS.LINKS: _handle_links,
+        IRC_COMMANDS.CONNECT: _handle_connect,
+        IRC_COMMANDS.SQUIT: _handle_squit,
+        IRC_COMMANDS.WHO: _handle_who,
+        IRC_COMMANDS.WHOIS: _handle_whois,
+        IRC_COMMANDS.NAMES: _handle_names,
+        IRC_COMMANDS.CHATHISTORY: _handle_chathistory,
+    }
@@ -2,12 +2,64 @@
 
 https://docs.python.org/3/faq/programming.html#how-do-i-share-global-variables-across-modules
 """
-
+import constants
 
 SERVER_NAME = "pyircd"
 
+# Output queued per connection, in bytes, see constants for details
+SENDQ_LOW_WATERMARK = constants.DEFAULT_SENDQ_LOW_WATERMARK
+SENDQ_HIGH_WATERMARK = constants.DEFAULT_SENDQ_HIGH_WATERMARK
+
+# Flood control of every connection, see constants for details
+FLOOD_BURST = constants.DEFAULT_FLOOD_BURST
+FLOOD_RATE = constants.DEFAULT_FLOOD_RATE
+FLOOD_MAX_HELD = constants.DEFAULT_FLOOD_MAX_HELD
+
+OPERATORS = {}  # Key: operator name, Value: password
+
+# Keepalive of every connection in seconds, see constants for details
+REGISTRATION_TIMEOUT = constants.DEFAULT_REGISTRATION_TIMEOUT
+PING_INTERVAL = constants.DEFAULT_PING_INTERVAL
+PING_TIMEOUT = constants.DEFAULT_PING_TIMEOUT
+
+# Connections accepted per listener in one loop iteration
+ACCEPT_BUDGET = constants.DEFAULT_ACCEPT_BUDGET
+
+# BrokerLink of this worker process when running with --workers, else None
+BROKER_LINK = None
+
+# Network of linked servers when linking is enabled, else None
+NETWORK = None
+
+# HistoryStore keeping the recent events of channels, None if history is off
+HISTORY = None
+
 
-def init(name: str):
+def init(
+    name: str,
+    sendq_low_watermark: int = constants.DEFAULT_SENDQ_LOW_WATERMARK,
+    sendq_high_watermark: int = constants.DEFAULT_SENDQ_HIGH_WATERMARK,
+    operators: dict = None,
+    flood_burst: int = constants.DEFAULT_FLOOD_BURST,
+    flood_rate: float = constants.DEFAULT_FLOOD_RATE,
+    flood_max_held: int = constants.DEFAULT_FLOOD_MAX_HELD,
+    registration_timeout: float = constants.DEFAULT_REGISTRATION_TIMEOUT,
+    ping_interval: float = constants.DEFAULT_PING_INTERVAL,
+    ping_timeout: float = constants.DEFAULT_PING_TIMEOUT,
+    accept_budget: int = constants.DEFAULT_ACCEPT_BUDGET,
+):
     """This method should only be called by the daemon module"""
-    global SERVER_NAME
+    global SERVER_NAME, SENDQ_LOW_WATERMARK, SENDQ_HIGH_WATERMARK, OPERATORS
+    global FLOOD_BURST, FLOOD_RATE, FLOOD_MAX_HELD
+    global REGISTRATION_TIMEOUT, PING_INTERVAL, PING_TIMEOUT, ACCEPT_BUDGET
     SERVER_NAME = name if name is not None else "pyircd"
+    SENDQ_LOW_WATERMARK = sendq_low_watermark
+    SENDQ_HIGH_WATERMARK = sendq_high_watermark
+    OPERATORS = operators if operators is not None else {}
+    FLOOD_BURST = flood_burst
+    FLOOD_RATE = flood_rate
+    FLOOD_MAX_HELD = flood_max_held
+    REGISTRATION_TIMEOUT = registration_timeout
+    PING_INTERVAL = ping_interval
+    PING_TIMEOUT = ping_timeout
+    ACCEPT_BUDGET = accept_budget
@@ -0,0 +1,78 @@
+"""Holds the state kept with every client connection by the servers"""
+import time
+
+from buffers import InputBuffer, OutputQueue
+from flood_control import FloodState
+
+
+class Connection:
+    """State of a client connection, the data of its selector key
+
+    Both backends keep one per connection, so Client can write to out_queue
+    and mark it dirty without knowing which backend is in use.
+    """
+
+    __slots__ = (
+        "address",
+        "in_buffer",
+        "out_queue",
+        "flood",
+        "unregister_socket",
+        "is_dirty",
+        "is_waiting_for_write",
+        "is_reading_paused",
+        "mark_dirty",
+        "close_connection",
+        "connected_at",
+        "is_registered",
+        "last_active_at",
+        "ping_sent_at",
+        "timer",
+        "handshake_started_at",
+        "is_server_link",
+        "refill",
+    )
+
+    is_server_socket = False
+
+    def __init__(
+        self, address: tuple, mark_dirty: callable, close_connection: callable
+    ):
+        """mark_dirty: Called with the key of the connection once it queued
+            output, shared by every connection of a server
+        close_connection: Called with the key and a reason to close the
+            connection, shared like mark_dirty
+        """
+        self.address = address
+        self.in_buffer = InputBuffer()
+        self.out_queue = OutputQueue()
+        self.flood = FloodState()
+        self.unregister_socket = False
+        self.is_dirty = False
+        self.is_waiting_for_write = False
+        self.is_reading_paused = False
+        self.mark_dirty = mark_dirty
+        self.close_connection = close_connection
+        self.connected_at = time.monotonic()
+        self.is_registered = False  # Set by Client
+        # Kept by Keepalive
+        self.last_active_at = self.connected_at
+        self.ping_sent_at = None
+        self.timer = None
+        # perf_counter of the accept while a TLS handshake is in progress
+        self.handshake_started_at = None
+        # Set by Network once the connection is a link to another server
+        self.is_server_link = False
+        # Called by the server once out_queue was sent, while the client
+        # queues replies as they are sent, like those of a LIST
+        self.refill = None
+
+
+class TransportKey:
+    """Key of a connection served by asyncio, shaped like a SelectorKey"""
+
+    __slots__ = ("fileobj", "data")
+
+    def __init__(self, fileobj, data: Connection):
+        self.fileobj = fileobj
+        self.data = data
@@ -2,9 +2,19 @@
 from enum import Enum, unique
 
 
+class StrEnum(str, Enum):
+    """Enum whose members format as their value on every supported Python
+
+    Python 3.11 formats mixed in enums as `Class.MEMBER` in f-strings
+    """
+
+    def __str__(self):
+        return str.__str__(self)
+
+
 # Use str as value in enums: https://docs.python.org/3/library/enum.html#notes
 @unique
-class IRC_COMMANDS(str, Enum):
+class IRC_COMMANDS(StrEnum):
     NICK = "NICK"
     USER = "USER"
     PASS = "PASS"
@@ -18,10 +28,26 @@ class IRC_COMMANDS(str, Enum):
     PRIVMSG = "PRIVMSG"
     MOTD = "MOTD"
     LIST = "LIST"
+    OPER = "OPER"
+    STATS = "STATS"
+    NOTICE = "NOTICE"
+    LINKS = "LINKS"
+    CONNECT = "CONNECT"
+    SQUIT = "SQUIT"
+    # Server to server, https://www.rfc-editor.org/rfc/rfc2813
+    SERVER = "SERVER"
+    NJOIN = "NJOIN"
+    TOPIC = "TOPIC"
+    NAMES = "NAMES"
+    WHO = "WHO"
+    WHOIS = "WHOIS"
+    CHATHISTORY = "CHATHISTORY"
+    BATCH = "BATCH"
+    FAIL = "FAIL"
 
 
 @unique
-class IRC_ERRORS(str, Enum):
+class IRC_ERRORS(StrEnum):
     NOSUCHNICK = "401"
     NOSUCHCHANNEL = "403"
     NO_NICKNAME_GIVEN = "431"
@@ -33,11 +59,13 @@ class IRC_ERRORS(str, Enum):
     BADCHANMASK = "476"
     USERONCHANNEL = "443"
     NOSUCHSERVER = "402"
+    PASSWDMISMATCH = "464"
+    NOPRIVILEGES = "481"
 
 
 # https://modern.ircdocs.horse/#numerics
 @unique
-class IRC_REPLIES(str, Enum):
+class IRC_REPLIES(StrEnum):
     WELCOME = "001"
     YOURHOST = "002"
     CREATED = "003"
@@ -54,23 +82,48 @@ class IRC_REPLIES(str, Enum):
     LIST = "322"
     LISTSTART = "321"
     LISTEND = "323"
+    STATSLINKINFO = "211"
+    STATSCOMMANDS = "212"
+    STATSDEBUG = "249"
+    ENDOFSTATS = "219"
+    YOUREOPER = "381"
+    LINKS = "364"
+    ENDOFLINKS = "365"
+    WHOREPLY = "352"
+    ENDOFWHO = "315"
+    WHOISUSER = "311"
+    WHOISSERVER = "312"
+    WHOISOPERATOR = "313"
+    WHOISCHANNELS = "319"
+    ENDOFWHOIS = "318"
 
 
 @unique
-class SERVER_EVENTS(str, Enum):
+class SERVER_EVENTS(StrEnum):
+    CONNECT = "CONNECT"
     DISCONNECT = "DISCONNECT"
 
 
+# Every connection has one flood control bucket per class
+@unique
+class FLOOD_CLASSES(StrEnum):
+    MESSAGE = "message"
+    COMMAND = "command"
+
+
 # https://modern.ircdocs.horse/#message-format
 IRC_TERMINATION_DELIMITER = b"\r\n"
 
-EMPTY_STRING = b""
-
 # Most IRC servers limit messages to 512 bytes in length
 # https://modern.ircdocs.horse/#message-format
-RECEIVE_LENGTH = 1024
+RECEIVE_LENGTH = 16384
 MAX_LINE_LENGTH = 512
 
+# Most unterminated data a connection may buffer before it is closed
+# IRCv3 allows up to 8191 bytes of message tags on top of MAX_LINE_LENGTH
+# https://ircv3.net/specs/extensions/message-tags#size-limit
+MAX_IN_BUFFER_LENGTH = 8191 + MAX_LINE_LENGTH
+
 # +1 for \n since find gives us index of \r
 # +1 bc end index is not inclusive
 DELIMITER_END_OFFSET = 2
@@ -78,54 +131,194 @@ DELIMITER_END_OFFSET = 2
 # -1 is returned by find when not found
 NOT_FOUND = -1
 
+# -1 is returned by socket.fileno once the socket is closed
+CLOSED_FILENO = -1
+
 LOCAL_HOST = "127.0.0.1"
 DEFAULT_PORT = 6667
+DEFAULT_BACKEND = "selectors"
+
+# Connections the kernel queues per listener until they are accepted, it caps
+# the backlog at net.core.somaxconn
+DEFAULT_LISTEN_BACKLOG = 1024
+# Connections accepted per listener in one loop iteration, so a reconnect
+# storm is drained quickly without starving clients that are connected
+DEFAULT_ACCEPT_BUDGET = 64
+
+# Bytes of output queued for a connection before it stops being read from
+# and before it is disconnected for not reading what it is sent
+DEFAULT_SENDQ_LOW_WATERMARK = 64 * 1024
+DEFAULT_SENDQ_HIGH_WATERMARK = 1024 * 1024
+SENDQ_EXCEEDED = "Max SendQ exceeded"
+
+# Tokens per connection and class, refilled per second, and number of lines
+# held while a connection is out of tokens before further lines are dropped
+DEFAULT_FLOOD_BURST = 20
+DEFAULT_FLOOD_RATE = 10
+DEFAULT_FLOOD_MAX_HELD = 64
+
+# Commands that are not listed use FLOOD_CLASSES.COMMAND
+FLOOD_COMMAND_CLASSES = {
+    IRC_COMMANDS.PRIVMSG: FLOOD_CLASSES.MESSAGE,
+}
+
+# Tokens a command costs, commands that are not listed cost 1.
+# PRIVMSG and JOIN cost their penalty once per target.
+FLOOD_PENALTIES = {
+    IRC_COMMANDS.CHATHISTORY: 5,
+    IRC_COMMANDS.JOIN: 2,
+    IRC_COMMANDS.LIST: 5,
+    IRC_COMMANDS.LUSERS: 2,
+    IRC_COMMANDS.MOTD: 2,
+    IRC_COMMANDS.NAMES: 2,
+    IRC_COMMANDS.STATS: 5,
+    IRC_COMMANDS.WHO: 5,
+    IRC_COMMANDS.WHOIS: 2,
+}
+
+# Upper bounds in seconds of the buckets of command handler durations
+LATENCY_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.1,
+)
+
+# Seconds over which the event loop wakeup rate is reported
+WAKEUP_RATE_WINDOW = 10
+
+# Seconds a metrics scraper may take to send its request
+METRICS_REQUEST_TIMEOUT = 0.5
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds a connection may take to register, may stay silent before it is
+# sent a PING, and then may take to answer before it is disconnected
+DEFAULT_REGISTRATION_TIMEOUT = 60
+DEFAULT_PING_INTERVAL = 120
+DEFAULT_PING_TIMEOUT = 60
+REGISTRATION_TIMED_OUT = "Registration timeout"
+
+# Timer wheel of keepalive timers, its slots cover one tick of WHEEL_RESOLUTION
+# seconds in the first level and WHEEL_SLOTS times as long in every further one
+WHEEL_RESOLUTION = 1.0
+WHEEL_BITS = 6
+WHEEL_SLOTS = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SLOTS - 1
+WHEEL_LEVELS = 4
+
+# Seconds a hot restart may take to hand over to the new process
+HOT_RESTART_TIMEOUT = 10
+
+# Events returned by a single epoll.poll call of the epoll backend
+EPOLL_MAX_EVENTS = 4096
+
+# TLS handshakes stepped per loop iteration, after the events of connected
+# clients were handled. Stalled handshakes run into the registration timeout,
+# with the asyncio backend into TLS_HANDSHAKE_TIMEOUT seconds
+TLS_HANDSHAKE_BUDGET = 32
+TLS_HANDSHAKE_TIMEOUT = 10
+# Session tickets sent after a full handshake, a client resumes with one of them
+TLS_NUM_TICKETS = 2
+# Plaintext encrypted by a single write, as much as one TLS record holds
+TLS_WRITE_LENGTH = 16384
+# Upper bounds in seconds of the buckets of TLS handshake durations
+TLS_HANDSHAKE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+# LIST and WHO replies queued at once, the next ones once they were sent, so
+# listing every channel or user neither stalls the loop nor fills the SendQ of
+# the client
+STREAMED_REPLIES_PER_REFILL = 256
+
+# Channel history kept for CHATHISTORY: events per channel and bytes of all
+# channels, see history.py
+DEFAULT_HISTORY_SIZE = 100
+DEFAULT_HISTORY_BUDGET = 16 * 1024 * 1024
+# Bytes an event is counted for besides its line, the objects holding it, and
+# bytes a channel is counted for once it has a history
+HISTORY_ENTRY_OVERHEAD = 160
+HISTORY_CHANNEL_OVERHEAD = 640
+# Commands of lines sent to channel members that are kept in history
+HISTORY_COMMANDS = frozenset(
+    [IRC_COMMANDS.PRIVMSG, IRC_COMMANDS.JOIN, IRC_COMMANDS.PART]
+)
+# Events a single CHATHISTORY returns at most
+CHATHISTORY_MAX_LIMIT = 100
+
+# Seconds between attempts to link to a --connect peer that is not linked
+LINK_RECONNECT_INTERVAL = 30
+# Bytes of output queued for a server link before it is dropped, the burst of a
+# large network is queued at once
+LINK_SENDQ_HIGH_WATERMARK = 16 * 1024 * 1024
+# Bytes of nicks in a single NJOIN line of a burst
+NJOIN_LENGTH = 400
+NICK_COLLISION = "Nick collision"
+
+# Reason given to channels when a client disconnects without QUIT
+DEFAULT_DISCONNECT_REASON = "Disconnected"
 
 ACCEPTED_ACTIONS = ["PARSE"]
 
+# Number of casefolded nicks and targets kept by utils.irc_lower
+CASEFOLD_CACHE_SIZE = 65536
+
+# Messages held per client while a nick claim waits for the broker
+MAX_HELD_MESSAGES = 32
+
 # Based on https://modern.ircdocs.horse/#client-messages
-VALID_ALPHA_COMMANDS = [
-    "CAP",
-    "AUTHENTICATE",
-    "PASS",
-    "NICK",
-    "USER",
-    "PING",
-    "PONG",
-    "OPER",
-    "QUIT",
-    "ERROR",
-    "JOIN",
-    "PART",
-    "TOPIC",
-    "NAMES",
-    "LIST",
-    "INVITE",
-    "KICK",
-    "MOTD",
-    "VERSION",
-    "ADMIN",
-    "CONNECT",
-    "TIME",
-    "STATS",
-    "HELP",
-    "INFO",
-    "MODE",
-    "PRIVMSG",
-    "NOTICE",
-    "WHO",
-    "WHOIS",
-    "WHOWAS",
-    "KILL",
-    "REHASH",
-    "RESTART",
-    "SQUIT",
-    "AWAY",
-    "LINKS",
-    "USERHOST",
-    "WALLOPS",
-    "LUSERS",
-]
+VALID_ALPHA_COMMANDS = frozenset(
+    [
+        "CAP",
+        "AUTHENTICATE",
+        "PASS",
+        "NICK",
+        "USER",
+        "PING",
+        "PONG",
+        "OPER",
+        "QUIT",
+        "ERROR",
+        "JOIN",
+        "PART",
+        "TOPIC",
+        "NAMES",
+        "LIST",
+        "INVITE",
+        "KICK",
+        "MOTD",
+        "VERSION",
+        "ADMIN",
+        "CONNECT",
+        "TIME",
+        "STATS",
+        "HELP",
+        "INFO",
+        "MODE",
+        "PRIVMSG",
+        "NOTICE",
+        "WHO",
+        "WHOIS",
+        "WHOWAS",
+        "KILL",
+        "REHASH",
+        "RESTART",
+        "SQUIT",
+        "AWAY",
+        "LINKS",
+        "USERHOST",
+        "WALLOPS",
+        "LUSERS",
+        # https://ircv3.net/specs/extensions/chathistory
+        "CHATHISTORY",
+    ]
+)
 
 # https://modern.ircdocs.horse/#channels
 FORBIDDEN_CHANNELNAME_CHARS = [
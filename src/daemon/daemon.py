@@ -1,15 +1,43 @@
 """This module sets up the event bus, parser and starts the server"""
+import atexit
 import logging
 import logging.config
-from argparse import ArgumentParser, Namespace
+import logging.handlers
+import os
+import queue
+import select
+import signal
+import socket
+import ssl
+import sys
+import tempfile
+from argparse import SUPPRESS, ArgumentParser, Namespace
 
 import config
 import constants
 import utils
 import yaml
+from async_server import AsyncServer
+from broker import Broker, BrokerLink
+from flood_control import FloodControl
+from history import HistoryStore
+from hot_restart import RESUME_OPTION, HotRestart, resume
+from keepalive import Keepalive
+from listener import Listener
 from message_bus import MessageBus
+from metrics import MetricsEndpoint
+from network import Network
 from parser import Parser
 from server import Server
+from tls import TlsContext
+
+BACKENDS = {"selectors": Server, "asyncio": AsyncServer}
+if hasattr(select, "epoll"):  # Linux only
+    from epoll_server import EpollServer
+
+    BACKENDS["epoll"] = EpollServer
+
+LOG_LISTENERS = []  # QueueListeners running the configured handlers, if any
 
 
 def parse_args() -> Namespace:
@@ -30,6 +58,41 @@ def parse_args() -> Namespace:
         help="Port to listen on",
         default=constants.DEFAULT_PORT,
     )
+    parser.add_argument(
+        "--listen",
+        action="append",
+        metavar="ADDRESS[,OPTION...]",
+        help="Accept clients on HOST:PORT, [IPV6]:PORT or unix:PATH instead of "
+        "--host and --port, can be repeated. Options: backlog=N, nodelay, "
+        "keepalive[=IDLE_SECONDS], sndbuf=BYTES, rcvbuf=BYTES, tls",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        required=False,
+        help="Connections queued by the kernel per listener until accepted",
+        default=constants.DEFAULT_LISTEN_BACKLOG,
+    )
+    parser.add_argument(
+        "--accept-budget",
+        type=int,
+        required=False,
+        help="Connections accepted per listener in one event loop iteration",
+        default=constants.DEFAULT_ACCEPT_BUDGET,
+    )
+    parser.add_argument(
+        "--tls-cert",
+        type=str,
+        required=False,
+        help="PEM certificate chain of listeners with the tls option, including "
+        "the private key unless --tls-key is given. Reloaded on SIGHUP",
+    )
+    parser.add_argument(
+        "--tls-key",
+        type=str,
+        required=False,
+        help="PEM private key of --tls-cert",
+    )
     parser.add_argument(
         "--name",
         type=str,
@@ -37,30 +100,458 @@ def parse_args() -> Namespace:
         help="Name of server",
         default="pyircd",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        choices=BACKENDS.keys(),
+        help="Event loop used to serve client connections",
+        default=constants.DEFAULT_BACKEND,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        help="Number of worker processes sharing the port through SO_REUSEPORT",
+        default=1,
+    )
+    parser.add_argument(
+        "--sendq-low",
+        type=int,
+        required=False,
+        help="Queued output in bytes above which a client's input is not read",
+        default=constants.DEFAULT_SENDQ_LOW_WATERMARK,
+    )
+    parser.add_argument(
+        "--sendq-high",
+        type=int,
+        required=False,
+        help="Queued output in bytes above which a client is disconnected",
+        default=constants.DEFAULT_SENDQ_HIGH_WATERMARK,
+    )
+    parser.add_argument(
+        "--oper",
+        type=str,
+        required=False,
+        action="append",
+        metavar="NAME:PASSWORD",
+        help="Operator credentials accepted by OPER, may be given multiple times",
+        default=[],
+    )
+    parser.add_argument(
+        "--flood-burst",
+        type=int,
+        required=False,
+        help="Commands a client may send at once before it is throttled",
+        default=constants.DEFAULT_FLOOD_BURST,
+    )
+    parser.add_argument(
+        "--flood-rate",
+        type=float,
+        required=False,
+        help="Commands per second a throttled client may send, 0 disables "
+        "flood control",
+        default=constants.DEFAULT_FLOOD_RATE,
+    )
+    parser.add_argument(
+        "--flood-max-held",
+        type=int,
+        required=False,
+        help="Commands held per throttled client before further ones are dropped",
+        default=constants.DEFAULT_FLOOD_MAX_HELD,
+    )
+    parser.add_argument(
+        "--registration-timeout",
+        type=float,
+        required=False,
+        help="Seconds a client may take to register before it is disconnected",
+        default=constants.DEFAULT_REGISTRATION_TIMEOUT,
+    )
+    parser.add_argument(
+        "--ping-interval",
+        type=float,
+        required=False,
+        help="Seconds a client may stay silent before it is sent a PING, 0 "
+        "disables keepalive",
+        default=constants.DEFAULT_PING_INTERVAL,
+    )
+    parser.add_argument(
+        "--ping-timeout",
+        type=float,
+        required=False,
+        help="Seconds a client may take to answer a PING before it is disconnected",
+        default=constants.DEFAULT_PING_TIMEOUT,
+    )
+    parser.add_argument(
+        "--history-size",
+        type=int,
+        required=False,
+        help="Recent JOIN, PART and PRIVMSG events kept per channel for "
+        "CHATHISTORY, 0 disables history",
+        default=constants.DEFAULT_HISTORY_SIZE,
+    )
+    parser.add_argument(
+        "--history-budget",
+        type=int,
+        required=False,
+        help="Bytes the history of all channels may hold, the history of the "
+        "channels used least recently is dropped first",
+        default=constants.DEFAULT_HISTORY_BUDGET,
+    )
+    parser.add_argument(
+        "--hot-restart",
+        action="store_true",
+        help="On SIGUSR2, hand every client over to a new daemon process started "
+        "with the same options instead of dropping them",
+    )
+    parser.add_argument(
+        "--link-password",
+        type=str,
+        required=False,
+        help="Link with other daemons into one network, this password is sent to "
+        "them and expected from them",
+    )
+    parser.add_argument(
+        "--connect",
+        type=str,
+        required=False,
+        action="append",
+        metavar="HOST:PORT",
+        help="Link with the daemon at HOST:PORT, retried while it is not linked, "
+        "may be given multiple times",
+        default=[],
+    )
+    # Set by the daemon that hands its clients over to this one
+    parser.add_argument(RESUME_OPTION, type=int, required=False, help=SUPPRESS)
+    metrics = parser.add_mutually_exclusive_group()
+    metrics.add_argument(
+        "--metrics-port",
+        type=int,
+        required=False,
+        help="Serve Prometheus metrics over HTTP on this loopback port",
+    )
+    metrics.add_argument(
+        "--metrics-socket",
+        type=str,
+        required=False,
+        help="Serve Prometheus metrics over HTTP on a Unix socket at this path",
+    )
+    args = parser.parse_args()
+
+    if not 0 < args.sendq_low <= args.sendq_high:
+        parser.error("--sendq-low must be positive and not exceed --sendq-high")
+    if any(":" not in oper for oper in args.oper):
+        parser.error("--oper must be given as NAME:PASSWORD")
+    if args.flood_rate < 0 or args.flood_burst < 1 or args.flood_max_held < 0:
+        parser.error("--flood-* options must not be negative")
+    if args.ping_interval < 0 or args.ping_timeout <= 0:
+        parser.error("--ping-interval must not be negative, --ping-timeout positive")
+    if args.registration_timeout <= 0:
+        parser.error("--registration-timeout must be positive")
+    if args.hot_restart and (args.backend == "asyncio" or args.workers > 1):
+        parser.error("--hot-restart requires one worker and no asyncio backend")
+    if args.backlog < 1 or args.accept_budget < 1:
+        parser.error("--backlog and --accept-budget must be positive")
+    # The budget holds at least the history of the channel written last
+    event_size = constants.MAX_LINE_LENGTH + constants.HISTORY_ENTRY_OVERHEAD
+    if args.history_size < 0 or args.history_budget < (
+        args.history_size * event_size + constants.HISTORY_CHANNEL_OVERHEAD
+    ):
+        parser.error(
+            f"--history-size must not be negative, --history-budget must be at "
+            f"least {event_size} bytes per event of --history-size and "
+            f"{constants.HISTORY_CHANNEL_OVERHEAD} bytes"
+        )
+
+    args.peers = []
+    for peer in args.connect:
+        host, _, port = peer.rpartition(":")
+        port = utils.parse_port(port)
+        if not host or port is None:
+            parser.error("--connect must be given as HOST:PORT")
+        args.peers.append((host.removeprefix("[").removesuffix("]"), port))
+    if args.peers and args.link_password is None:
+        parser.error("--connect requires --link-password")
+    # Linked servers see a single process without handed over clients
+    if args.link_password is not None and (
+        args.backend == "asyncio" or args.workers > 1 or args.hot_restart
+    ):
+        parser.error(
+            "--link-password requires one worker, no asyncio backend and no "
+            "--hot-restart"
+        )
+
+    args.tls = None
+    if args.tls_cert is not None:
+        try:
+            args.tls = TlsContext(args.tls_cert, args.tls_key)
+        except (OSError, ssl.SSLError) as e:
+            parser.error(f"--tls-cert: {e}")
+    elif args.tls_key is not None:
+        parser.error("--tls-key requires --tls-cert")
+
+    try:
+        args.listeners = [
+            Listener.parse(value, args.backlog, args.tls)
+            for value in args.listen or [f"{args.host}:{args.port}"]
+        ]
+    except ValueError as e:
+        parser.error(f"--listen: {e}")
+    # The handshake state of TLS clients cannot be handed over
+    if args.hot_restart and any(listener.tls for listener in args.listeners):
+        parser.error("--hot-restart does not support listeners with the tls option")
+
+    return args
 
 
 def setup_logging():
+    """Configure logging as described by logging_config.yml
+
+    With background_handlers set in the file, the configured handlers write
+    from background threads, see move_handlers_to_background
+    """
     with open("logging_config.yml", "rt") as f:
         config = yaml.safe_load(f.read())
 
+    background_handlers = config.pop("background_handlers", False)
     logging.config.dictConfig(config)
+    if background_handlers:
+        move_handlers_to_background()
+
+
+def move_handlers_to_background():
+    """Put a QueueHandler in place of every configured handler
+
+    The QueueHandler merges the arguments of a record into its message and
+    puts it on a queue. A QueueListener thread per handler takes records off
+    the queue and writes them, so the event loop never waits for a terminal
+    or a file.
+    """
+    queue_handlers = {}  # Key: configured handler, Value: its QueueHandler
+    loggers = [logging.getLogger()] + [
+        logger
+        for logger in logging.root.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        for i, handler in enumerate(logger.handlers):
+            if handler not in queue_handlers:
+                records = queue.SimpleQueue()
+                queue_handlers[handler] = logging.handlers.QueueHandler(records)
+                LOG_LISTENERS.append(
+                    logging.handlers.QueueListener(
+                        records, handler, respect_handler_level=True
+                    )
+                )
+            logger.handlers[i] = queue_handlers[handler]
+
+    start_log_listeners()
+    atexit.register(stop_log_listeners)
+    # Threads do not survive fork, workers start listeners of their own
+    os.register_at_fork(after_in_child=start_log_listeners)
+
+
+def start_log_listeners():
+    """Start a thread for every QueueListener"""
+    for listener in LOG_LISTENERS:
+        listener.start()
+
+
+def stop_log_listeners():
+    """Write the records still queued and stop the QueueListener threads"""
+    for listener in LOG_LISTENERS:
+        listener.stop()
+
+
+def create_metrics_endpoint(args: Namespace, worker: int = None):
+    """Return the MetricsEndpoint asked for on the command line, if any
+
+    Every worker serves its own metrics, on the port after the previous
+    worker's port or on the socket path suffixed with its number
+    """
+    if args.metrics_port is not None:
+        return MetricsEndpoint(port=args.metrics_port + (worker or 0))
+    if args.metrics_socket is not None:
+        suffix = "" if worker is None else f".{worker}"
+        return MetricsEndpoint(path=args.metrics_socket + suffix)
+    return None
+
+
+def combine_ticks(ticks: list):
+    """Return a tick that calls every one of ticks, or None if there is none
+
+    The combined tick asks to be called again after the shortest delay any
+    of ticks asked for
+    """
+    if len(ticks) <= 1:
+        return ticks[0] if ticks else None
+
+    def tick():
+        delays = [delay for delay in (tick() for tick in ticks) if delay is not None]
+        return min(delays, default=None)
+
+    return tick
+
+
+def serve(
+    args: Namespace, reuse_port: bool = False, broker_link=None, worker: int = None
+):
+    """Setup event_bus and parser, then serve clients until the server stops
+
+    Parsed messages pass keepalive and flood control on their way to the
+    event bus, unless they are disabled with --ping-interval 0 and
+    --flood-rate 0
+
+    With --hot-restart the clients of the previous daemon are taken over,
+    before anything else binds the ports it still holds
+    """
+    backend_options = {}
+    if args.hot_restart:
+        if args.resume_fd is not None:
+            connections = resume(args.resume_fd, args.listeners)
+        else:
+            for listener in args.listeners:
+                listener.listen()
+            connections = ()
+        backend_options.update(connections=connections)
+
+    message_bus = MessageBus()
+    dispatch, ticks = message_bus.dispatch, []
+    if config.FLOOD_RATE:
+        flood_control = FloodControl(dispatch)
+        dispatch = flood_control.dispatch
+        ticks.append(flood_control.release_held)
+    if config.PING_INTERVAL:
+        keepalive = Keepalive(dispatch)
+        dispatch = keepalive.dispatch
+        ticks.append(keepalive.tick)
+    parser = Parser(dispatch)
+
+    if args.history_size:
+        config.HISTORY = HistoryStore(args.history_size, args.history_budget)
+
+    if args.link_password is not None:
+        config.NETWORK = Network(args.link_password, args.peers)
+        backend_options.update(on_start=config.NETWORK.start)
+        ticks.append(config.NETWORK.tick)
+
+    if args.tls is not None:
+        signal.signal(signal.SIGHUP, lambda *_: args.tls.reload())
+
+    readers = [] if broker_link is None else [broker_link]
+    if args.hot_restart:
+        readers.append(HotRestart(args.listeners, before_exit=stop_log_listeners))
+    metrics_endpoint = create_metrics_endpoint(args, worker)
+    if metrics_endpoint is not None:
+        readers.append(metrics_endpoint)
+
+    try:
+        BACKENDS[args.backend](
+            args.host,
+            args.port,
+            parser.dispatch,
+            reuse_port=reuse_port,
+            readers=readers,
+            tick=combine_ticks(ticks),
+            listeners=args.listeners,
+            **backend_options,
+        )
+    finally:
+        if metrics_endpoint is not None:
+            metrics_endpoint.close()
+        for listener in args.listeners:
+            listener.close()
+
+
+def run_workers(args: Namespace):
+    """Fork workers that share the port and run the broker in this process"""
+    logger = logging.getLogger(__name__)
+    broker_dir = tempfile.mkdtemp(prefix="pyircd-")
+    broker_path = os.path.join(broker_dir, "broker.sock")
+    broker = Broker(broker_path)
+
+    # Workers share Unix sockets, they listen on ports of their own
+    for listener in args.listeners:
+        if listener.family == socket.AF_UNIX:
+            listener.listen()
+
+    workers = []
+    for worker in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            broker.close()
+            config.BROKER_LINK = BrokerLink(broker_path)
+            try:
+                serve(
+                    args,
+                    reuse_port=True,
+                    broker_link=config.BROKER_LINK,
+                    worker=worker,
+                )
+            finally:
+                # os._exit skips atexit, write the queued records now
+                stop_log_listeners()
+                os._exit(0)
+        workers.append(pid)
+
+    logger.info(f"Started workers {workers}")
+
+    # Run the cleanup below when asked to terminate
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    if args.tls is not None:
+        signal.signal(signal.SIGHUP, lambda *_: signal_workers(workers, signal.SIGHUP))
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ChildProcessError, ProcessLookupError):
+                pass
+        os.unlink(broker_path)
+        os.rmdir(broker_dir)
+        for listener in args.listeners:
+            listener.close()
+
+
+def signal_workers(workers: list, signal_number: int):
+    """Send signal_number to every worker that is still running"""
+    for pid in workers:
+        try:
+            os.kill(pid, signal_number)
+        except ProcessLookupError:
+            pass
 
 
 def main() -> None:
-    """Get parsed commandline arguments, setup event_bus, parser and start server"""
+    """Get parsed commandline arguments and start the server or its workers"""
     setup_logging()
 
     args = parse_args()
-    host, port, name = args.host, args.port, args.name
 
     utils.print_logo()
 
-    config.init(name)
+    config.init(
+        args.name,
+        sendq_low_watermark=args.sendq_low,
+        sendq_high_watermark=args.sendq_high,
+        operators=dict(oper.split(":", 1) for oper in args.oper),
+        flood_burst=args.flood_burst,
+        flood_rate=args.flood_rate,
+        flood_max_held=args.flood_max_held,
+        registration_timeout=args.registration_timeout,
+        ping_interval=args.ping_interval,
+        ping_timeout=args.ping_timeout,
+        accept_budget=args.accept_budget,
+    )
 
-    message_bus = MessageBus()
-    parser = Parser(message_bus.dispatch)
-    Server(host, port, parser.dispatch)
+    if args.workers > 1:
+        run_workers(args)
+    else:
+        serve(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+"""Epoll server module, a Linux only alternative to the selectors based Server
+
+Client sockets are registered once, edge-triggered for both reading and
+writing, and their interest is never modified. A read event is drained until
+the socket would block. A write event only arrives after the socket buffer
+filled up and drained again, which is when Server would have waited for write
+readiness.
+Connections are looked up in a list indexed by file descriptor instead of the
+mappings of a selector.
+"""
+import select
+import socket
+import traceback
+
+import config
+import constants
+from connection import TransportKey
+from metrics import Metrics
+from server import Server
+
+CLIENT_EVENTS = select.EPOLLIN | select.EPOLLOUT | select.EPOLLRDHUP | select.EPOLLET
+READ_EVENTS = select.EPOLLIN | select.EPOLLRDHUP | select.EPOLLHUP | select.EPOLLERR
+
+
+class EpollServer(Server):
+    """Server that drives select.epoll directly
+
+    Messages are dispatched exactly like Server does. Keys are TransportKeys,
+    so Client sees the same fileobj and data as with the other backends.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        """Take the arguments of Server"""
+        self._epoll = None  # Created once the server starts
+        # Key: file descriptor, Value: TransportKey or None, grown on demand.
+        # Listeners are the data of their keys, readers have None
+        self._keys = []
+        super().__init__(*args, **kwargs)
+
+    def _set_interest(
+        self, key: TransportKey, is_waiting_for_write: bool, is_reading_paused: bool
+    ):
+        """Resume reading once the client read enough of its output
+
+        Interest never changes, output left in out_queue is sent on the next
+        write event. Data that arrived while reading was paused did not cause
+        an event, so it is read right away.
+        """
+        key_data = key.data
+        was_reading_paused = key_data.is_reading_paused
+        key_data.is_waiting_for_write = is_waiting_for_write
+        key_data.is_reading_paused = is_reading_paused
+        if was_reading_paused and not is_reading_paused:
+            self._receive_and_buffer_data(key)
+
+    def _register_socket(self, client_connection: socket.socket, connection):
+        """Wait for data on client_connection, return its key"""
+        key = TransportKey(client_connection, connection)
+        self._add_key(key, CLIENT_EVENTS)
+        return key
+
+    def _add_key(self, key: TransportKey, events: int):
+        """Register the socket of key with epoll and index key by its fd"""
+        fd = key.fileobj.fileno()
+        if fd >= len(self._keys):
+            self._keys.extend([None] * (fd + 1 - len(self._keys)))
+        self._keys[fd] = key
+        self._epoll.register(fd, events)
+
+    def _unregister_and_close(self, key: TransportKey):
+        """Stop waiting for events on the socket of key and close it"""
+        fd = key.fileobj.fileno()
+        self._epoll.unregister(fd)
+        self._keys[fd] = None
+        key.fileobj.close()
+
+    def _receive_and_buffer_data(self, key: TransportKey):
+        """Receive like Server and note when reading stopped before the socket
+        would block, since no further event arrives for data already received
+        """
+        super()._receive_and_buffer_data(key)
+        key_data = key.data
+        if len(key_data.out_queue) > config.SENDQ_LOW_WATERMARK:
+            key_data.is_reading_paused = True
+
+    def _service_existing_connection(self, key: TransportKey, events: int):
+        """Handle read or write event on existing connection"""
+        key_data = key.data
+        if key_data.handshake_started_at is not None:
+            self._handshake_keys[key.fileobj.fileno()] = key
+            return
+
+        if events & READ_EVENTS and not key_data.is_reading_paused:
+            self._receive_and_buffer_data(key)
+
+        # Connection may have been closed while reading
+        if key.fileobj.fileno() == constants.CLOSED_FILENO:
+            return
+
+        if events & select.EPOLLOUT and key_data.is_waiting_for_write:
+            self._send_response(key)
+
+    def _set_handshake_interest(self, key: TransportKey, is_waiting_for_write: bool):
+        """Nothing to change, both events of the handshake arrive anyway"""
+
+    def _start_server(self):
+        """Initialize server socket and call event_loop initialization"""
+        self._epoll = select.epoll()
+        # Listeners stay level-triggered, clients left over once the accept
+        # budget is spent wake the next iteration. Readers may not read
+        # everything they are woken for either
+        for listener in self._listeners:
+            if listener.socket is None:
+                listener.listen(self._reuse_port)
+            self._logger.info(f"Listening on {listener}")
+            self._add_key(TransportKey(listener.socket, listener), select.EPOLLIN)
+
+        for reader in self._readers.values():
+            self._add_key(TransportKey(reader, None), select.EPOLLIN)
+
+        for client_connection, connection in self._connections:
+            self._register_connection(client_connection, connection)
+        self._connections = ()
+
+        if self._on_start is not None:
+            self._on_start(self)
+        self._run_event_loop()
+
+    def _run_event_loop(self):
+        """Wait for sockets to register events and handle appropriately"""
+        timeout = -1
+        keys, poll = self._keys, self._epoll.poll
+        try:
+            while True:
+                events = poll(timeout, constants.EPOLL_MAX_EVENTS)
+                Metrics.num_wakeups += 1
+
+                for fd, event_mask in events:
+                    key = keys[fd]
+                    if key is None:  # Closed by an earlier event of this batch
+                        continue
+                    data = key.data
+                    if data is None:
+                        key.fileobj.handle_readable()
+                    elif data.is_server_socket:
+                        self._handle_new_client_connection(data)
+                    else:
+                        self._service_existing_connection(key, event_mask)
+
+                if self._handshake_keys:
+                    self._step_handshakes()
+
+                timeout = -1
+                if self._tick is not None:
+                    delay = self._tick()
+                    timeout = -1 if delay is None else delay
+
+                self._flush_dirty_connections()
+                # Reading resumed by a flush may have queued further output,
+                # handshakes beyond the budget continue without waiting
+                if self._dirty_keys or self._handshake_keys:
+                    timeout = 0
+
+        except Exception as e:
+            self._logger.debug(f"Exception in event loop: {e}")
+            traceback.print_exc()
+        finally:
+            self._epoll.close()
@@ -0,0 +1,171 @@
+"""This module throttles connections that send commands faster than allowed
+
+FloodControl sits between Parser and MessageBus. Every connection has a token
+bucket per command class, see constants.FLOOD_CLASSES. A command takes its
+penalty in tokens from the bucket of its class. Once a bucket runs dry the
+connection's commands are held in order and released as the bucket refills.
+Commands received while the held queue is full are dropped. Linked servers
+relay the commands of all their users and are not throttled.
+"""
+import logging
+import time
+from collections import deque
+
+import config
+import constants
+from constants import IRC_COMMANDS, SERVER_EVENTS
+from message import Message
+
+
+def get_cost(message: Message) -> tuple:
+    """Return the flood class of message and the tokens it costs"""
+    command = message.command
+    flood_class = constants.FLOOD_COMMAND_CLASSES.get(
+        command, constants.FLOOD_CLASSES.COMMAND
+    )
+    penalty = constants.FLOOD_PENALTIES.get(command, 1)
+
+    if command == IRC_COMMANDS.PRIVMSG:
+        targets = message.parameters[:-1]  # Last parameter is the text
+    elif command == IRC_COMMANDS.JOIN:
+        targets = message.parameters
+    else:
+        return flood_class, penalty
+
+    num_targets = sum(target.count(",") + 1 for target in targets)
+    return flood_class, penalty * max(num_targets, 1)
+
+
+class TokenBucket:
+    """Holds up to burst tokens and refills rate tokens per second"""
+
+    __slots__ = ("_rate", "_burst", "_tokens", "_updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+        self._updated_at = now
+
+    def consume(self, tokens: float, now: float) -> bool:
+        """Take tokens if the bucket holds enough, a full bucket always suffices"""
+        tokens = min(tokens, self._burst)
+        self._refill(now)
+        if self._tokens < tokens:
+            return False
+
+        self._tokens -= tokens
+        return True
+
+    def get_delay(self, tokens: float, now: float) -> float:
+        """Return seconds until the bucket holds tokens"""
+        tokens = min(tokens, self._burst)
+        self._refill(now)
+        return max(0.0, (tokens - self._tokens) / self._rate)
+
+
+class FloodState:
+    """Flood control state kept with every connection as key.data.flood"""
+
+    __slots__ = ("buckets", "held", "num_throttled", "num_dropped")
+
+    def __init__(self):
+        self.buckets = {
+            flood_class: TokenBucket(config.FLOOD_RATE, config.FLOOD_BURST)
+            for flood_class in constants.FLOOD_CLASSES
+        }
+        # (Message, flood class, tokens) waiting for tokens, a deque is only
+        # allocated while the connection is throttled
+        self.held = None
+        self.num_throttled = 0  # Commands that were held
+        self.num_dropped = 0  # Commands that were dropped as held was full
+
+
+class FloodControl:
+    """Dispatches parsed messages to the message bus at the rate allowed
+
+    Held messages are released by release_held, which the server calls once
+    per loop iteration.
+    """
+
+    def __init__(self, dispatch: callable):
+        """dispatch: Called with every message that is released"""
+        self._logger = logging.getLogger(__name__)
+        self._dispatch = dispatch
+        self._throttled = {}  # Key: address, Value: key of a connection with held
+        self.num_throttled = 0
+        self.num_dropped = 0
+
+    def dispatch(self, message: Message):
+        """Dispatch message if its connection has tokens left, else hold it"""
+        if message.action in (SERVER_EVENTS.CONNECT, SERVER_EVENTS.DISCONNECT):
+            if message.action == SERVER_EVENTS.DISCONNECT:
+                self._throttled.pop(message.client_address, None)
+            self._dispatch(message)
+            return
+
+        key_data = message.key.data
+        # Linked servers relay the commands of many users, such as their burst
+        if key_data.is_server_link:
+            self._dispatch(message)
+            return
+
+        flood = key_data.flood
+        flood_class, tokens = get_cost(message)
+
+        # Commands are never reordered, once held every later command waits too
+        if not flood.held and flood.buckets[flood_class].consume(
+            tokens, time.monotonic()
+        ):
+            self._dispatch(message)
+            return
+
+        if flood.held is None:
+            flood.held = deque()
+        if len(flood.held) >= config.FLOOD_MAX_HELD:
+            flood.num_dropped += 1
+            self.num_dropped += 1
+            self._logger.debug(f"Dropped {message.command} of {key_data.address}")
+            return
+
+        flood.held.append((message, flood_class, tokens))
+        flood.num_throttled += 1
+        self.num_throttled += 1
+        self._throttled[message.client_address] = message.key
+
+    def release_held(self):
+        """Dispatch held messages of every connection whose tokens refilled
+
+        Return seconds until the next held message can be released,
+        or None if no message is held
+        """
+        if not self._throttled:
+            return None
+
+        now = time.monotonic()
+        delay = None
+        for address, key in list(self._throttled.items()):
+            flood = key.data.flood
+            while flood.held and not key.data.unregister_socket:
+                message, flood_class, tokens = flood.held[0]
+                if not flood.buckets[flood_class].consume(tokens, now):
+                    break
+                flood.held.popleft()
+                self._dispatch(message)
+
+            # A client that quit has no use for the rest of its commands
+            if key.data.unregister_socket or not flood.held:
+                flood.held = None
+                self._throttled.pop(address, None)
+                continue
+
+            _, flood_class, tokens = flood.held[0]
+            next_delay = flood.buckets[flood_class].get_delay(tokens, now)
+            delay = next_delay if delay is None else min(delay, next_delay)
+
+        return delay
@@ -0,0 +1,183 @@
+"""This module keeps the recent events of channels for CHATHISTORY
+
+Every channel has a ChannelHistory, a ring buffer holding its last events as
+the encoded lines members received, each with a message id and the Unix time
+in milliseconds it was received. Both grow with every event, so the events
+around a message id or a time are found by bisection.
+
+A HistoryStore holds the histories of all channels. It counts the bytes they
+hold and, once they hold more than its budget, drops whole histories of the
+channels that were neither written nor read for the longest time. However
+many channels exist, history never holds more than the budget.
+"""
+import itertools
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+import constants
+from metrics import Metrics
+
+
+class ChannelHistory:
+    """The last events of a channel, oldest first, at most capacity of them"""
+
+    __slots__ = ("_capacity", "_ids", "_times", "_lines", "_start", "num_bytes")
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        # Parallel lists, entry number i of the ring is at (_start + i) % len
+        self._ids = []
+        self._times = []
+        self._lines = []
+        self._start = 0  # Position of the oldest event once the ring is full
+        # Bytes held, the history itself included, counted like HistoryStore
+        self.num_bytes = constants.HISTORY_CHANNEL_OVERHEAD
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def append(self, msgid: int, timestamp: int, line: bytes) -> int:
+        """Add an event, replacing the oldest one once the ring is full
+
+        msgid and timestamp must not be lower than those of any event held
+        Return the change of num_bytes
+        """
+        change = len(line) + constants.HISTORY_ENTRY_OVERHEAD
+        if len(self._ids) < self._capacity:
+            self._ids.append(msgid)
+            self._times.append(timestamp)
+            self._lines.append(line)
+        else:
+            position = self._start
+            change -= len(self._lines[position]) + constants.HISTORY_ENTRY_OVERHEAD
+            self._ids[position] = msgid
+            self._times[position] = timestamp
+            self._lines[position] = line
+            self._start = (position + 1) % self._capacity
+        self.num_bytes += change
+        return change
+
+    def before(self, reference: tuple, limit: int) -> list:
+        """Return the last limit events before reference, oldest first
+
+        reference: ("msgid", int) or ("timestamp", Unix time in milliseconds)
+        """
+        stop = self._locate(reference, bisect_left)
+        if stop is None:
+            return []
+        return self._get_range(stop - limit, stop)
+
+    def after(self, reference: tuple, limit: int) -> list:
+        """Return the first limit events after reference, oldest first"""
+        start = self._locate(reference, bisect_right)
+        if start is None:
+            return []
+        return self._get_range(start, start + limit)
+
+    def latest(self, reference: tuple, limit: int) -> list:
+        """Return the last limit events, only those after reference unless it
+        is None, oldest first
+        """
+        start = 0
+        if reference is not None:
+            start = self._locate(reference, bisect_right)
+            if start is None:
+                return []
+        return self._get_range(max(start, len(self._ids) - limit), len(self._ids))
+
+    def _locate(self, reference: tuple, bisect: callable):
+        """Return the number of events before reference, those equal to it
+        included if bisect is bisect_right, or None for an unknown msgid
+        """
+        kind, value = reference
+        if kind == "timestamp":
+            return self._bisect(self._times, value, bisect)
+        position = self._bisect(self._ids, value, bisect_left)
+        if position == len(self._ids) or self._get_id(position) != value:
+            return None
+        return position + 1 if bisect is bisect_right else position
+
+    def _bisect(self, values: list, value, bisect: callable) -> int:
+        """Return the number of events whose entry in values comes before value
+        as told by bisect, on both sorted halves of the ring
+        """
+        start, end = self._start, len(values)
+        # The oldest events are at start..end, the newest at 0..start
+        position = bisect(values, value, start, end) - start
+        if position < end - start:
+            return position
+        return end - start + bisect(values, value, 0, start)
+
+    def _get_id(self, number: int) -> int:
+        return self._ids[(self._start + number) % len(self._ids)]
+
+    def _get_range(self, start: int, stop: int) -> list:
+        """Return (msgid, timestamp, line) of the events from number start up
+        to number stop
+        """
+        length = len(self._ids)
+        events = []
+        for number in range(max(start, 0), min(stop, length)):
+            position = (self._start + number) % length
+            events.append(
+                (self._ids[position], self._times[position], self._lines[position])
+            )
+        return events
+
+
+class HistoryStore:
+    """Histories of channels by lower case name, within a budget of bytes"""
+
+    def __init__(self, capacity: int, budget: int):
+        """capacity: Events kept per channel
+        budget: Bytes the histories of all channels may hold, at least as much
+            as one full history holds
+        """
+        self._capacity = capacity
+        self._budget = budget
+        # Key: channel name, Value: ChannelHistory, least recently used first
+        self._histories = OrderedDict()
+        self.num_bytes = 0
+        self.num_evicted = 0  # Histories dropped to stay within the budget
+        self._msgids = itertools.count(1)
+        self._last_time = 0  # Time of the last event in milliseconds
+        Metrics.gauges.update(
+            history_bytes=("Bytes held by channel history", lambda: self.num_bytes),
+            history_channels=("Channels with history", lambda: len(self._histories)),
+            history_evicted=(
+                "Channel histories dropped to stay within the budget",
+                lambda: self.num_evicted,
+            ),
+        )
+
+    def record(self, channel_key: str, line: bytes):
+        """Add an encoded line that members of a channel received"""
+        history = self._histories.get(channel_key)
+        if history is None:
+            history = self._histories[channel_key] = ChannelHistory(self._capacity)
+            self.num_bytes += history.num_bytes
+        else:
+            self._histories.move_to_end(channel_key)
+
+        # Times of events only grow, even if the clock goes back
+        self._last_time = max(int(time.time() * 1000), self._last_time)
+        self.num_bytes += history.append(next(self._msgids), self._last_time, line)
+
+        while self.num_bytes > self._budget and len(self._histories) > 1:
+            _, coldest = self._histories.popitem(last=False)
+            self.num_bytes -= coldest.num_bytes
+            self.num_evicted += 1
+
+    def get(self, channel_key: str):
+        """Return the ChannelHistory of a channel or None"""
+        history = self._histories.get(channel_key)
+        if history is not None:
+            self._histories.move_to_end(channel_key)
+        return history
+
+    def forget(self, channel_key: str):
+        """Drop the history of a channel that no longer exists"""
+        history = self._histories.pop(channel_key, None)
+        if history is not None:
+            self.num_bytes -= history.num_bytes
@@ -0,0 +1,240 @@
+"""This module hands the daemon over to a new process without dropping clients
+
+On SIGUSR2 the running daemon starts a new daemon process with the same
+command line. Over a Unix socket pair it passes the new process the listening
+sockets and every client socket (SCM_RIGHTS), along with a JSON snapshot of
+Client.clients, Client.channels and the buffered input and output of every
+connection. Once the new process restored that state it answers, and the old
+process exits without closing a single connection. If the new process does
+not answer in time the old process keeps serving.
+
+The new process starts serving once the old one has exited, so that it can
+bind the metrics endpoint of the old one.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import constants
+from channel import Channel
+from client import Client
+from connection import Connection
+
+HOT_RESTART_SIGNAL = signal.SIGUSR2
+RESUME_OPTION = "--resume-fd"
+READY = b"R"
+FD_MARKER = b"F"
+MAX_FDS_PER_MESSAGE = 253  # SCM_MAX_FD of Linux
+# Number of file descriptors and length of the snapshot that follow
+HEADER = struct.Struct("!IQ")
+
+
+def send_state(link: socket.socket, snapshot: bytes, fds: list):
+    """Send fds and the encoded snapshot over link"""
+    link.sendall(HEADER.pack(len(fds), len(snapshot)))
+    for start in range(0, len(fds), MAX_FDS_PER_MESSAGE):
+        socket.send_fds(link, [FD_MARKER], fds[start : start + MAX_FDS_PER_MESSAGE])
+    link.sendall(snapshot)
+
+
+def receive_state(link: socket.socket) -> tuple:
+    """Return the file descriptors and the encoded snapshot sent by send_state"""
+    num_fds, snapshot_length = HEADER.unpack(receive_exactly(link, HEADER.size))
+    fds = []
+    while len(fds) < num_fds:
+        marker, batch, _, _ = socket.recv_fds(link, 1, MAX_FDS_PER_MESSAGE)
+        if marker != FD_MARKER:
+            raise ConnectionError("Hand over was interrupted")
+        fds.extend(batch)
+    return fds, receive_exactly(link, snapshot_length)
+
+
+def receive_exactly(link: socket.socket, length: int) -> bytes:
+    """Receive length bytes from link"""
+    chunks = []
+    while length:
+        chunk = link.recv(min(length, constants.RECEIVE_LENGTH))
+        if not chunk:
+            raise ConnectionError("Hand over was interrupted")
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
+
+
+class HotRestart:
+    """Hands the daemon over to a new process once it receives SIGUSR2
+
+    It is served by the event loop like the broker link. The signal handler
+    does nothing, the signal wakes the loop through signal.set_wakeup_fd.
+    """
+
+    def __init__(self, listeners: list, before_exit: callable):
+        """listeners: Listeners the server accepts clients on
+        before_exit: Called right before this process exits
+        """
+        self._logger = logging.getLogger(__name__)
+        self._listeners = listeners
+        self._before_exit = before_exit
+        self._wakeup, self._wakeup_writer = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        signal.set_wakeup_fd(self._wakeup_writer.fileno(), warn_on_full_buffer=False)
+        signal.signal(HOT_RESTART_SIGNAL, lambda *_: None)
+
+    def fileno(self) -> int:
+        """Return file descriptor so it can be registered with a selector"""
+        return self._wakeup.fileno()
+
+    def handle_readable(self):
+        """Hand over if one of the signals received is HOT_RESTART_SIGNAL"""
+        try:
+            signals = self._wakeup.recv(constants.RECEIVE_LENGTH)
+        except BlockingIOError:
+            return
+
+        if HOT_RESTART_SIGNAL in signals:
+            self._hand_over()
+
+    def _get_state(self) -> tuple:
+        """Return the encoded snapshot and the file descriptors to hand over"""
+        connections = []
+        fds = [listener.socket.fileno() for listener in self._listeners]
+        for client in Client.clients.values():
+            key = client.key
+            if (
+                key.data.unregister_socket
+                or key.fileobj.fileno() == constants.CLOSED_FILENO
+            ):
+                continue
+
+            connection = key.data
+            # Commands held by flood control are received again
+            held = connection.flood.held or ()
+            received = b"".join(message.message for message, _, _ in held)
+            received += connection.in_buffer.get_unconsumed()
+            connections.append(
+                {
+                    "client": client.get_snapshot(),
+                    "connected_at": connection.connected_at,
+                    "in_buffer": received.decode("latin-1"),
+                    "out_queue": connection.out_queue.get_unsent().decode("latin-1"),
+                }
+            )
+            fds.append(key.fileobj.fileno())
+
+        channels = [channel.get_snapshot() for channel in Client.channels.values()]
+        snapshot = {
+            "listeners": [str(listener) for listener in self._listeners],
+            "connections": connections,
+            "channels": channels,
+        }
+        return json.dumps(snapshot).encode(), fds
+
+    def _hand_over(self):
+        """Start the new process, hand it every connection and exit"""
+        snapshot, fds = self._get_state()
+        link, new_process_link = socket.socketpair()
+        arguments = get_arguments_without_resume(sys.argv)
+        try:
+            process = subprocess.Popen(
+                [sys.executable, *arguments]
+                + [RESUME_OPTION, str(new_process_link.fileno())],
+                pass_fds=[new_process_link.fileno()],
+            )
+        finally:
+            new_process_link.close()
+
+        self._logger.info(
+            f"Handing {len(fds) - len(self._listeners)} connections over to "
+            f"process {process.pid}"
+        )
+        try:
+            link.settimeout(constants.HOT_RESTART_TIMEOUT)
+            send_state(link, snapshot, fds)
+            is_ready = link.recv(len(READY)) == READY
+        except OSError as e:
+            self._logger.error(f"Could not hand over: {e}")
+            is_ready = False
+
+        if not is_ready:
+            self._logger.error(f"Process {process.pid} did not take over, killing it")
+            process.kill()
+            process.wait()
+            link.close()
+            return
+
+        self._logger.info(f"Process {process.pid} took over, exiting")
+        self._before_exit()
+        # Exit without closing connections or running cleanups of the server
+        os._exit(0)
+
+
+def get_arguments_without_resume(arguments: list) -> list:
+    """Return command line arguments without RESUME_OPTION and its value"""
+    if RESUME_OPTION not in arguments:
+        return list(arguments)
+    index = arguments.index(RESUME_OPTION)
+    return arguments[:index] + arguments[index + 2 :]
+
+
+def resume(fd: int, listeners: list) -> list:
+    """Restore the state handed over by the process that started this one
+
+    fd: File descriptor of the socket to the old process
+    listeners: Listeners of this process, they take over the listening sockets
+    Return (socket, Connection) of every client, once the old process has exited
+    Raises ConnectionError if the old process had other listeners
+    """
+    logger = logging.getLogger(__name__)
+    link = socket.socket(fileno=fd)
+    link.settimeout(constants.HOT_RESTART_TIMEOUT)
+    fds, snapshot = receive_state(link)
+    snapshot = json.loads(snapshot)
+    if snapshot["listeners"] != [str(listener) for listener in listeners]:
+        raise ConnectionError(f"Listeners differ: {snapshot['listeners']}")
+
+    sockets = [socket.socket(fileno=fd) for fd in fds]
+    for sock in sockets:
+        sock.setblocking(False)
+    for listener, listening_socket in zip(listeners, sockets):
+        listener.socket = listening_socket
+
+    connections, clients = [], {}
+    client_sockets = sockets[len(listeners) :]
+    for state, client_socket in zip(snapshot["connections"], client_sockets):
+        address = tuple(state["client"]["address"])
+        connection = Connection(address, mark_dirty=None, close_connection=None)
+        connection.connected_at = state["connected_at"]
+        connection.in_buffer.extend(state["in_buffer"].encode("latin-1"))
+        if state["out_queue"]:
+            connection.out_queue.append(state["out_queue"].encode("latin-1"))
+        # Client takes the key of the connection once the server registered it
+        clients[address] = Client.restore(
+            state["client"], SimpleNamespace(data=connection)
+        )
+        connections.append((client_socket, connection))
+
+    for state in snapshot["channels"]:
+        channel = Channel.restore(state, clients)
+        if channel.has_members():
+            Client.channels[channel.get_channel_name().lower()] = channel
+
+    # Clients of Unix sockets are numbered, go on after the handed over ones
+    for listener in listeners:
+        numbers = [number for path, number in clients if path == listener.address]
+        listener.skip_client_numbers(max(numbers, default=0))
+
+    logger.info(f"Took over {len(connections)} connections")
+    link.sendall(READY)
+    try:
+        link.recv(1)  # Returns once the old process has exited
+    except socket.timeout:
+        logger.warning("Previous process did not exit")
+    link.close()
+    return connections
@@ -0,0 +1,101 @@
+"""This module pings idle connections and disconnects dead ones
+
+Keepalive sits between Parser and flood control and sees every message of
+every connection. Each connection has a single timer on a TimerWheel. A
+received message only notes the time, it does not move the timer. Once the
+timer expires it checks how long the connection was silent and schedules
+itself again for the rest of the interval.
+
+A connection that does not register within config.REGISTRATION_TIMEOUT, or
+stays silent for config.PING_TIMEOUT after it was sent a PING, is closed.
+"""
+import logging
+import time
+
+import config
+import constants
+from constants import SERVER_EVENTS
+from message import Message
+from timer_wheel import TimerWheel
+
+
+class Keepalive:
+    """Dispatches every message on and keeps the timer of its connection
+
+    Timers expire in tick, which the server calls like FloodControl.release_held
+    """
+
+    def __init__(self, dispatch: callable):
+        """dispatch: Called with every message"""
+        self._logger = logging.getLogger(__name__)
+        self._dispatch = dispatch
+        self._wheel = TimerWheel(time.monotonic())
+        self.num_pings_sent = 0
+        self.num_timeouts = 0
+
+    def dispatch(self, message: Message):
+        """Note that the connection of message is alive and dispatch it"""
+        key = message.key
+        key_data = key.data
+        if message.action == SERVER_EVENTS.CONNECT:
+            key_data.timer = self._wheel.schedule(
+                config.REGISTRATION_TIMEOUT, self._check, key
+            )
+        elif message.command == SERVER_EVENTS.DISCONNECT:
+            if key_data.timer is not None:
+                self._wheel.cancel(key_data.timer)
+                key_data.timer = None
+
+        key_data.last_active_at = self._wheel.now
+        key_data.ping_sent_at = None
+        self._dispatch(message)
+
+    def tick(self):
+        """Run the timers that expired
+
+        Return seconds until the next timer expires, or None if there is none
+        """
+        self._wheel.advance(time.monotonic())
+        return self._wheel.get_delay()
+
+    def _check(self, key):
+        """Ping, disconnect or wait for the connection of key, whose timer expired"""
+        key_data = key.data
+        key_data.timer = None
+        if key_data.unregister_socket:
+            return
+
+        now = self._wheel.now
+        if not key_data.is_registered:
+            delay = key_data.connected_at + config.REGISTRATION_TIMEOUT - now
+            if delay <= 0:
+                self._time_out(key, constants.REGISTRATION_TIMED_OUT)
+                return
+        elif key_data.ping_sent_at is not None:
+            delay = key_data.ping_sent_at + config.PING_TIMEOUT - now
+            if delay <= 0:
+                silent = round(now - key_data.last_active_at)
+                self._time_out(key, f"Ping timeout: {silent} seconds")
+                return
+        else:
+            delay = key_data.last_active_at + config.PING_INTERVAL - now
+            if delay <= 0:
+                self._send_ping(key)
+                key_data.ping_sent_at = now
+                delay = config.PING_TIMEOUT
+
+        key_data.timer = self._wheel.schedule(delay, self._check, key)
+
+    def _send_ping(self, key):
+        """Queue a PING, the client answers with a PONG"""
+        key_data = key.data
+        key_data.out_queue.append(f"PING :{config.SERVER_NAME}\r\n".encode())
+        if not key_data.is_dirty:
+            key_data.mark_dirty(key)
+        self.num_pings_sent += 1
+
+    def _time_out(self, key, reason: str):
+        """Close the connection of key, channels are told reason"""
+        self._logger.info(f"{reason} of {key.data.address}, closing")
+        self.num_timeouts += 1
+        key.data.close_connection(key, reason)
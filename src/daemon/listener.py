@@ -0,0 +1,207 @@
+"""This module describes the sockets clients connect to
+
+Every --listen option describes one listener:
+
+    ADDRESS[,OPTION...]
+
+ADDRESS is HOST:PORT, [IPV6]:PORT or unix:PATH. OPTION is one of
+
+    backlog=N       Connections the kernel queues until they are accepted
+    nodelay         Disable Nagle's algorithm (TCP_NODELAY)
+    keepalive[=S]   Let the kernel probe idle peers (SO_KEEPALIVE), after S
+                    seconds of silence (TCP_KEEPIDLE) if given
+    sndbuf=BYTES    Kernel send buffer of every client socket (SO_SNDBUF)
+    rcvbuf=BYTES    Kernel receive buffer of every client socket (SO_RCVBUF)
+    tls             Clients speak TLS, with the certificate of --tls-cert,
+                    implies nodelay
+
+Options are set on the listening socket, accepted sockets inherit them.
+"""
+import itertools
+import os
+import socket
+import stat
+
+import constants
+import utils
+
+UNIX_PREFIX = "unix:"
+
+
+class Listener:
+    """An address clients connect to and the socket options of their sockets
+
+    Its socket is created by listen, in the process that serves the listener,
+    or handed over by the daemon that served it before a hot restart.
+    """
+
+    __slots__ = (
+        "family",
+        "address",
+        "backlog",
+        "nodelay",
+        "keepalive",
+        "keepalive_idle",
+        "sndbuf",
+        "rcvbuf",
+        "tls",
+        "socket",
+        "_client_numbers",
+        "_bound_by",
+    )
+
+    # A Listener is the selector data of its socket
+    is_server_socket = True
+
+    def __init__(
+        self,
+        family: int,
+        address,
+        backlog: int = constants.DEFAULT_LISTEN_BACKLOG,
+        nodelay: bool = False,
+        keepalive: bool = False,
+        keepalive_idle: int = None,
+        sndbuf: int = None,
+        rcvbuf: int = None,
+        tls=None,
+    ):
+        """address: (host, port), or the path of a Unix socket
+        tls: TlsContext of the clients, None for plaintext
+        """
+        self.family = family
+        self.address = address
+        self.backlog = backlog
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.tls = tls
+        self.socket = None
+        # Unix socket clients have no address, they are numbered instead
+        self._client_numbers = itertools.count(1)
+        self._bound_by = None  # PID of the process that bound the Unix socket
+
+    def __str__(self):
+        if self.family == socket.AF_UNIX:
+            name = f"{UNIX_PREFIX}{self.address}"
+        else:
+            name = str(self.address)
+        return name if self.tls is None else f"{name} (TLS)"
+
+    @classmethod
+    def parse(
+        cls, value: str, backlog: int = constants.DEFAULT_LISTEN_BACKLOG, tls=None
+    ) -> "Listener":
+        """Create a listener from the value of a --listen option
+
+        backlog: Used unless value has a backlog option
+        tls: TlsContext used if value has the tls option
+        Raises ValueError if value is malformed
+        """
+        address, *options = value.split(",")
+        if address.startswith(UNIX_PREFIX):
+            family, address = socket.AF_UNIX, address[len(UNIX_PREFIX) :]
+            if not address:
+                raise ValueError(f"missing path in {value}")
+        else:
+            host, separator, port = address.rpartition(":")
+            port = utils.parse_port(port)
+            if not separator or port is None:
+                raise ValueError(f"missing or invalid port in {value}")
+            host = host.removeprefix("[").removesuffix("]")
+            family = socket.AF_INET6 if ":" in host else socket.AF_INET
+            address = (host, port)
+
+        listener = cls(family, address, backlog)
+        for option in options:
+            name, _, setting = option.partition("=")
+            if name in ("nodelay", "keepalive") and family == socket.AF_UNIX:
+                raise ValueError(f"{name} does not apply to Unix sockets")
+            if name == "nodelay" and not setting:
+                listener.nodelay = True
+            elif name == "keepalive":
+                listener.keepalive = True
+                if setting:
+                    listener.keepalive_idle = parse_positive(option, setting)
+            elif name == "tls" and not setting:
+                if tls is None:
+                    raise ValueError("tls needs a certificate, see --tls-cert")
+                listener.tls = tls
+            elif name in ("backlog", "sndbuf", "rcvbuf"):
+                setattr(listener, name, parse_positive(option, setting))
+            else:
+                raise ValueError(f"unknown option {option}")
+        return listener
+
+    def listen(self, reuse_port: bool = False):
+        """Create the non-blocking listening socket with the options applied
+
+        reuse_port: Let every worker accept on the same port, the kernel
+            balances them. Unix sockets are shared by the workers instead
+        """
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_UNIX:
+            # A socket left behind by a previous run would fail bind
+            path = self.address
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+            self._bound_by = os.getpid()
+        else:
+            # Avoid "Address already in use" error
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if self.family == socket.AF_INET6:
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            # Output of TLS clients is written in whole records already, Nagle's
+            # algorithm would hold the first one after the session tickets back
+            # until the client acknowledged them
+            if self.nodelay or self.tls is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.keepalive:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if self.keepalive_idle is not None and hasattr(socket, "TCP_KEEPIDLE"):
+                sock.setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle
+                )
+
+        # Set before listen, so the window scale offered to clients fits them
+        if self.sndbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+        sock.bind(self.address)
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        self.socket = sock
+
+    def get_client_address(self, address) -> tuple:
+        """Return the address a client accepted on this listener is known by
+
+        address: Peer address returned by accept
+        IPv6 addresses lose flow info and scope id, Unix socket clients are
+        known by (path, number of the client)
+        """
+        if self.family == socket.AF_UNIX:
+            return self.address, next(self._client_numbers)
+        return address[0], address[1]
+
+    def skip_client_numbers(self, last: int):
+        """Number further Unix socket clients after last"""
+        self._client_numbers = itertools.count(last + 1)
+
+    def close(self):
+        """Stop listening and remove the Unix socket, if this process bound it"""
+        if self.socket is not None:
+            self.socket.close()
+        if self._bound_by == os.getpid() and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+def parse_positive(option: str, setting: str) -> int:
+    """Return setting of option as a positive integer or raise ValueError"""
+    if not utils.is_number(setting) or int(setting) == 0:
+        raise ValueError(f"{option} needs a positive number")
+    return int(setting)
@@ -1,10 +1,10 @@
 """Holds the Message class that is passed around by different parts of the server"""
 from dataclasses import dataclass, field
 from selectors import SelectorKey
-from typing import List
+from typing import Dict, List
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     """This class encapsulates information about IRC messages or events.
 
@@ -20,3 +20,6 @@ class Message:
     key: SelectorKey = field(repr=False)
     command: str = ""
     parameters: List[str] = field(default_factory=list)
+    # IRCv3 message tags and source prefix, None if the message had none
+    tags: Dict[str, str] = None
+    source: str = None
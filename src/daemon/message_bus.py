@@ -1,8 +1,10 @@
 """This module is responsible for handling parsed messages sent by the parser"""
 import logging
+import time
 
 from client import Client
 from message import Message
+from metrics import Metrics
 
 
 class MessageBus:
@@ -11,12 +13,33 @@ class MessageBus:
     def __init__(self):
         """Initialize map of address to client objects"""
         self._logger = logging.getLogger(__name__)
+        Metrics.gauges.update(
+            clients=("Connected clients", lambda: len(Client.clients)),
+            registered_clients=(
+                "Registered clients",
+                lambda: Client.registered_count,
+            ),
+            channels=("Channels", lambda: len(Client.channels)),
+            sendq_bytes=(
+                "Bytes queued for every client",
+                lambda: sum(client.get_sendq() for client in Client.clients.values()),
+            ),
+            max_sendq_bytes=(
+                "Most bytes queued for a single client",
+                lambda: max(
+                    (client.get_sendq() for client in Client.clients.values()),
+                    default=0,
+                ),
+            ),
+        )
 
     def _handle_message(self, message: Message):
         """Handle received message by forwarding it to client"""
         self._logger.debug(message)
         client = self._get_client(message)
+        started_at = time.perf_counter()
         client.handle_message(message)
+        Metrics.observe_command(message.command, time.perf_counter() - started_at)
 
     def dispatch(self, message: Message):
         """Call handler on message, used by Parser"""
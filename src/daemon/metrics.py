@@ -0,0 +1,246 @@
+"""This module collects runtime metrics of the daemon and serves them
+
+Metrics are read by operators through STATS and scraped in the Prometheus text
+format from a MetricsEndpoint served by the server's event loop.
+"""
+import logging
+import os
+import socket
+import stat
+import time
+from bisect import bisect_left
+
+import constants
+
+PROMETHEUS_PREFIX = "pyircd"
+
+
+class Histogram:
+    """Counts observations into buckets, rendered like a Prometheus histogram"""
+
+    def __init__(self, buckets: tuple = constants.LATENCY_BUCKETS):
+        """buckets: Ascending upper bounds, a bucket for larger values is added"""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Count value into the first bucket whose upper bound is not below it"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_quantile(self, quantile: float) -> float:
+        """Return the upper bound of the bucket holding quantile of observations
+
+        Observations above the largest bucket report the largest bucket
+        """
+        rank = quantile * self.count
+        seen = 0
+        for upper_bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return upper_bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Class level metrics recorded by the servers and the message bus
+
+    Gauges are registered as callables and only evaluated when read.
+    """
+
+    commands = {}  # Key: command, Value: Histogram of handler seconds
+    num_bytes_received = 0
+    num_bytes_sent = 0
+    num_wakeups = 0  # Event loop iterations that handled events
+    num_tls_handshakes = 0  # Completed TLS handshakes, full or resumed
+    num_tls_resumed = 0
+    num_tls_failed = 0
+    # Seconds from accept until the TLS handshake completed
+    tls_handshakes = Histogram(constants.TLS_HANDSHAKE_BUCKETS)
+    gauges = {}  # Key: name, Value: (help text, callable returning the value)
+    started_at = time.monotonic()
+
+    # Wakeups counted at the start of the current rate window
+    _rate_window = (started_at, 0)
+
+    @classmethod
+    def observe_command(cls, command: str, seconds: float):
+        """Record that handling command took seconds"""
+        histogram = cls.commands.get(command)
+        if histogram is None:
+            histogram = cls.commands[command] = Histogram()
+        histogram.observe(seconds)
+
+    @classmethod
+    def observe_tls_handshake(cls, seconds: float, is_resumed: bool):
+        """Record a completed TLS handshake, seconds is None if not measured"""
+        cls.num_tls_handshakes += 1
+        cls.num_tls_resumed += is_resumed
+        if seconds is not None:
+            cls.tls_handshakes.observe(seconds)
+
+    @classmethod
+    def get_wakeups_per_second(cls) -> float:
+        """Return the wakeup rate over the last WAKEUP_RATE_WINDOW seconds or so"""
+        now = time.monotonic()
+        window_start, window_wakeups = cls._rate_window
+        elapsed = now - window_start
+        rate = (cls.num_wakeups - window_wakeups) / elapsed if elapsed else 0.0
+        if elapsed >= constants.WAKEUP_RATE_WINDOW:
+            cls._rate_window = (now, cls.num_wakeups)
+        return rate
+
+    @classmethod
+    def get_summary(cls) -> list:
+        """Return (name, value) of every metric that is not per command"""
+        summary = [
+            ("uptime_seconds", round(time.monotonic() - cls.started_at)),
+            ("wakeups", cls.num_wakeups),
+            ("wakeups_per_second", round(cls.get_wakeups_per_second(), 1)),
+            ("received_bytes", cls.num_bytes_received),
+            ("sent_bytes", cls.num_bytes_sent),
+        ]
+        if cls.num_tls_handshakes or cls.num_tls_failed:
+            summary.extend(
+                [
+                    ("tls_handshakes", cls.num_tls_handshakes),
+                    ("tls_resumed", cls.num_tls_resumed),
+                    ("tls_failed", cls.num_tls_failed),
+                ]
+            )
+        # The asyncio backend does not time handshakes
+        if cls.tls_handshakes.count:
+            p99 = cls.tls_handshakes.get_quantile(0.99)
+            summary.append(("tls_handshake_p99_seconds", p99))
+        summary.extend((name, get()) for name, (_, get) in cls.gauges.items())
+        return summary
+
+    @classmethod
+    def render(cls) -> str:
+        """Return every metric in the Prometheus text exposition format"""
+        counters = [
+            ("loop_wakeups_total", "Event loop wakeups", cls.num_wakeups),
+            ("received_bytes_total", "Bytes received", cls.num_bytes_received),
+            ("sent_bytes_total", "Bytes sent", cls.num_bytes_sent),
+            (
+                "tls_handshakes_total",
+                "Completed TLS handshakes",
+                cls.num_tls_handshakes,
+            ),
+            ("tls_resumed_total", "TLS sessions resumed", cls.num_tls_resumed),
+            ("tls_failed_total", "Failed TLS handshakes", cls.num_tls_failed),
+        ]
+        gauges = [
+            (
+                "uptime_seconds",
+                "Seconds since the daemon started",
+                round(time.monotonic() - cls.started_at, 3),
+            )
+        ]
+        gauges.extend((name, text, get()) for name, (text, get) in cls.gauges.items())
+
+        lines = []
+        for metric_type, metrics in (("counter", counters), ("gauge", gauges)):
+            for name, help_text, value in metrics:
+                name = f"{PROMETHEUS_PREFIX}_{name}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.append(f"{name} {value}")
+
+        name = f"{PROMETHEUS_PREFIX}_command_duration_seconds"
+        lines.append(f"# HELP {name} Seconds spent handling commands")
+        lines.append(f"# TYPE {name} histogram")
+        for command, histogram in sorted(cls.commands.items()):
+            render_histogram(lines, name, f'command="{command}"', histogram)
+
+        name = f"{PROMETHEUS_PREFIX}_tls_handshake_duration_seconds"
+        lines.append(f"# HELP {name} Seconds from accept until the TLS handshake")
+        lines.append(f"# TYPE {name} histogram")
+        render_histogram(lines, name, "", cls.tls_handshakes)
+
+        return "\n".join(lines) + "\n"
+
+
+def render_histogram(lines: list, name: str, labels: str, histogram: Histogram):
+    """Append the samples of histogram to lines, labels may be empty"""
+    separator = "," if labels else ""
+    cumulative = 0
+    for upper_bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        bucket_labels = f'{labels}{separator}le="{upper_bound}"'
+        lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+    lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {histogram.count}')
+    sample_labels = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{sample_labels} {histogram.sum}")
+    lines.append(f"{name}_count{sample_labels} {histogram.count}")
+
+
+class MetricsEndpoint:
+    """Serves Metrics over HTTP to Prometheus scrapers
+
+    Listens on a loopback port or on a Unix socket and is served by the
+    server's event loop like the broker link. Every scrape is answered as
+    soon as it is accepted. The request is read with a short timeout so a
+    stalled scraper holds up the event loop for METRICS_REQUEST_TIMEOUT at most.
+    """
+
+    def __init__(self, port: int = None, path: str = None):
+        """Listen on 127.0.0.1:port, or on a Unix socket at path"""
+        self._logger = logging.getLogger(__name__)
+        self._path = path
+        if path is not None:
+            # A socket left behind by a previous run would fail bind
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.bind(path)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket.bind((constants.LOCAL_HOST, port))
+        self._socket.listen()
+        self._socket.setblocking(False)
+        self._logger.info(f"Serving metrics on {self._socket.getsockname()}")
+
+    def fileno(self) -> int:
+        """Return file descriptor so the endpoint can be registered with a selector"""
+        return self._socket.fileno()
+
+    def close(self):
+        """Stop listening and remove the Unix socket"""
+        self._socket.close()
+        if self._path is not None and os.path.exists(self._path):
+            os.unlink(self._path)
+
+    def handle_readable(self):
+        """Accept a scraper and answer its request"""
+        try:
+            connection, _ = self._socket.accept()
+        except BlockingIOError:
+            return
+
+        with connection:
+            try:
+                connection.settimeout(constants.METRICS_REQUEST_TIMEOUT)
+                request = b""
+                while b"\r\n\r\n" not in request and len(request) < 8192:
+                    received_data = connection.recv(4096)
+                    if not received_data:
+                        break
+                    request += received_data
+
+                if request.startswith(b"GET "):
+                    status, body = "200 OK", Metrics.render().encode()
+                else:
+                    status, body = "405 Method Not Allowed", b""
+                connection.sendall(
+                    f"HTTP/1.0 {status}\r\n"
+                    f"Content-Type: {constants.PROMETHEUS_CONTENT_TYPE}\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+            except OSError as e:
+                self._logger.debug(f"Could not serve metrics: {e}")
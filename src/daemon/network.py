@@ -0,0 +1,800 @@
+"""This module links daemons into one IRC network spanning several servers
+
+Servers are linked in a spanning tree. Every server only holds the sockets of
+its own clients and of the servers it is linked to. A link is a connection
+that registered with PASS and SERVER instead of NICK and USER, or one opened
+to a --connect peer. Once both sides accepted the other, each sends a burst of
+every server, user, channel and topic it knows of. From then on they relay:
+
+    :server SERVER name hopcount :description
+    :server NICK nick hopcount username ts :realname    A user registered
+    :server NJOIN #channel :nick,nick,...               Members, in a burst
+    :server TOPIC #channel :topic                       Topic, in a burst
+    :server SQUIT name :reason                          A server split off
+    :nick NICK newnick ts
+    :nick JOIN #channel, PART, QUIT and PRIVMSG
+
+A message received over one link is passed on over every other link, so it
+reaches every server exactly once. Channel messages only go to links with
+members of the channel behind them.
+
+Two servers that did not know of each other's user yet may introduce the same
+nick. The user that took it first, by the ts sent along, keeps it, ties go to
+the server whose name sorts first. Every server applies the same rule, so a
+server whose user lost disconnects it without being told to.
+When a link goes down, the servers behind it and their users are gone.
+"""
+import hmac
+import itertools
+import logging
+import time
+
+import channel
+import config
+import constants
+import utils
+from client import Client
+from constants import IRC_COMMANDS, SERVER_EVENTS
+from message import Message
+
+SERVER_DESCRIPTION = "pyircd"
+
+
+class RemoteServer:
+    """A server of the network reached over a link of this server"""
+
+    __slots__ = ("name", "uplink", "hopcount", "link")
+
+    def __init__(self, name: str, uplink: str, hopcount: int, link):
+        """uplink: Name of the server it is linked to
+        hopcount: Number of links between this server and it
+        link: ServerLink of the neighbour it is reached through
+        """
+        self.name = name
+        self.uplink = uplink
+        self.hopcount = hopcount
+        self.link = link
+
+
+class RemoteUser:
+    """A client connected to another server of the network
+
+    Channels and private messages treat it like a Client, lines sent to it
+    are passed on over the link towards its server.
+    """
+
+    __slots__ = (
+        "nick",
+        "nick_ts",
+        "username",
+        "realname",
+        "server",
+        "address",
+        "joined_channels",
+    )
+
+    # Only registered users are introduced, operators are not told apart
+    is_registered = True
+    is_operator = False
+
+    def __init__(
+        self,
+        nick: str,
+        nick_ts: int,
+        username: str,
+        realname: str,
+        server: RemoteServer,
+        address: tuple,
+    ):
+        """address: Unique key of the user in channels, like that of a Client"""
+        self.nick = nick
+        self.nick_ts = nick_ts
+        self.username = username
+        self.realname = realname
+        self.server = server
+        self.address = address
+        self.joined_channels = {}  # Key: channel_name, Value: Channel
+
+    @property
+    def host(self):
+        """Get the host shown to clients, the name of the server of the user,
+        as links do not tell the address of users
+        """
+        return self.server.name
+
+    @property
+    def server_name(self):
+        """Get the name of the server of the user"""
+        return self.server.name
+
+    @property
+    def hopcount(self):
+        """Get the number of links between this server and that of the user"""
+        return self.server.hopcount
+
+    def send_message(
+        self,
+        numeric: str,
+        message: str,
+        include_nick: bool = True,
+        source: str = None,
+    ):
+        """Pass a message on towards the server of this user, see Client"""
+        self.send_raw(
+            utils.encode_message(
+                numeric,
+                message,
+                source if source is not None else config.SERVER_NAME,
+                self.nick if include_nick else None,
+            )
+        )
+
+    def send_raw(self, line: bytes):
+        """Pass an encoded message on towards the server of this user"""
+        self.server.link.send_raw(line)
+
+
+class ServerLink:
+    """Connection to a neighbouring server
+
+    It takes the place of the Client of its connection in Client.clients, so
+    the message bus hands it every message of the neighbour.
+    """
+
+    __slots__ = ("_network", "_key", "address", "name", "is_outgoing", "password")
+
+    def __init__(self, network, key, is_outgoing: bool):
+        """is_outgoing: This server opened the connection to a --connect peer
+        or for a CONNECT
+        """
+        self._network = network
+        self._key = key
+        self.address = key.data.address
+        self.name = None  # Name of the neighbour, once it was accepted
+        self.is_outgoing = is_outgoing
+        self.password = None  # Sent by the neighbour with PASS
+
+    @property
+    def key(self):
+        """Get the key of this link's connection"""
+        return self._key
+
+    def handle_message(self, message: Message):
+        """Hand message to the network, forget the link once it is closed"""
+        if message.command == SERVER_EVENTS.DISCONNECT:
+            reason = (
+                message.parameters[0]
+                if message.parameters
+                else constants.DEFAULT_DISCONNECT_REASON
+            )
+            self._network.remove_link(self, reason)
+        elif message.action != SERVER_EVENTS.CONNECT:
+            self._network.handle_message(self, message)
+
+    def _get_link_name(self) -> str:
+        """Return name and address identifying this link in STATS replies"""
+        return f"{self.name or '*'}[{self.address[0]}:{self.address[1]}]"
+
+    # A link is queued to and reported on exactly like a client
+    send_raw = Client.send_raw
+    get_sendq = Client.get_sendq
+    get_link_info = Client.get_link_info
+    get_flood_info = Client.get_flood_info
+
+
+class Network:
+    """The servers linked with this one and the users connected to them
+
+    Set as config.NETWORK by the daemon. Client tells it about its changes so
+    they are relayed to every linked server, ServerLinks hand it what linked
+    servers relay.
+    """
+
+    def __init__(self, password: str, peers: list = ()):
+        """password: Sent by servers that link with this one, and sent to peers
+        peers: (host, port) of servers to link with, retried every
+            LINK_RECONNECT_INTERVAL seconds while they are not linked
+        """
+        self._logger = logging.getLogger(__name__)
+        self._password = password
+        self._peers = dict.fromkeys(peers)  # Key: address, Value: ServerLink
+        self._connect = None  # Opens a connection, set by start
+        self._next_attempt_at = 0.0
+        self._links = {}  # Key: lower case name of a neighbour, Value: ServerLink
+        self._servers = {}  # Key: lower case name, Value: RemoteServer
+        self._users = {}  # Key: address, Value: RemoteUser
+        self._user_numbers = itertools.count(1)
+
+    def start(self, server):
+        """Link with the peers once server serves, server.connect opens links"""
+        self._connect = server.connect
+        self.tick()
+
+    def tick(self):
+        """Retry peers that are not linked
+
+        Return seconds until the next attempt, or None if every peer is linked
+        """
+        unlinked = [address for address, link in self._peers.items() if not link]
+        if not unlinked:
+            return None
+
+        now = time.monotonic()
+        if now >= self._next_attempt_at:
+            self._next_attempt_at = now + constants.LINK_RECONNECT_INTERVAL
+            for address in unlinked:
+                try:
+                    self.connect(address)
+                except OSError as e:
+                    self._logger.warning(f"Could not connect to {address}: {e}")
+        return self._next_attempt_at - now
+
+    def connect(self, address: tuple):
+        """Open a link to the server at address (host, port), raise OSError
+        if the connection cannot be opened
+        """
+        if address in Client.clients:
+            raise OSError(f"{address[0]}:{address[1]} is already connected")
+        self._connect(address)
+
+        # The message bus created a Client when the connection was registered
+        link = ServerLink(self, Client.clients[address].key, is_outgoing=True)
+        Client.clients[address] = link
+        if address in self._peers:
+            self._peers[address] = link
+        self._send_credentials(link)
+        self._logger.info(f"Linking with {address[0]}:{address[1]}")
+
+    def accept_link(self, key, password: str, message: Message):
+        """Take over the connection of key, whose client sent SERVER"""
+        link = ServerLink(self, key, is_outgoing=False)
+        link.password = password
+        Client.clients[link.address] = link
+        self._complete_link(link, message)
+
+    def unlink(self, name: str, reason: str) -> bool:
+        """Drop the link with the neighbour called name, for SQUIT
+
+        Return False if no such server is linked with this one
+        """
+        link = self._links.get(name.lower())
+        if link is None:
+            return False
+        self._drop_link(link, reason)
+        return True
+
+    def get_servers(self) -> list:
+        """Return (name, uplink, hopcount) of every server, nearest first"""
+        return [
+            (server.name, server.uplink, server.hopcount)
+            for server in sorted(self._servers.values(), key=get_hopcount)
+        ]
+
+    def get_server_count(self) -> int:
+        return len(self._servers)
+
+    def get_link_count(self) -> int:
+        return len(self._links)
+
+    def get_user_count(self) -> int:
+        return len(self._users)
+
+    def introduce(self, client: Client):
+        """Tell every server about a client that registered"""
+        self._send_all(
+            self._encode_user(
+                config.SERVER_NAME,
+                client.nick,
+                1,
+                client.username,
+                client.nick_ts,
+                client.realname,
+            )
+        )
+
+    def change_nick(self, client: Client, old_nick: str):
+        """Tell every server about a nick change of a registered client"""
+        self._send_all(
+            utils.encode_message(
+                IRC_COMMANDS.NICK, f"{client.nick} {client.nick_ts}", old_nick
+            )
+        )
+
+    def join(self, client: Client, channel_name: str):
+        """Tell every server that a client joined channel_name"""
+        self._send_all(
+            utils.encode_message(IRC_COMMANDS.JOIN, channel_name, client.nick)
+        )
+
+    def part(self, client: Client, channel_name: str, reason: str):
+        """Tell every server that a client left channel_name"""
+        self._send_all(
+            utils.encode_message(
+                IRC_COMMANDS.PART, f"{channel_name} :{reason}", client.nick
+            )
+        )
+
+    def quit(self, client: Client, reason: str):
+        """Tell every server that a client is gone
+
+        Nothing is sent for a client that was never introduced, or that lost
+        its nick to a user of another server
+        """
+        if client.is_registered and Client.get_client(client.nick) is client:
+            self._send_all(
+                utils.encode_message(IRC_COMMANDS.QUIT, f":{reason}", client.nick)
+            )
+
+    def send_to_channel(self, target_channel, line: bytes, exclude=None):
+        """Pass a channel message on to every link with members behind it"""
+        links = {member.server.link for member in target_channel.get_remote_members()}
+        links.discard(exclude)
+        for link in links:
+            link.send_raw(line)
+
+    def handle_message(self, link: ServerLink, message: Message):
+        """Handle a message relayed by the neighbour of link"""
+        if message.command == IRC_COMMANDS.PING:
+            token = message.parameters[0] if message.parameters else ""
+            link.send_raw(
+                utils.encode_message(
+                    IRC_COMMANDS.PONG,
+                    f"{config.SERVER_NAME} :{token}",
+                    config.SERVER_NAME,
+                )
+            )
+        elif message.command == IRC_COMMANDS.ERROR:
+            self._logger.warning(f"{link.name or link.address} sent {message}")
+        elif link.name is None:
+            if message.command == IRC_COMMANDS.PASS and message.parameters:
+                link.password = message.parameters[0]
+            elif message.command == IRC_COMMANDS.SERVER:
+                self._complete_link(link, message)
+        else:
+            handler = Network._handlers.get(message.command)
+            if handler is not None:
+                handler(self, link, message)
+
+    def remove_link(self, link: ServerLink, reason: str):
+        """Forget a link whose connection closed, and every server behind it"""
+        if Client.clients.get(link.address) is link:
+            Client.clients.pop(link.address)
+        if self._peers.get(link.address) is link:
+            self._peers[link.address] = None
+        if link.name is None or self._links.get(link.name.lower()) is not link:
+            self._logger.info(f"Could not link with {link.address}: {reason}")
+            return
+
+        self._links.pop(link.name.lower())
+        split = [server for server in self._servers.values() if server.link is link]
+        self._logger.warning(
+            f"Lost link with {link.name}: {reason}, {len(split)} servers split off"
+        )
+        self._remove_servers(split, f"{config.SERVER_NAME} {link.name}")
+        self._send_all(
+            utils.encode_message(
+                IRC_COMMANDS.SQUIT, f"{link.name} :{reason}", config.SERVER_NAME
+            )
+        )
+
+    def _send_all(self, line: bytes, exclude: tuple = ()):
+        """Queue line for every linked neighbour but those in exclude"""
+        for link in self._links.values():
+            if link not in exclude:
+                link.send_raw(line)
+
+    def _send_credentials(self, link: ServerLink):
+        link.send_raw(
+            f"PASS :{self._password}\r\n"
+            f"SERVER {config.SERVER_NAME} 1 :{SERVER_DESCRIPTION}\r\n".encode()
+        )
+
+    def _is_known(self, name: str) -> bool:
+        """Return True if name is this server or a server of the network"""
+        return name.lower() == config.SERVER_NAME.lower() or name.lower() in (
+            self._servers
+        )
+
+    def _complete_link(self, link: ServerLink, message: Message):
+        """Accept the neighbour of link if it sent the password and is new to
+        the network, then exchange bursts
+        """
+        name = message.parameters[0] if message.parameters else ""
+        if link.password is None or not hmac.compare_digest(
+            link.password.encode(), self._password.encode()
+        ):
+            self._drop_link(link, "Bad password")
+            return
+        if not name or self._is_known(name):
+            self._drop_link(link, f"Server {name} already exists")
+            return
+
+        link.name = name
+        # The burst of the neighbour follows, flood control must not hold it
+        link.key.data.is_registered = True
+        link.key.data.is_server_link = True
+        if not link.is_outgoing:
+            self._send_credentials(link)
+        # Nothing is behind the link yet, the burst holds everything known
+        self._send_burst(link)
+
+        self._links[name.lower()] = link
+        self._servers[name.lower()] = RemoteServer(name, config.SERVER_NAME, 1, link)
+        self._send_all(
+            utils.encode_message(
+                IRC_COMMANDS.SERVER,
+                f"{name} 2 :{SERVER_DESCRIPTION}",
+                config.SERVER_NAME,
+            ),
+            exclude=(link,),
+        )
+        self._logger.info(f"Linked with {name} at {link.address}")
+
+    def _drop_link(self, link: ServerLink, reason: str):
+        """Tell the neighbour of link why it is dropped, then close the link"""
+        link.send_raw(f"ERROR :Closing link: {reason}\r\n".encode())
+        link.key.data.unregister_socket = True
+        self.remove_link(link, reason)
+
+    def _send_burst(self, link: ServerLink):
+        """Queue every server, user, channel and topic known for link"""
+        for server in sorted(self._servers.values(), key=get_hopcount):
+            link.send_raw(
+                utils.encode_message(
+                    IRC_COMMANDS.SERVER,
+                    f"{server.name} {server.hopcount + 1} :{SERVER_DESCRIPTION}",
+                    server.uplink,
+                )
+            )
+
+        for user in Client.nicks.values():
+            if isinstance(user, RemoteUser):
+                server_name, hopcount = user.server.name, user.server.hopcount + 1
+            elif user.is_registered:
+                server_name, hopcount = config.SERVER_NAME, 1
+            else:
+                continue
+            link.send_raw(
+                self._encode_user(
+                    server_name,
+                    user.nick,
+                    hopcount,
+                    user.username,
+                    user.nick_ts,
+                    user.realname,
+                )
+            )
+
+        for burst_channel in Client.channels.values():
+            channel_name = burst_channel.get_channel_name()
+            nicks = []
+            for nick in burst_channel.iter_nicks():
+                nicks.append(nick)
+                if sum(map(len, nicks)) + len(nicks) > constants.NJOIN_LENGTH:
+                    link.send_raw(self._encode_njoin(channel_name, nicks))
+                    nicks = []
+            if nicks:
+                link.send_raw(self._encode_njoin(channel_name, nicks))
+
+            if burst_channel.get_topic():
+                link.send_raw(
+                    utils.encode_message(
+                        IRC_COMMANDS.TOPIC,
+                        f"{channel_name} :{burst_channel.get_topic()}",
+                        config.SERVER_NAME,
+                    )
+                )
+
+    @staticmethod
+    def _encode_user(
+        server_name: str,
+        nick: str,
+        hopcount: int,
+        username: str,
+        nick_ts: int,
+        realname: str,
+    ) -> bytes:
+        return utils.encode_message(
+            IRC_COMMANDS.NICK,
+            f"{nick} {hopcount} {username} {nick_ts} :{realname}",
+            server_name,
+        )
+
+    @staticmethod
+    def _encode_njoin(channel_name: str, nicks: list) -> bytes:
+        return utils.encode_message(
+            IRC_COMMANDS.NJOIN, f"{channel_name} :{','.join(nicks)}", config.SERVER_NAME
+        )
+
+    def _get_user(self, link: ServerLink, nick: str):
+        """Return the RemoteUser called nick if it is behind link, else None"""
+        user = Client.get_client(nick or "")
+        if isinstance(user, RemoteUser) and user.server.link is link:
+            return user
+        self._logger.debug(f"{link.name} relayed unknown user {nick}")
+        return None
+
+    def _handle_server(self, link: ServerLink, message: Message):
+        """A server was linked behind link"""
+        if len(message.parameters) < 2 or not utils.is_number(message.parameters[1]):
+            self._logger.warning(f"{link.name} sent malformed {message}")
+            return
+        name, hopcount = message.parameters[0], int(message.parameters[1])
+        if self._is_known(name):
+            # A second path to a server would make the tree a loop
+            self._drop_link(link, f"Server {name} already exists")
+            return
+
+        uplink = message.source or link.name
+        self._servers[name.lower()] = RemoteServer(name, uplink, hopcount, link)
+        self._send_all(
+            utils.encode_message(
+                IRC_COMMANDS.SERVER,
+                f"{name} {hopcount + 1} :{SERVER_DESCRIPTION}",
+                uplink,
+            ),
+            exclude=(link,),
+        )
+
+    def _handle_squit(self, link: ServerLink, message: Message):
+        """A server behind link split off, with every server behind it"""
+        if not message.parameters:
+            return
+        server = self._servers.get(message.parameters[0].lower())
+        if server is None or server.link is not link:
+            return
+        if server.hopcount == 1:
+            self._drop_link(link, "Split off")
+            return
+
+        split = [server]
+        names = {server.name.lower()}
+        for other in sorted(self._servers.values(), key=get_hopcount):
+            if other.uplink.lower() in names and other.name.lower() not in names:
+                split.append(other)
+                names.add(other.name.lower())
+        self._remove_servers(split, f"{server.uplink} {server.name}")
+        self._send_all(message.message, exclude=(link,))
+
+    def _remove_servers(self, servers: list, reason: str):
+        """Forget servers and their users, who quit with reason"""
+        names = {server.name.lower() for server in servers}
+        for name in names:
+            self._servers.pop(name, None)
+        for user in list(self._users.values()):
+            if user.server.name.lower() in names:
+                self._remove_user(user, reason)
+
+    def _handle_nick(self, link: ServerLink, message: Message):
+        """A user registered or changed nick behind link"""
+        if len(message.parameters) >= 5:
+            self._introduce_user(link, message)
+        elif message.parameters:
+            self._rename_user(link, message)
+
+    def _introduce_user(self, link: ServerLink, message: Message):
+        nick, hopcount, username, nick_ts, realname = message.parameters[:5]
+        server = self._servers.get((message.source or "").lower())
+        if server is None or server.link is not link or not utils.is_number(nick_ts):
+            self._logger.warning(f"{link.name} sent malformed {message}")
+            return
+
+        nick_ts = int(nick_ts)
+        existing = Client.get_client(nick)
+        if existing is not None and not self._resolve_collision(
+            link, existing, (nick_ts, server.name.lower())
+        ):
+            return
+
+        address = (server.name, next(self._user_numbers))
+        user = RemoteUser(nick, nick_ts, username, realname, server, address)
+        self._users[address] = user
+        Client.nicks[utils.irc_lower(nick)] = user
+        self._send_all(
+            self._encode_user(
+                server.name, nick, server.hopcount + 1, username, nick_ts, realname
+            ),
+            exclude=(link,),
+        )
+
+    def _rename_user(self, link: ServerLink, message: Message):
+        user = self._get_user(link, message.source)
+        if user is None:
+            return
+
+        nick = message.parameters[0]
+        nick_ts = message.parameters[1] if len(message.parameters) > 1 else ""
+        nick_ts = int(nick_ts) if utils.is_number(nick_ts) else int(time.time())
+        existing = Client.get_client(nick)
+        if (
+            existing is not None
+            and existing is not user
+            and not self._resolve_collision(
+                link, existing, (nick_ts, user.server.name.lower())
+            )
+        ):
+            # Its server disconnects the user once it learns of existing
+            self._send_all(
+                utils.encode_message(
+                    IRC_COMMANDS.QUIT, f":{constants.NICK_COLLISION}", user.nick
+                ),
+                exclude=(link,),
+            )
+            self._remove_user(user, constants.NICK_COLLISION)
+            return
+
+        nick_key = utils.irc_lower(user.nick)
+        if Client.nicks.get(nick_key) is user:
+            Client.nicks.pop(nick_key)
+        user.nick, user.nick_ts = nick, nick_ts
+        Client.nicks[utils.irc_lower(nick)] = user
+        self._send_all(message.message, exclude=(link,))
+
+    def _resolve_collision(self, link: ServerLink, existing, claim: tuple) -> bool:
+        """Return True if claim, (ts, lower case server name), wins the nick of
+        existing, which is then removed. Servers beyond link, where claim came
+        from, and beyond the link of existing remove it themselves
+        """
+        if isinstance(existing, RemoteUser):
+            if (existing.nick_ts, existing.server.name.lower()) <= claim:
+                return False
+            exclude = (link, existing.server.link)
+            self._send_all(self._encode_collision(existing.nick), exclude)
+            self._remove_user(existing, constants.NICK_COLLISION)
+            return True
+
+        # An unregistered client was not introduced, it picks another nick
+        if not existing.is_registered:
+            existing.lose_nick()
+            return True
+        if (existing.nick_ts, config.SERVER_NAME.lower()) <= claim:
+            return False
+
+        self._send_all(self._encode_collision(existing.nick), exclude=(link,))
+        # Its nick is taken away first, so its quit is not relayed once more
+        Client.nicks.pop(utils.irc_lower(existing.nick))
+        self._logger.info(f"{constants.NICK_COLLISION} of {existing.nick}")
+        existing.key.data.close_connection(existing.key, constants.NICK_COLLISION)
+        return True
+
+    @staticmethod
+    def _encode_collision(nick: str) -> bytes:
+        return utils.encode_message(
+            IRC_COMMANDS.QUIT, f":{constants.NICK_COLLISION}", nick
+        )
+
+    def _remove_user(self, user: RemoteUser, reason: str):
+        """Forget a remote user, local members of its channels see it part"""
+        for channel_name, joined_channel in user.joined_channels.items():
+            joined_channel.send_to_members(
+                utils.encode_message(
+                    IRC_COMMANDS.PART,
+                    f"{joined_channel.get_channel_name()} :{reason}",
+                    user.nick,
+                ),
+                command=IRC_COMMANDS.PART,
+            )
+            joined_channel.remove_remote_member(user.address)
+            self._delete_if_empty(channel_name, joined_channel)
+        user.joined_channels = {}
+
+        self._users.pop(user.address, None)
+        nick_key = utils.irc_lower(user.nick)
+        if Client.nicks.get(nick_key) is user:
+            Client.nicks.pop(nick_key)
+
+    @staticmethod
+    def _delete_if_empty(channel_name: str, joined_channel):
+        if (
+            not joined_channel.has_members()
+            and Client.channels.get(channel_name) is joined_channel
+        ):
+            Client.channels.pop(channel_name)
+
+    def _add_member(self, user: RemoteUser, channel_name: str):
+        """Add user to channel_name, local members see it join"""
+        channel_key = channel_name.lower()
+        joined_channel = Client.channels.get(channel_key)
+        if joined_channel is None:
+            if channel_name[:1] != "#" or any(
+                character in channel_name
+                for character in constants.FORBIDDEN_CHANNELNAME_CHARS
+            ):
+                return
+            joined_channel = Client.channels[channel_key] = channel.Channel(
+                channel_name
+            )
+
+        if joined_channel.add_remote_member(user):
+            user.joined_channels[channel_key] = joined_channel
+            joined_channel.send_to_members(
+                utils.encode_message(IRC_COMMANDS.JOIN, channel_name, user.nick),
+                command=IRC_COMMANDS.JOIN,
+            )
+
+    def _handle_njoin(self, link: ServerLink, message: Message):
+        """Members of a channel, sent in a burst"""
+        if len(message.parameters) < 2:
+            return
+        channel_name = message.parameters[0]
+        for nick in message.parameters[1].split(","):
+            user = self._get_user(link, nick)
+            if user is not None:
+                self._add_member(user, channel_name)
+        self._send_all(message.message, exclude=(link,))
+
+    def _handle_topic(self, link: ServerLink, message: Message):
+        """Topic of a channel sent in a burst, taken by channels without one"""
+        if len(message.parameters) < 2:
+            return
+        topic_channel = Client.channels.get(message.parameters[0].lower())
+        if topic_channel is None or topic_channel.get_topic():
+            return
+        topic_channel.change_topic(message.parameters[1])
+        self._send_all(message.message, exclude=(link,))
+
+    def _handle_join(self, link: ServerLink, message: Message):
+        user = self._get_user(link, message.source)
+        if user is None or not message.parameters:
+            return
+        self._add_member(user, message.parameters[0])
+        self._send_all(message.message, exclude=(link,))
+
+    def _handle_part(self, link: ServerLink, message: Message):
+        user = self._get_user(link, message.source)
+        if user is None or not message.parameters:
+            return
+        channel_key = message.parameters[0].lower()
+        joined_channel = user.joined_channels.pop(channel_key, None)
+        if joined_channel is None:
+            return
+        joined_channel.send_to_members(message.message, command=message.command)
+        joined_channel.remove_remote_member(user.address)
+        self._delete_if_empty(channel_key, joined_channel)
+        self._send_all(message.message, exclude=(link,))
+
+    def _handle_quit(self, link: ServerLink, message: Message):
+        user = self._get_user(link, message.source)
+        if user is None:
+            return
+        reason = message.parameters[0] if message.parameters else ""
+        self._remove_user(user, reason)
+        self._send_all(message.message, exclude=(link,))
+
+    def _handle_privmsg(self, link: ServerLink, message: Message):
+        """Deliver a message to local clients and pass it on towards others"""
+        if len(message.parameters) < 2 or not self._get_user(link, message.source):
+            return
+        target = message.parameters[0]
+        if target[:1] == "#":
+            target_channel = Client.channels.get(target.lower())
+            if target_channel is not None:
+                target_channel.send_to_members(
+                    message.message, command=message.command
+                )
+                self.send_to_channel(target_channel, message.message, exclude=link)
+            return
+
+        target_client = Client.get_client(target)
+        if target_client is None:
+            return
+        if isinstance(target_client, RemoteUser) and target_client.server.link is link:
+            return
+        target_client.send_raw(message.message)
+
+    # Key: command, Value: handler called with the network, link and message
+    _handlers = {
+        IRC_COMMANDS.SERVER: _handle_server,
+        IRC_COMMANDS.SQUIT: _handle_squit,
+        IRC_COMMANDS.NICK: _handle_nick,
+        IRC_COMMANDS.NJOIN: _handle_njoin,
+        IRC_COMMANDS.TOPIC: _handle_topic,
+        IRC_COMMANDS.JOIN: _handle_join,
+        IRC_COMMANDS.PART: _handle_part,
+        IRC_COMMANDS.QUIT: _handle_quit,
+        IRC_COMMANDS.PRIVMSG: _handle_privmsg,
+    }
+
+
+def get_hopcount(server: RemoteServer) -> int:
+    return server.hopcount
@@ -2,20 +2,63 @@
 import logging
 
 import constants
+from constants import IRC_COMMANDS
 from message import Message
 
+# Key: upper case command as received, Value: command passed on to handlers.
+# Commands the daemon handles map to their IRC_COMMANDS member, so handler
+# lookups find the very same object, the others to an interned str.
+COMMAND_TOKENS = {
+    command.encode(): command for command in constants.VALID_ALPHA_COMMANDS
+}
+COMMAND_TOKENS.update((command.value.encode(), command) for command in IRC_COMMANDS)
+
+# Bytes that are not allowed anywhere in a message
+NUL, CR, LF = b"\0\r\n"
+
+# https://ircv3.net/specs/extensions/message-tags#escaping-values
+TAG_VALUE_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def parse_tags(raw_tags: bytes) -> dict:
+    """Return IRCv3 message tags as a dict of unescaped str values
+
+    A tag without a value has the value ""
+    """
+    tags = {}
+    for raw_tag in raw_tags.decode("utf-8").split(";"):
+        if not raw_tag:
+            continue
+        name, _, value = raw_tag.partition("=")
+        if "\\" in value:
+            value = unescape_tag_value(value)
+        tags[name] = value
+    return tags
+
+
+def unescape_tag_value(value: str) -> str:
+    """Unescape a tag value, a trailing lone backslash is dropped"""
+    unescaped = []
+    characters = iter(value)
+    for character in characters:
+        if character == "\\":
+            escaped = next(characters, "")
+            character = TAG_VALUE_ESCAPES.get(escaped, escaped)
+        unescaped.append(character)
+    return "".join(unescaped)
+
 
 class Parser:
     """Parser responsible for parsing received IRC messages
 
-    It receives a Message object. It parses the message creates a new
-    Message with command and parameter fields. Finally it dispatches the
-    Message to the EventBus.
+    It receives a Message object holding a raw IRC delimited line. It parses
+    the line into the command, parameters, tags and source fields of that same
+    Message and dispatches it to the EventBus.
     """
 
     def __init__(self, dispatch: callable):
         """Save the dispatch function to send messages to event_bus"""
-        self._logger = logging.getLogger("Parser")
+        self._logger = logging.getLogger(__name__)
         self._dispatch = dispatch
 
     def _handle_message(self, message: Message):
@@ -38,75 +81,68 @@ class Parser:
         # If the delimiter is not found, the message never reaches the parser
         self._handle_message(message)
 
-    def _parse_parameters(self, parameters: list):
-        """Return a list of parsed parameters.
-        If there are any bad parameters, return None"""
-        for i in range(len(parameters)):
-            for forbidden_sequence in ["\0", "\r", "\n", "::"]:
-                if forbidden_sequence in parameters[i]:
-                    return None
-        return parameters
-
     def _parse_message(self, message: Message):
         """Parse message according to IRC spec
-        If parse is successful, forward message to EventBus
-        Otherwise, drop message"""
+        https://modern.ircdocs.horse/#message-format
 
-        # Decode message
-        try:
-            message_str = message.message.decode("utf-8")
-        except UnicodeDecodeError:
-            self._logger.debug("Could not decode message from utf-8 encoding!")
-            return
-
-        # Remove EOL delimiter
+        Fill in the fields of message and return it if parse is successful,
+        otherwise return None so that the message is dropped
+        """
         delimiter_length = len(constants.IRC_TERMINATION_DELIMITER)
-        stripped_message = message_str[:-delimiter_length].lstrip()
+        body = message.message[:-delimiter_length].lstrip()
+
+        tags = None
+        if body[:1] == b"@":
+            raw_tags, _, body = body[1:].partition(b" ")
+            try:
+                tags = parse_tags(raw_tags)
+            except UnicodeDecodeError:
+                self._logger.debug("Could not decode tags from utf-8 encoding!")
+                return None
+            body = body.lstrip(b" ")
 
         # Accept messages that exceed MAX_LINE_LENGTH, but slice them
+        # Tags do not count towards the limit
         # https://modern.ircdocs.horse/#compatibility-with-incorrect-software
-        if len(stripped_message) > constants.MAX_LINE_LENGTH - delimiter_length:
-            stripped_message = stripped_message[
-                : constants.MAX_LINE_LENGTH - delimiter_length
-            ]
-
-        # Find colon in message, if exists
-        aggregated_param = None
-        colon_index = stripped_message.find(":")
-        if colon_index > -1 and colon_index < len(stripped_message):
-            aggregated_param = self._parse_parameters(
-                [stripped_message[colon_index + 1 :]]
-            )
-            if aggregated_param is None:
-                return
-            stripped_message = stripped_message[:colon_index].rstrip()
-
-        # Split message by space
-        split_message = stripped_message.split(" ")
-
-        # Inspect contents (assume no tags and source for now)
-        if len(split_message) < 1 and aggregated_param is None:
-            return
-
-        command = split_message[0].upper()
-        parameters = self._parse_parameters(split_message[1:])
-        for param in parameters:
-            if param == "":
-                parameters.remove(param)
-        if aggregated_param is not None:
-            parameters.append(aggregated_param[0])
-
-        if (command not in constants.VALID_ALPHA_COMMANDS) or parameters is None:
-            return
-
-        # Return parsed message
-        parsed_message = Message(
-            message.client_address,
-            "HANDLE",
-            message.message,
-            message.key,
-            command,
-            parameters,
+        body = body[: constants.MAX_LINE_LENGTH - delimiter_length]
+        # Integers are searched for faster than single byte bytes
+        if NUL in body or CR in body or LF in body:
+            return None
+
+        source = None
+        if body[:1] == b":":
+            source, _, body = body[1:].partition(b" ")
+            body = body.lstrip(b" ")
+
+        raw_command, _, rest = body.partition(b" ")
+        command = COMMAND_TOKENS.get(raw_command) or COMMAND_TOKENS.get(
+            raw_command.upper()
         )
+        if command is None:
+            return None
 
-        return parsed_message
+        try:
+            rest = rest.decode("utf-8")
+            if source is not None:
+                source = source.decode("utf-8")
+        except UnicodeDecodeError:
+            self._logger.debug("Could not decode message from utf-8 encoding!")
+            return None
+
+        # The trailing parameter follows the first " :" and may hold anything
+        if rest[:1] == ":":
+            parameters = [rest[1:]]
+        else:
+            middle, separator, trailing = rest.partition(" :")
+            parameters = middle.split(" ") if middle else []
+            if "" in parameters:
+                parameters = [parameter for parameter in parameters if parameter]
+            if separator:
+                parameters.append(trailing)
+
+        message.action = "HANDLE"
+        message.command = command
+        message.parameters = parameters
+        message.tags = tags
+        message.source = source
+        return message
@@ -1,122 +1,272 @@
 """Server module is responsible for managing client connections"""
+import errno
 import logging
+import os
 import selectors
 import socket
+import ssl
+import time
 import traceback
 from selectors import SelectorKey
 from types import SimpleNamespace
 
+import config
 import constants
+from connection import Connection
+from listener import Listener
 from message import Message
+from metrics import Metrics
 
 
 class Server:
     """Server class responsible for handling socket connections with client
 
     Server will buffer receievd data until a full IRC delimited message is received.
+    Each readiness event is drained until the socket would block.
     It will then dispatch the message as a Message to the parser.
 
-    Server also continously checks if in_buffer for any socket has data.
+    Server also continously checks if out_queue for any socket has data.
     If so it will write such data to client.
     """
 
-    def __init__(self, host: str, port: int, dispatch: callable) -> None:
-        """Start the server"""
-        self._selector = selectors.DefaultSelector()
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        dispatch: callable,
+        reuse_port: bool = False,
+        readers: list = (),
+        tick: callable = None,
+        listeners: list = None,
+        connections: list = (),
+        on_start: callable = None,
+    ) -> None:
+        """Start the server
+
+        reuse_port: Share the port with other workers through SO_REUSEPORT
+        readers: Objects with fileno() and handle_readable() to serve alongside
+            clients, like the BrokerLink in worker mode. The server stops if
+            handle_readable raises ConnectionError
+        tick: Called once per loop iteration, returns seconds until it must be
+            called again or None to wait for the next event
+        listeners: Listeners to accept clients on instead of host and port.
+            Those without a socket yet, unlike the ones handed over by a hot
+            restart, start listening with the server
+        connections: (socket, Connection) of clients handed over by a hot
+            restart, served from the start
+        on_start: Called with the server once it listens, before the loop runs
+        """
+        self._selector = None  # Created once the server starts
         self._host = host
         self._port = port
+        self._reuse_port = reuse_port
+        self._readers = {reader.fileno(): reader for reader in readers}
+        self._tick = tick
+        self._listeners = listeners or [Listener(socket.AF_INET, (host, port))]
+        self._connections = connections
+        self._on_start = on_start
         self._logger = logging.getLogger(__name__)
         self._dispatch = dispatch
+        # Every connection receives into this buffer before data is appended
+        # to its in_buffer, so idle connections do not hold receive space
+        self._receive_view = memoryview(bytearray(constants.RECEIVE_LENGTH))
+        # Keys of connections that queued output during this loop iteration
+        self._dirty_keys = []
+        # Keys of TLS connections whose handshake can progress, by file
+        # descriptor, stepped in the order their sockets became ready
+        self._handshake_keys = {}
+        # Bound once, so connections share them instead of holding bound methods
+        self._shared_mark_dirty = self._mark_dirty
+        self._shared_close_connection = self._close_connection
         self._start_server()
 
-    def _get_writing_toggle(self, connection: socket.socket):
-        """Return a function to toggle whether to wait for socket write events
+    def _mark_dirty(self, key: SelectorKey):
+        """Flush out_queue of key once the current loop iteration is done
 
-        Since healthy socket is always ready for write,
-        we should only toggle when we want to write to ensure
+        Shared by every connection, Client calls it through key.data.mark_dirty
+        """
+        key.data.is_dirty = True
+        self._dirty_keys.append(key)
+
+    def _flush_dirty_connections(self):
+        """Write every connection that queued output during this iteration"""
+        dirty_keys, self._dirty_keys = self._dirty_keys, []
+        for key in dirty_keys:
+            key.data.is_dirty = False
+            if (
+                key.fileobj.fileno() != constants.CLOSED_FILENO
+                and key.data.handshake_started_at is None
+            ):
+                self._send_response(key)
+
+    def _set_interest(
+        self, key: SelectorKey, is_waiting_for_write: bool, is_reading_paused: bool
+    ):
+        """Set which socket events to wait for
+
+        Since healthy socket is always ready for write, we only wait for
+        write readiness after the socket buffer filled up, to ensure
         that event loop is not running needlessly.
+        Reading is paused while a client does not read what it is sent.
         """
+        key_data = key.data
+        if (
+            key_data.is_waiting_for_write == is_waiting_for_write
+            and key_data.is_reading_paused == is_reading_paused
+        ):
+            return
 
-        def toggle(key_data, make_writable: bool):
-            events = (
-                selectors.EVENT_READ | selectors.EVENT_WRITE
-                if make_writable
-                else selectors.EVENT_READ
-            )
-            self._selector.modify(connection, events, key_data)
-
-        return toggle
-
-    def _handle_new_client_connection(self, socket: socket.socket):
-        """On client connection, create state and register it with the selector"""
-        client_connection, client_address = socket.accept()
-
-        self._logger.info(f"Accepted connection from {client_address}")
-        client_connection.setblocking(False)
+        key_data.is_waiting_for_write = is_waiting_for_write
+        key_data.is_reading_paused = is_reading_paused
+        events = 0 if is_reading_paused else selectors.EVENT_READ
+        if is_waiting_for_write:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(key.fileobj, events, key_data)
 
-        toggle_writable = self._get_writing_toggle(client_connection)
+    def _handle_new_client_connection(self, listener: Listener):
+        """Accept clients until none is waiting or config.ACCEPT_BUDGET were
+        accepted, create their state and register them with the selector
 
-        key = SimpleNamespace(
-            address=client_address,
-            in_buffer=b"",
-            out_buffer=b"",
-            is_server_socket=False,
-            unregister_socket=False,
-            toggle_writable=toggle_writable,
+        Clients still waiting are accepted in the next loop iteration
+        """
+        for _ in range(config.ACCEPT_BUDGET):
+            try:
+                client_connection, peer_address = listener.socket.accept()
+            except BlockingIOError:
+                return
+            except ConnectionAbortedError:
+                continue
+
+            client_address = listener.get_client_address(peer_address)
+            self._logger.info(f"Accepted connection from {client_address}")
+            client_connection.setblocking(False)
+
+            connection = Connection(
+                client_address, self._shared_mark_dirty, self._shared_close_connection
+            )
+            if listener.tls is not None:
+                client_connection = listener.tls.wrap(client_connection)
+                connection.handshake_started_at = time.perf_counter()
+            self._register_connection(client_connection, connection)
+
+    def _register_connection(
+        self, client_connection: socket.socket, connection: Connection
+    ):
+        """Register connection state with the selector and signal the connect
+
+        Input and output the connection already buffered, when it was handed
+        over by a hot restart, is handled in this loop iteration. A TLS
+        connection starts its handshake in this loop iteration
+        """
+        connection.mark_dirty = self._shared_mark_dirty
+        connection.close_connection = self._shared_close_connection
+        key = self._register_socket(client_connection, connection)
+        self._dispatch(
+            Message(
+                connection.address,
+                constants.SERVER_EVENTS.CONNECT,
+                b"",
+                key,
+                command=constants.SERVER_EVENTS.CONNECT,
+            )
         )
+        if connection.handshake_started_at is not None:
+            self._handshake_keys[client_connection.fileno()] = key
+            return
+        if connection.in_buffer:
+            self._dispatch_message_to_parser(key)
+        if connection.out_queue and not connection.is_dirty:
+            self._mark_dirty(key)
 
-        events = selectors.EVENT_READ
+    def connect(self, address: tuple):
+        """Open a connection to address (host, port) and serve it like an
+        accepted one, raise OSError if it cannot be opened
 
-        self._selector.register(client_connection, events, data=key)
+        The name is resolved blocking, the connection completes in the event
+        loop. Its output is queued until then
+        """
+        host, port = address
+        family, socktype, proto, _, peer_address = socket.getaddrinfo(
+            host, port, type=socket.SOCK_STREAM
+        )[0]
+        client_connection = socket.socket(family, socktype, proto)
+        client_connection.setblocking(False)
+        error = client_connection.connect_ex(peer_address)
+        if error not in (0, errno.EINPROGRESS):
+            client_connection.close()
+            raise OSError(error, os.strerror(error))
+
+        self._logger.info(f"Connecting to {address}")
+        connection = Connection(
+            address, self._shared_mark_dirty, self._shared_close_connection
+        )
+        self._register_connection(client_connection, connection)
 
-    def _has_irc_termination_delimiter(self, in_buffer: bytes) -> bool:
-        """Return true if buffer is delimited by \r\n"""
-        index_of_delimiter = in_buffer.find(constants.IRC_TERMINATION_DELIMITER)
-        return index_of_delimiter != constants.NOT_FOUND
+    def _register_socket(self, client_connection: socket.socket, connection):
+        """Wait for data on client_connection, return its key"""
+        return self._selector.register(
+            client_connection, selectors.EVENT_READ, data=connection
+        )
 
-    def _get_delimiter_position(self, in_buffer: bytes) -> int:
-        """Return index of \r\n delimiter"""
-        index_of_delimiter = in_buffer.find(constants.IRC_TERMINATION_DELIMITER)
-        return index_of_delimiter
+    def _unregister_and_close(self, key: SelectorKey):
+        """Stop waiting for events on the socket of key and close it"""
+        self._selector.unregister(key.fileobj)
+        key.fileobj.close()
 
     def _receive_and_buffer_data(self, key: SelectorKey):
-        """Receive data and call dispatcher if it has IRC delimiter.
+        """Receive data until the socket would block and dispatch every
+        IRC delimited message to the parser.
 
-        If no data received, close socket
+        If no data received, or the client sent more unterminated data than
+        the in_buffer holds, close socket
         """
         socket, address = key.fileobj, key.data.address
+        in_buffer, out_queue = key.data.in_buffer, key.data.out_queue
 
-        try:
-            received_data = socket.recv(constants.RECEIVE_LENGTH)
-        except ConnectionResetError:
-            self._dispatch_on_disconnect(key)
-            return
-
-        self._logger.debug(
-            f"Received the following data from {address}: {received_data}"
-        )
-
-        if received_data:
-            key.data.in_buffer += received_data
-            if self._has_irc_termination_delimiter(key.data.in_buffer):
-                self._dispatch_message_to_parser(key)
-
-        # Empty receipt means we terminate
-        else:
-            self._logger.info(f"Closing connection to {address}")
-            self._dispatch_on_disconnect(key)
-            self._selector.unregister(socket)
-            socket.close()
+        # Stop reading once the client has quit or stopped reading replies
+        while (
+            not key.data.unregister_socket
+            and len(out_queue) <= config.SENDQ_LOW_WATERMARK
+        ):
+            try:
+                num_bytes_received = socket.recv_into(self._receive_view)
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except (ConnectionError, ssl.SSLError):
+                self._close_connection(key)
+                return
+
+            # Empty receipt means we terminate
+            if not num_bytes_received:
+                self._logger.info(f"Closing connection to {address}")
+                self._close_connection(key)
+                return
+
+            self._logger.debug("Received %d bytes from %s", num_bytes_received, address)
+            Metrics.num_bytes_received += num_bytes_received
+
+            in_buffer.extend(self._receive_view[:num_bytes_received])
+            self._dispatch_message_to_parser(key)
+
+            if in_buffer.is_overflowing():
+                self._logger.info(f"Input buffer of {address} overflowed, closing")
+                self._close_connection(key)
+                return
 
     def _dispatch_message_to_parser(self, key: SelectorKey):
         """Retrieve data from buffer, build Message and dispatch to parser"""
         address = key.data.address
 
-        for message in self._get_message_from_in_buffer(key):
+        for message in key.data.in_buffer.lines():
             message = Message(address, "PARSE", message, key)
             self._dispatch(message)
+            # Lines after a QUIT, or after a server link was dropped, are left
+            if key.data.unregister_socket:
+                return
 
-    def _dispatch_on_disconnect(self, key: SelectorKey):
+    def _dispatch_on_disconnect(
+        self, key: SelectorKey, reason: str = constants.DEFAULT_DISCONNECT_REASON
+    ):
         address = key.data.address
         message = Message(
             address,
@@ -124,108 +274,183 @@ class Server:
             b"",
             key,
             command=constants.SERVER_EVENTS.DISCONNECT,
+            parameters=[reason],
         )
         self._dispatch(message)
 
+    def _close_connection(
+        self, key: SelectorKey, reason: str = constants.DEFAULT_DISCONNECT_REASON
+    ):
+        """Signal disconnect to the client, then unregister and close socket"""
+        self._dispatch_on_disconnect(key, reason)
+        self._unregister_and_close(key)
+
     def _service_existing_connection(self, key: SelectorKey, event_mask: int):
         """Handle read or write event on existing connection"""
+        if key.data.handshake_started_at is not None:
+            self._handshake_keys[key.fd] = key
+            return
+
         if event_mask & selectors.EVENT_READ:
             self._receive_and_buffer_data(key)
 
-        if event_mask & selectors.EVENT_WRITE and key.data.out_buffer:
+        # Connection may have been closed while reading
+        if key.fileobj.fileno() == constants.CLOSED_FILENO:
+            return
+
+        if event_mask & selectors.EVENT_WRITE and key.data.out_queue:
             self._send_response(key)
 
-    def _get_message_from_in_buffer(self, key: SelectorKey):
-        """Generator to retrieve all IRC delimited strings from in_buffer"""
-        while delimiter_position := key.data.in_buffer.find(
-            constants.IRC_TERMINATION_DELIMITER
-        ):
-            if delimiter_position == constants.NOT_FOUND:
-                break
-
-            message = key.data.in_buffer[
-                : delimiter_position + constants.DELIMITER_END_OFFSET
-            ]
-            key.data.in_buffer = key.data.in_buffer[len(message) :]
-            yield (message)
-
-    def _get_message(self, key: SelectorKey):
-        """Generator to retrieve all IRC delimited strings from out_buffer"""
-        while delimiter_position := key.data.out_buffer.find(
-            constants.IRC_TERMINATION_DELIMITER
-        ):
-            if delimiter_position == constants.NOT_FOUND:
-                break
+    def _send_response(self, key: SelectorKey):
+        """Send contents of out_queue to client"""
+        socket, address = key.fileobj, key.data.address
 
-            message = key.data.out_buffer[
-                : delimiter_position + constants.DELIMITER_END_OFFSET
-            ]
-            key.data.out_buffer = key.data.out_buffer[len(message) :]
-            yield (message)
+        try:
+            num_bytes_sent = key.data.out_queue.send(socket)
+        except ConnectionError as e:
+            self._logger.debug(f"Connection error {e}, deregistering socket")
+            self._close_connection(key)
+            return
 
-    def _send_response(self, key: SelectorKey):
-        """Send contents of out_buffer to client"""
-        socket = key.fileobj
-
-        # Could have multiple messages in output buffer
-        for message in self._get_message(key):
-            self._logger.debug(f"Sending message {message}")
-            while message != constants.EMPTY_STRING:
-                try:
-                    num_bytes_sent = socket.send(message)
-                    message = message[num_bytes_sent:]
-                except ConnectionError as e:
-                    self._logger.debug(f"Connection error {e}, deregistering socket")
-                    self._dispatch_on_disconnect(key)
-                    self._selector.unregister(socket)
-                    socket.close()
-                    return
-                if key.data.unregister_socket:
-                    self._selector.unregister(socket)
-                    socket.close()
-                    return
-        key.data.toggle_writable(key.data, False)
+        self._logger.debug("Sent %d bytes to %s", num_bytes_sent, address)
+        Metrics.num_bytes_sent += num_bytes_sent
 
-    def _start_server(self):
-        """Initialize server socket and call event_loop initialization"""
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        out_queue = key.data.out_queue
+        high_watermark = (
+            constants.LINK_SENDQ_HIGH_WATERMARK
+            if key.data.is_server_link
+            else config.SENDQ_HIGH_WATERMARK
+        )
+        if len(out_queue) > high_watermark:
+            self._logger.info(f"{constants.SENDQ_EXCEEDED} by {address}, closing")
+            self._close_connection(key, constants.SENDQ_EXCEEDED)
+            return
+
+        if not out_queue and key.data.unregister_socket:
+            self._unregister_and_close(key)
+            return
+
+        if not out_queue and key.data.refill is not None:
+            key.data.refill()
 
-        # Avoid "Address already in use" error
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Wait for write readiness while the socket buffer is full
+        self._set_interest(
+            key,
+            is_waiting_for_write=bool(out_queue),
+            is_reading_paused=len(out_queue) > config.SENDQ_LOW_WATERMARK,
+        )
 
-        server_socket.bind((self._host, self._port))
-        server_socket.listen()
+    def _step_handshakes(self):
+        """Continue up to TLS_HANDSHAKE_BUDGET TLS handshakes whose socket
+        became ready, the others continue in the next loop iteration
 
-        self._logger.info(f"Listening on {(self._host, self._port)}")
+        A connection whose handshake completed is read from right away, the
+        client may have sent its registration along with the last handshake
+        message. A failed handshake closes the connection.
+        """
+        handshake_keys = self._handshake_keys
+        for _ in range(min(len(handshake_keys), constants.TLS_HANDSHAKE_BUDGET)):
+            key = handshake_keys.pop(next(iter(handshake_keys)))
+            tls_socket, connection = key.fileobj, key.data
+            if tls_socket.fileno() == constants.CLOSED_FILENO:
+                continue
+
+            try:
+                tls_socket.do_handshake()
+            except ssl.SSLWantReadError:
+                self._set_handshake_interest(key, is_waiting_for_write=False)
+                continue
+            except ssl.SSLWantWriteError:
+                self._set_handshake_interest(key, is_waiting_for_write=True)
+                continue
+            except (ssl.SSLError, OSError) as e:
+                address = connection.address
+                self._logger.info(f"TLS handshake with {address} failed: {e}")
+                Metrics.num_tls_failed += 1
+                self._close_connection(key)
+                continue
+
+            Metrics.observe_tls_handshake(
+                time.perf_counter() - connection.handshake_started_at,
+                tls_socket.session_reused,
+            )
+            connection.handshake_started_at = None
+            self._set_handshake_interest(key, is_waiting_for_write=False)
+            self._receive_and_buffer_data(key)
+            if tls_socket.fileno() != constants.CLOSED_FILENO:
+                if connection.out_queue and not connection.is_dirty:
+                    self._mark_dirty(key)
 
-        server_socket.setblocking(False)
+    def _set_handshake_interest(self, key: SelectorKey, is_waiting_for_write: bool):
+        """Wait for the socket event the TLS handshake of key needs next"""
+        if key.data.is_waiting_for_write == is_waiting_for_write:
+            return
+        key.data.is_waiting_for_write = is_waiting_for_write
+        events = selectors.EVENT_WRITE if is_waiting_for_write else selectors.EVENT_READ
+        self._selector.modify(key.fileobj, events, key.data)
 
-        # key will be registered alongside socket in selector
-        # so we can access it whenever we access the socket
-        key = SimpleNamespace(is_server_socket=True)
+    def _start_server(self):
+        """Initialize server socket and call event_loop initialization"""
+        self._selector = selectors.DefaultSelector()
+        for listener in self._listeners:
+            if listener.socket is None:
+                listener.listen(self._reuse_port)
+            self._logger.info(f"Listening on {listener}")
+
+            # The listener is registered alongside its socket in the selector,
+            # we are only interested in reading new cxn information from it
+            self._selector.register(
+                listener.socket, selectors.EVENT_READ, data=listener
+            )
+
+        for reader in self._readers.values():
+            key = SimpleNamespace(is_server_socket=False)
+            self._selector.register(reader, selectors.EVENT_READ, data=key)
+
+        for client_connection, connection in self._connections:
+            self._register_connection(client_connection, connection)
+        self._connections = ()
 
-        # We are only interested in reading new cxn information from server_socket
-        self._selector.register(server_socket, selectors.EVENT_READ, data=key)
+        if self._on_start is not None:
+            self._on_start(self)
         self._run_event_loop()
 
     def _run_event_loop(self):
         """Wait for sockets to register events and handle appropriately"""
+        timeout = None
         try:
             while True:
-                active_socket = self._selector.select(timeout=None)
+                # Handshakes beyond the budget continue without waiting
+                active_socket = self._selector.select(
+                    timeout=0 if self._handshake_keys else timeout
+                )
+                Metrics.num_wakeups += 1
 
                 for socket_data, event_mask in active_socket:
 
-                    socket = socket_data.fileobj
                     connection_receieved_on_server_socket = (
                         socket_data.data.is_server_socket
                     )
 
                     if connection_receieved_on_server_socket:
-                        self._handle_new_client_connection(socket)
+                        self._handle_new_client_connection(socket_data.data)
+                    elif socket_data.fd in self._readers:
+                        self._readers[socket_data.fd].handle_readable()
                     else:
                         self._service_existing_connection(socket_data, event_mask)
 
+                if self._handshake_keys:
+                    self._step_handshakes()
+
+                timeout = None
+                if self._tick is not None:
+                    timeout = self._tick()
+
+                self._flush_dirty_connections()
+                # Refills queued further output, which is sent without waiting
+                if self._dirty_keys:
+                    timeout = 0
+
         except Exception as e:
             self._logger.debug(f"Exception in event loop: {e}")
             traceback.print_exc()
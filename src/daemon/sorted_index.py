@@ -0,0 +1,88 @@
+"""This module keeps the keys of a dict sorted, to search them by mask
+
+Client.nicks is a SortedIndex and ChannelIndex builds on it. Keys that start
+with the fixed part of a mask, the part before its first wildcard, are found
+by bisection instead of looking at every key.
+
+Replies to searches like WHO and LIST are queued over several loop iterations
+while keys come and go. Searches are generators that find their place again
+after every key they yield.
+"""
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+# Characters of a mask that match any characters, or any single one
+WILDCARDS = "*?"
+
+
+class SortedIndex(dict):
+    """A dict that also keeps its keys sorted
+
+    Only item assignment, del, pop and clear keep the keys sorted, like
+    Client uses
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []  # Sorted keys
+
+    def __setitem__(self, key: str, value):
+        if key not in self:
+            self._keys.insert(bisect_left(self._keys, key), key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: str):
+        self.pop(key)
+
+    def pop(self, key: str, *default):
+        if key in self:
+            del self._keys[bisect_left(self._keys, key)]
+        return super().pop(key, *default)
+
+    def clear(self):
+        super().clear()
+        self._keys.clear()
+
+    def iter_matching(self, masks: list):
+        """Yield sorted keys that match any of masks, each once
+
+        Masks must be casefolded like the keys. * matches any characters and ?
+        any single one
+        """
+        matchers = [compile_mask(mask) for mask in masks]
+        for key in self.iter_prefixes([get_prefix(mask) for mask in masks]):
+            if any(matches(key) for matches in matchers):
+                yield key
+
+    def iter_prefixes(self, prefixes: list):
+        """Yield sorted keys starting with any of prefixes, each once"""
+        # A prefix that starts with another one adds nothing
+        distinct = []
+        for prefix in sorted(prefixes):
+            if not distinct or not prefix.startswith(distinct[-1]):
+                distinct.append(prefix)
+
+        keys = self._keys
+        for prefix in distinct:
+            position = bisect_left(keys, prefix)
+            while position < len(keys) and keys[position].startswith(prefix):
+                key = keys[position]
+                yield key
+                # Keys may have been added or removed while suspended
+                position = bisect_right(keys, key)
+
+
+def get_prefix(mask: str) -> str:
+    """Return the part of mask before its first wildcard"""
+    for index, character in enumerate(mask):
+        if character in WILDCARDS:
+            return mask[:index]
+    return mask
+
+
+@lru_cache(maxsize=256)
+def compile_mask(mask: str):
+    """Return a function that tells if a name matches mask, compiled once"""
+    pattern = re.escape(mask).replace(r"\*", ".*").replace(r"\?", ".")
+    return re.compile(pattern, re.DOTALL).fullmatch
@@ -0,0 +1,130 @@
+"""This module schedules timers on a hierarchical timing wheel
+
+Every level of the wheel has WHEEL_SLOTS slots. A slot of the first level
+covers one tick of `resolution` seconds, a slot of every further level covers
+a whole turn of the level below it. Timers are put into the slot their
+deadline falls into, so scheduling and cancelling a timer takes constant
+time however many timers are pending. Whenever a level completes a turn, the
+timers of the next slot of the level above it are spread over the slots below.
+"""
+import constants
+
+
+class Timer:
+    """A callback scheduled on a TimerWheel, returned by TimerWheel.schedule"""
+
+    __slots__ = ("deadline", "callback", "args", "slot")
+
+    def __init__(self, deadline: int, callback: callable, args: tuple):
+        self.deadline = deadline  # Tick of the wheel the timer expires at
+        self.callback = callback
+        self.args = args
+        self.slot = None  # Slot holding the timer, None once it expired
+
+
+class TimerWheel:
+    """Calls the callbacks of timers once their delay has passed
+
+    Timers expire with a precision of one tick, never early. The wheel is
+    driven by advance, which the event loop calls through its tick.
+    """
+
+    def __init__(
+        self,
+        now: float,
+        resolution: float = constants.WHEEL_RESOLUTION,
+        num_levels: int = constants.WHEEL_LEVELS,
+    ):
+        """now: Current time in seconds, like time.monotonic()"""
+        self._resolution = resolution
+        self._current = int(now / resolution)  # Tick whose timers expired last
+        # Every slot maps its timers to None, a dict keeps them in order
+        self._levels = [
+            [{} for _ in range(constants.WHEEL_SLOTS)] for _ in range(num_levels)
+        ]
+        self._max_ticks = constants.WHEEL_SLOTS**num_levels - 1
+        self.now = now
+        self.num_timers = 0
+
+    def schedule(self, delay: float, callback: callable, *args) -> Timer:
+        """Call callback with args once delay seconds have passed"""
+        num_ticks = max(1, -int(-delay // self._resolution))
+        timer = Timer(self._current + min(num_ticks, self._max_ticks), callback, args)
+        self._insert(timer)
+        self.num_timers += 1
+        return timer
+
+    def cancel(self, timer: Timer):
+        """Forget timer, it may have expired already"""
+        if timer.slot is not None:
+            del timer.slot[timer]
+            timer.slot = None
+            self.num_timers -= 1
+
+    def advance(self, now: float):
+        """Call the callbacks of every timer that expired by now"""
+        self.now = now
+        target = int(now / self._resolution)
+        if not self.num_timers:
+            self._current = max(self._current, target)
+            return
+
+        first_level = self._levels[0]
+        while self._current < target:
+            self._current += 1
+            if not self._current & constants.WHEEL_MASK:
+                self._cascade(1)
+
+            slot = first_level[self._current & constants.WHEEL_MASK]
+            while slot:
+                timer = next(iter(slot))
+                del slot[timer]
+                timer.slot = None
+                self.num_timers -= 1
+                timer.callback(*timer.args)
+
+    def get_delay(self) -> float:
+        """Return seconds until advance must be called again,
+        or None if no timer is pending
+        """
+        if not self.num_timers:
+            return None
+
+        # Timers in further levels are cascaded when the first level turns
+        first_level = self._levels[0]
+        num_ticks = constants.WHEEL_SLOTS - (self._current & constants.WHEEL_MASK)
+        for offset in range(1, num_ticks):
+            if first_level[(self._current + offset) & constants.WHEEL_MASK]:
+                num_ticks = offset
+                break
+        return max(0.0, (self._current + num_ticks) * self._resolution - self.now)
+
+    def _insert(self, timer: Timer):
+        """Put timer into the slot of the lowest level that reaches its deadline"""
+        num_ticks = timer.deadline - self._current
+        level = 0
+        while num_ticks >> (constants.WHEEL_BITS * (level + 1)):
+            level += 1
+        index = (timer.deadline >> (constants.WHEEL_BITS * level)) & (
+            constants.WHEEL_MASK
+        )
+        timer.slot = self._levels[level][index]
+        timer.slot[timer] = None
+
+    def _cascade(self, level: int):
+        """Spread the timers of the next slot of level over the levels below"""
+        if level == len(self._levels):
+            return
+
+        index = (self._current >> (constants.WHEEL_BITS * level)) & (
+            constants.WHEEL_MASK
+        )
+        # Turning this level over cascades the next level first
+        if not index:
+            self._cascade(level + 1)
+
+        slot = self._levels[level][index]
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self._insert(timer)
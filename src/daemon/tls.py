@@ -0,0 +1,57 @@
+"""This module holds the TLS settings of listeners with the tls option
+
+Every TLS listener shares one TlsContext. Its SSLContext keeps the session
+cache and the session ticket keys for the lifetime of the daemon, so clients
+resume their sessions instead of paying for a full handshake, also after the
+certificate was reloaded. A reload loads the certificate into a new SSLContext,
+which the SNI callback selects for every handshake that follows.
+"""
+import logging
+import ssl
+
+import constants
+
+
+class TlsContext:
+    """Certificate and session state of the TLS listeners"""
+
+    def __init__(self, cert_path: str, key_path: str = None):
+        """cert_path: PEM file with the certificate chain, and the private key
+            unless key_path is given
+        Raises OSError or ssl.SSLError if they cannot be loaded
+        """
+        self._logger = logging.getLogger(__name__)
+        self._cert_path = cert_path
+        self._key_path = key_path
+        # Handshakes start with this context, which resumes sessions
+        self.context = self._create_context()
+        self.context.sni_callback = self._select_context
+        self._current = self.context  # Holds the certificate loaded last
+
+    def _create_context(self) -> ssl.SSLContext:
+        """Return a server context with the certificate loaded"""
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.num_tickets = constants.TLS_NUM_TICKETS
+        context.load_cert_chain(self._cert_path, self._key_path)
+        return context
+
+    def _select_context(self, ssl_socket, server_name: str, context):
+        """Present the certificate loaded last, called before every handshake"""
+        if self._current is not context:
+            ssl_socket.context = self._current
+
+    def reload(self):
+        """Load the certificate again, keep the current one if that fails"""
+        try:
+            self._current = self._create_context()
+        except (OSError, ssl.SSLError) as e:
+            self._logger.error(f"Could not reload {self._cert_path}: {e}")
+            return
+        self._logger.info(f"Reloaded {self._cert_path}")
+
+    def wrap(self, client_socket) -> ssl.SSLSocket:
+        """Return client_socket wrapped for a handshake stepped by the server"""
+        return self.context.wrap_socket(
+            client_socket, server_side=True, do_handshake_on_connect=False
+        )
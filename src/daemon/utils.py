@@ -1,3 +1,14 @@
+import string
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import constants
+
+# https://modern.ircdocs.horse/#casemapping-parameter
+RFC1459_CASEMAPPING = str.maketrans(
+    string.ascii_uppercase + "[]\\~", string.ascii_lowercase + "{}|^"
+)
+
 motd = r"""
 _______________.___.______________________ ________
 \______   \__  |   |   \______   \_   ___ \\______ \
@@ -11,3 +22,111 @@ _______________.___.______________________ ________
 def print_logo():
     """Print out our cool logo"""
     print(motd)
+
+
+def encode_message(numeric: str, message: str, source: str, target: str = None):
+    """Construct a message and return it encoded and terminated with \r\n
+
+    Constructs message according to spec below
+    https://modern.ircdocs.horse/#numeric-replies
+    numeric: 3 digit code per docs
+    message: utf-8 string, optionally terminated with \r\n
+    source: Value to use as source of message
+    target: Nick of the client the message is sent to, if it should be included
+    """
+    message_source = f":{source}"
+    if target is not None:
+        constructed_messsage = f"{message_source} {numeric} {target} {message}"
+    else:
+        constructed_messsage = f"{message_source} {numeric} {message}"
+
+    message_as_bytes = constructed_messsage.encode()
+
+    if not message_as_bytes.endswith(constants.IRC_TERMINATION_DELIMITER):
+        message_as_bytes += constants.IRC_TERMINATION_DELIMITER
+
+    return message_as_bytes
+
+
+def compile_replies(replies: list, source: str) -> tuple:
+    """Encode replies ahead of time, leaving out the nick of their target
+
+    replies: (numeric, message) pairs, as passed to encode_message
+    Return parts that make up the replies when joined by the encoded nick
+    """
+    parts = [b""]
+    for numeric, message in replies:
+        parts[-1] += f":{source} {numeric} ".encode()
+        parts.append(f" {message}".encode() + constants.IRC_TERMINATION_DELIMITER)
+    return tuple(parts)
+
+
+def is_number(value: str) -> bool:
+    """Return True if value is an unsigned decimal number in ASCII digits
+
+    str.isdigit also accepts digits such as "²" that int cannot parse
+    """
+    return value.isascii() and value.isdigit()
+
+
+def parse_port(value: str):
+    """Return value as a TCP port number, None if it is not one"""
+    if not is_number(value) or int(value) > 65535:
+        return None
+    return int(value)
+
+
+def iter_joined_lines(prefix: bytes, words):
+    """Yield lines of prefix and space separated words, each within
+    MAX_LINE_LENGTH, that hold every one of words
+
+    prefix: Encoded start of every line, such as a reply up to the " :" that
+        starts its words
+    words: Encoded words, none of them longer than a line holds
+    """
+    room = (
+        constants.MAX_LINE_LENGTH
+        - len(prefix)
+        - len(constants.IRC_TERMINATION_DELIMITER)
+    )
+    joined, length = [], 0
+    for word in words:
+        # length includes the space after every word
+        if joined and length + len(word) > room:
+            yield prefix + b" ".join(joined) + constants.IRC_TERMINATION_DELIMITER
+            joined, length = [], 0
+        joined.append(word)
+        length += len(word) + 1
+    if joined:
+        yield prefix + b" ".join(joined) + constants.IRC_TERMINATION_DELIMITER
+
+
+def format_server_time(milliseconds: int) -> str:
+    """Return Unix time in milliseconds as an IRCv3 server time, such as
+    2024-01-31T12:00:00.000Z
+
+    https://ircv3.net/specs/extensions/server-time
+    """
+    moment = datetime.fromtimestamp(milliseconds // 1000, timezone.utc)
+    return f"{moment:%Y-%m-%dT%H:%M:%S}.{milliseconds % 1000:03}Z"
+
+
+def parse_server_time(value: str):
+    """Return an IRCv3 server time as Unix time in milliseconds, None if value
+    is not one
+    """
+    if not value.endswith("Z"):
+        return None
+    try:
+        moment = datetime.fromisoformat(value[:-1])
+    except ValueError:
+        return None
+    if moment.tzinfo is not None:
+        return None
+    return round(moment.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+@lru_cache(maxsize=constants.CASEFOLD_CACHE_SIZE)
+def irc_lower(name: str) -> str:
+    """Return name casefolded with the rfc1459 casemapping, results are cached"""
+    return name.translate(RFC1459_CASEMAPPING)
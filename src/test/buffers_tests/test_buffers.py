@@ -0,0 +1,90 @@
+"""Tests the buffers module (src/daemon/buffers.py)"""
+import pytest
+from buffers import InputBuffer, OutputQueue
+
+
+@pytest.fixture
+def in_buffer():
+    """Returns an InputBuffer instance"""
+    return InputBuffer(limit=16)
+
+
+def test_yields_every_delimited_line(in_buffer):
+    in_buffer.extend(b"NICK a\r\nUSER b\r\nJOI")
+    assert list(in_buffer.lines()) == [b"NICK a\r\n", b"USER b\r\n"]
+    assert len(in_buffer) == 3
+
+
+def test_delimiter_split_across_receives(in_buffer):
+    in_buffer.extend(b"PING x\r")
+    assert list(in_buffer.lines()) == []
+    in_buffer.extend(memoryview(b"\nPING y\r\n"))
+    assert list(in_buffer.lines()) == [b"PING x\r\n", b"PING y\r\n"]
+    assert len(in_buffer) == 0
+
+
+def test_compaction_keeps_unconsumed_data(in_buffer):
+    for i in range(100):
+        in_buffer.extend(b"L%d\r\nPART" % i)
+        assert list(in_buffer.lines())[-1] == b"L%d\r\n" % i
+        in_buffer.extend(b"IAL\r\n")
+        assert list(in_buffer.lines()) == [b"PARTIAL\r\n"]
+
+
+def test_overflow_counts_only_unterminated_data(in_buffer):
+    in_buffer.extend(b"A" * 10 + b"\r\n" + b"B" * 16)
+    list(in_buffer.lines())
+    assert not in_buffer.is_overflowing()
+    in_buffer.extend(b"B")
+    list(in_buffer.lines())
+    assert in_buffer.is_overflowing()
+
+
+class FakeSocket:
+    """Socket that accepts at most `capacity` bytes per sendmsg call"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.sent = b""
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b"".join(bytes(buffer) for buffer in buffers)[: self.capacity]
+        if not data:
+            raise BlockingIOError
+        self.sent += data
+        return len(data)
+
+
+def test_output_queue_sends_all_chunks_in_one_call():
+    out_queue = OutputQueue()
+    for i in range(10):
+        out_queue.append(b"line %d\r\n" % i)
+    connection = FakeSocket(capacity=1024)
+
+    assert out_queue.send(connection) == len(connection.sent)
+    assert connection.sent == b"".join(b"line %d\r\n" % i for i in range(10))
+    assert connection.calls == 1
+    assert not out_queue
+
+
+def test_output_queue_resumes_partial_writes():
+    out_queue = OutputQueue()
+    out_queue.append(b"hello\r\n")
+    out_queue.append(b"world\r\n")
+    connection = FakeSocket(capacity=3)
+
+    while out_queue:
+        out_queue.send(connection)
+    assert connection.sent == b"hello\r\nworld\r\n"
+
+
+def test_output_queue_drain_skips_sent_bytes():
+    out_queue = OutputQueue()
+    out_queue.append(b"hello\r\n")
+    out_queue.append(b"world\r\n")
+    out_queue.send(FakeSocket(capacity=3))
+
+    assert b"".join(out_queue.drain()) == b"lo\r\nworld\r\n"
+    assert len(out_queue) == 0
@@ -0,0 +1,50 @@
+"""Tests the channel index (src/daemon/channel_index.py)"""
+from types import SimpleNamespace
+
+from channel import Channel
+from channel_index import ChannelIndex
+
+
+def make_index(sizes: dict) -> ChannelIndex:
+    """Return an index of channels named by sizes with that many members"""
+    index = ChannelIndex()
+    for name, size in sizes.items():
+        index[name.lower()] = Channel(name)
+        for number in range(size):
+            index[name.lower()].register(SimpleNamespace(address=(name, number)))
+    return index
+
+
+def get_names(channels) -> list:
+    return [channel.get_channel_name() for channel in channels]
+
+
+def test_masks_select_channels_by_name():
+    index = make_index({"#linux": 1, "#Linux-dev": 1, "#python": 1, "#lisp": 1})
+    assert get_names(index.search(["#LI*"])) == ["#linux", "#Linux-dev", "#lisp"]
+    assert get_names(index.search(["#li?ux*"], ["*dev"])) == ["#linux"]
+    assert get_names(index.search(["*on"])) == ["#python"]
+    assert get_names(index.search(["#python", "#py*"])) == ["#python"]
+
+
+def test_member_counts_select_largest_first():
+    index = make_index({"#a": 1, "#b": 5, "#c": 3, "#d": 10})
+    assert get_names(index.search(min_members=3)) == ["#d", "#b", "#c"]
+    assert get_names(index.search(min_members=2, max_members=5)) == ["#b", "#c"]
+
+    index["#a"].unregister(("#a", 0))
+    index["#d"].unregister(("#d", 0))
+    assert get_names(index.search(max_members=0)) == ["#a"]
+    assert get_names(index.search(min_members=6)) == ["#d"]
+
+
+def test_search_resumes_after_channels_changed():
+    index = make_index({"#a": 1, "#b": 1, "#c": 1, "#d": 1})
+    search = index.search()
+    assert next(search).get_channel_name() == "#a"
+
+    index.pop("#b")
+    index["#bb"] = Channel("#bb")
+    index.pop("#c")
+    assert get_names(search) == ["#bb", "#d"]
+    assert list(index.search(["#c*"])) == []
@@ -0,0 +1,13 @@
+"""Fixtures shared by the client tests"""
+import pytest
+from client import Client
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    """Client state is class level, start every test from scratch"""
+    yield
+    Client.clients.clear()
+    Client.nicks.clear()
+    Client.channels.clear()
+    Client.registered_count = 0
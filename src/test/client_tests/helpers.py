@@ -0,0 +1,36 @@
+"""Helpers shared by the client tests, see conftest.py for the fixtures"""
+from types import SimpleNamespace
+
+from buffers import InputBuffer, OutputQueue
+from client import Client
+from message import Message
+
+
+def make_client(port: int) -> Client:
+    """Returns a Client whose output is queued on a fake connection"""
+    data = SimpleNamespace(
+        in_buffer=InputBuffer(),
+        out_queue=OutputQueue(),
+        unregister_socket=False,
+        is_dirty=False,
+        mark_dirty=lambda key: None,
+        connected_at=0.0,
+    )
+    return Client(("127.0.0.1", port), SimpleNamespace(data=data))
+
+
+def send(client: Client, command: str, *parameters):
+    client.handle_message(
+        Message(client.address, "HANDLE", b"", client._key, command, list(parameters))
+    )
+
+
+def get_output(client: Client) -> bytes:
+    return b"".join(client._key.data.out_queue.drain())
+
+
+def register(port: int, nick: str) -> Client:
+    client = make_client(port)
+    send(client, "NICK", nick)
+    send(client, "USER", nick, "0", "*", "Real Name")
+    return client
@@ -0,0 +1,78 @@
+"""Tests CHATHISTORY of the client module (src/daemon/client.py)"""
+import config
+import constants
+import pytest
+from history import HistoryStore
+
+from .helpers import get_output, register, send
+
+
+@pytest.fixture(autouse=True)
+def history():
+    config.HISTORY = HistoryStore(capacity=10, budget=1024 * 1024)
+    yield config.HISTORY
+    config.HISTORY = None
+
+
+def get_lines(client) -> list:
+    return get_output(client).split(constants.IRC_TERMINATION_DELIMITER)[:-1]
+
+
+def test_latest_before_and_after():
+    alice, bob = register(1, "alice"), register(2, "bob")
+    send(alice, "JOIN", "#chan")
+    send(bob, "JOIN", "#chan")
+    for number in range(3):
+        send(alice, "PRIVMSG", "#chan", f"message {number}")
+    get_output(bob)
+
+    send(bob, "CHATHISTORY", "LATEST", "#CHAN", "*", "2")
+    lines = get_lines(bob)
+    batch = lines[0].split(b" ")[2][1:]
+    assert lines[0] == b":pyircd BATCH +%s chathistory #chan" % batch
+    assert lines[1].startswith(b"@batch=%s;time=" % batch)
+    assert lines[1].endswith(b";msgid=4 :alice PRIVMSG #chan :message 1")
+    assert lines[2].endswith(b";msgid=5 :alice PRIVMSG #chan :message 2")
+    assert lines[3] == b":pyircd BATCH -%s" % batch
+
+    send(bob, "CHATHISTORY", "BEFORE", "#chan", "msgid=4", "10")
+    lines = get_lines(bob)
+    assert [line.split(b" ", 1)[1] for line in lines[1:-1]] == [
+        b":alice JOIN #chan",
+        b":bob JOIN #chan",
+        b":alice PRIVMSG #chan :message 0",
+    ]
+    send(bob, "CHATHISTORY", "AFTER", "#chan", "timestamp=2000-01-01T00:00:00Z", "1")
+    assert get_lines(bob)[1].endswith(b":alice JOIN #chan")
+
+
+def test_errors():
+    alice = register(1, "alice")
+    send(alice, "JOIN", "#chan")
+    get_output(alice)
+
+    send(alice, "CHATHISTORY", "LATEST", "#other", "*", "5")
+    send(alice, "CHATHISTORY", "AROUND", "#chan", "msgid=1", "5")
+    send(alice, "CHATHISTORY", "BEFORE", "#chan", "*", "5")
+    # Ids and limits are ASCII digits, not any digit str.isdigit accepts
+    send(alice, "CHATHISTORY", "LATEST", "#chan", "*", "²")
+    send(alice, "CHATHISTORY", "BEFORE", "#chan", "msgid=²", "5")
+    assert get_lines(alice) == [
+        b":pyircd FAIL CHATHISTORY INVALID_TARGET LATEST #other"
+        b" :Messages could not be retrieved",
+        b":pyircd FAIL CHATHISTORY UNKNOWN_COMMAND AROUND :Unknown subcommand",
+        b":pyircd FAIL CHATHISTORY INVALID_PARAMS BEFORE"
+        b" :Invalid message reference or limit",
+        b":pyircd FAIL CHATHISTORY INVALID_PARAMS LATEST"
+        b" :Invalid message reference or limit",
+        b":pyircd FAIL CHATHISTORY INVALID_PARAMS BEFORE"
+        b" :Invalid message reference or limit",
+    ]
+
+
+def test_history_is_forgotten_with_its_channel(history):
+    alice = register(1, "alice")
+    send(alice, "JOIN", "#chan")
+    assert history.get("#chan") is not None
+    send(alice, "PART", "#chan")
+    assert history.get("#chan") is None
@@ -0,0 +1,64 @@
+"""Tests the state handed over by a hot restart (src/daemon/hot_restart.py)"""
+import json
+import socket
+from types import SimpleNamespace
+
+from channel import Channel
+from client import Client
+from connection import Connection
+from hot_restart import get_arguments_without_resume, receive_state, send_state
+
+from .helpers import register, send
+
+
+def test_clients_and_channels_survive_snapshot():
+    alice, bob = register(1, "alice"), register(2, "bob")
+    send(alice, "JOIN", "#a")
+    send(bob, "JOIN", "#a")
+    Client.channels["#a"].change_topic("hello")
+    snapshot = json.loads(
+        json.dumps(
+            {
+                "clients": [alice.get_snapshot(), bob.get_snapshot()],
+                "channels": [Client.channels["#a"].get_snapshot()],
+            }
+        )
+    )
+    Client.clients.clear()
+    Client.nicks.clear()
+    Client.channels.clear()
+    Client.registered_count = 0
+
+    clients = {}
+    for state in snapshot["clients"]:
+        key = SimpleNamespace(data=Connection(None, None, None))
+        client = Client.restore(state, key)
+        clients[client.address] = client
+    channel = Channel.restore(snapshot["channels"][0], clients)
+
+    assert Client.get_client("ALICE").address == ("127.0.0.1", 1)
+    assert Client.registered_count == 2
+    assert Client.get_client("bob").key.data.is_registered
+    assert channel.get_members() == ["alice", "bob"]
+    assert channel.get_topic() == "hello"
+    assert clients[("127.0.0.1", 2)].joined_channels == {"#a": channel}
+
+
+def test_state_is_sent_with_file_descriptors():
+    link, other_link = socket.socketpair()
+    with link, other_link:
+        send_state(link, b"{}", [link.fileno()] * 300)
+        fds, snapshot = receive_state(other_link)
+        assert len(fds) == 300 and snapshot == b"{}"
+        for fd in fds:
+            socket.socket(fileno=fd).close()
+
+
+def test_resume_option_is_not_passed_on():
+    arguments = ["daemon.py", "--hot-restart", "--resume-fd", "5", "--port", "1"]
+    assert get_arguments_without_resume(arguments) == [
+        "daemon.py",
+        "--hot-restart",
+        "--port",
+        "1",
+    ]
@@ -0,0 +1,47 @@
+"""Tests LIST of the client module (src/daemon/client.py)"""
+import constants
+from client import Client
+
+from .helpers import get_output, register, send
+
+
+def test_list_is_queued_as_it_is_sent():
+    alice = register(1, "alice")
+    num_channels = constants.STREAMED_REPLIES_PER_REFILL + 10
+    for number in range(num_channels):
+        send(alice, "JOIN", f"#c{number:04}")
+    get_output(alice)
+
+    send(alice, "LIST")
+    first = get_output(alice).split(constants.IRC_TERMINATION_DELIMITER)
+    assert b" 321 " in first[0]
+    assert len(first) - 2 == constants.STREAMED_REPLIES_PER_REFILL
+    assert b":pyircd 322 alice #c0000 1 :" == first[1]
+
+    # A channel that goes away before its reply was queued is left out
+    send(alice, "PART", f"#c{num_channels - 1:04}")
+    get_output(alice)
+    alice.key.data.refill()
+    rest = get_output(alice).split(constants.IRC_TERMINATION_DELIMITER)
+    assert len(rest) - 2 == 9
+    assert b" 323 alice :End of /LIST" in rest[-2]
+    assert alice.key.data.refill is None
+
+
+def test_list_filters_by_member_count():
+    alice, bob = register(1, "alice"), register(2, "bob")
+    send(alice, "JOIN", "#big", "#small")
+    send(bob, "JOIN", "#big")
+    get_output(alice)
+
+    send(alice, "LIST", ">1")
+    assert b"#big 2" in get_output(alice)
+    send(alice, "LIST", "<2,!#s*")
+    output = get_output(alice)
+    assert b"#small" not in output and b"#big" not in output
+    assert len(Client.channels) == 2
+
+    # Counts must be ASCII digits, other conditions are masks
+    send(alice, "LIST", ">²,<²")
+    output = get_output(alice)
+    assert b" 322 " not in output and b" 323 alice :End of /LIST" in output
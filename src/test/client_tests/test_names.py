@@ -0,0 +1,36 @@
+"""Tests the NAMES replies sent on JOIN (src/daemon/client.py, channel.py)"""
+import constants
+from client import Client
+
+from .helpers import get_output, register, send
+
+
+def test_names_are_split_into_lines_within_limit():
+    nicks = [f"member{number:03}xxxxxxxxxxxxxxxxxxxxxx" for number in range(100)]
+    for port, nick in enumerate(nicks):
+        send(register(port, nick), "JOIN", "#big")
+
+    last = register(100, "last")
+    get_output(last)
+    send(last, "JOIN", "#big")
+    lines = get_output(last).split(constants.IRC_TERMINATION_DELIMITER)
+    names = [line for line in lines if b" 353 " in line]
+
+    assert len(names) > 1
+    assert all(len(line) + 2 <= constants.MAX_LINE_LENGTH for line in names)
+    received = []
+    for line in names:
+        assert line.startswith(b":pyircd 353 last = #big :")
+        received.extend(line.split(b" :", 1)[1].decode().split(" "))
+    assert received == nicks + ["last"]
+    assert b" 366 last #big :End of /NAMES list" in lines[-2]
+
+
+def test_join_is_case_insensitive():
+    alice, bob = register(1, "alice"), register(2, "bob")
+    send(alice, "JOIN", "#Chan")
+    send(bob, "JOIN", "#chan")
+
+    assert Client.channels["#chan"].get_members() == ["alice", "bob"]
+    send(bob, "JOIN", "#CHAN")
+    assert bob.joined_channels == {"#chan": Client.channels["#chan"]}
@@ -0,0 +1,41 @@
+"""Tests the nick index of the client module (src/daemon/client.py)"""
+from client import Client
+
+from .helpers import get_output, register, send
+
+
+def test_lookup_uses_rfc1459_casemapping():
+    client = register(1, "Nick[a]")
+    assert Client.get_client("NICK{A}") is client
+    assert Client.get_client("nick[a]") is client
+    assert Client.get_client("other") is None
+
+
+def test_nick_in_use_is_case_insensitive():
+    register(1, "alice")
+    bob = register(2, "bob")
+    get_output(bob)
+
+    send(bob, "NICK", "ALICE")
+    assert b" 432 " in get_output(bob)
+    assert bob.nick == "bob"
+
+
+def test_nick_change_and_quit_update_index():
+    alice = register(1, "alice")
+    send(alice, "NICK", "Alicia")
+    assert Client.get_client("alice") is None
+    assert Client.get_client("alicia") is alice
+    assert Client.registered_count == 1
+
+    send(alice, "QUIT")
+    assert Client.get_client("alicia") is None
+    assert Client.registered_count == 0
+
+
+def test_client_may_change_case_of_own_nick():
+    alice = register(1, "alice")
+    get_output(alice)
+    send(alice, "NICK", "Alice")
+    assert alice.nick == "Alice"
+    assert b"NICK Alice" in get_output(alice)
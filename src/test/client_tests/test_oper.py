@@ -0,0 +1,46 @@
+"""Tests OPER and STATS of the client module (src/daemon/client.py)"""
+import config
+import pytest
+
+from .helpers import get_output, register, send
+
+
+@pytest.fixture(autouse=True)
+def operators():
+    config.OPERATORS = {"root": "secret"}
+    yield
+    config.OPERATORS = {}
+
+
+def test_oper_rejects_wrong_password():
+    client = register(1, "alice")
+    get_output(client)
+
+    send(client, "OPER", "root", "wrong")
+    assert b" 464 alice " in get_output(client)
+
+    send(client, "OPER", "nobody", "secret")
+    assert b" 464 alice " in get_output(client)
+
+
+def test_stats_l_requires_operator():
+    client = register(1, "alice")
+    get_output(client)
+
+    send(client, "STATS", "l")
+    output = get_output(client)
+    assert b" 481 alice " in output
+    assert b" 211 " not in output
+
+
+def test_stats_l_reports_sendq_of_every_client():
+    client = register(1, "alice")
+    register(2, "bob")
+    send(client, "OPER", "root", "secret")
+    assert b" 381 alice " in get_output(client)
+
+    send(client, "STATS", "l")
+    lines = get_output(client).decode().splitlines()
+    assert lines[0].startswith(":pyircd 211 alice alice[127.0.0.1:1] 0 ")
+    assert lines[1].startswith(":pyircd 211 alice bob[127.0.0.1:2] ")
+    assert lines[2] == ":pyircd 219 alice l :End of STATS report"
@@ -0,0 +1,31 @@
+"""Tests the welcome burst of the client module (src/daemon/client.py)"""
+import config
+import utils
+
+from .helpers import get_output, register, send
+
+
+def test_welcome_burst_matches_encoded_replies():
+    client = register(1, "alice")
+    lines = get_output(client).split(b"\r\n")[:-1]
+
+    welcome = utils.encode_message("001", ":Welcome to pyircd", "pyircd", "alice")
+    assert lines[0] + b"\r\n" == welcome
+    assert lines[4].startswith(b":pyircd 375 alice :- pyircd ")
+    assert lines[-1] == b":pyircd 376 alice :End of MOTD"
+    assert len(lines) == 4 + utils.motd.count("\n") + 3
+
+    send(client, "MOTD")
+    assert get_output(client).split(b"\r\n")[:-1] == lines[4:]
+
+
+def test_welcome_burst_follows_server_name():
+    config.SERVER_NAME = "irc.example"
+    try:
+        client = register(1, "alice")
+        output = get_output(client)
+    finally:
+        config.SERVER_NAME = "pyircd"
+
+    assert output.startswith(b":irc.example 001 alice :Welcome to irc.example\r\n")
+    assert b"\r\n:irc.example 375 alice :- irc.example " in output
@@ -0,0 +1,95 @@
+"""Tests WHO, WHOIS and NAMES of the client module (src/daemon/client.py)"""
+import constants
+
+from .helpers import get_output, register, send
+
+
+def get_lines(client) -> list:
+    return get_output(client).split(constants.IRC_TERMINATION_DELIMITER)[:-1]
+
+
+def test_who_matches_nick_masks():
+    alice = register(1, "alice")
+    register(2, "Bot[1]")
+    register(3, "bot{2}")
+    register(4, "carol")
+    get_output(alice)
+
+    send(alice, "WHO", "BOT*")
+    lines = get_lines(alice)
+    assert lines == [
+        b":pyircd 352 alice * Bot[1] 127.0.0.1 pyircd Bot[1] H :0 Real Name",
+        b":pyircd 352 alice * bot{2} 127.0.0.1 pyircd bot{2} H :0 Real Name",
+        b":pyircd 315 alice BOT* :End of WHO list",
+    ]
+    send(alice, "WHO", "?aro?")
+    assert b" carol H " in get_lines(alice)[0]
+
+
+def test_who_of_a_channel_is_queued_as_it_is_sent():
+    alice = register(0, "alice")
+    num_members = constants.STREAMED_REPLIES_PER_REFILL + 5
+    members = [register(port, f"m{port:04}") for port in range(1, num_members)]
+    for member in [alice] + members:
+        send(member, "JOIN", "#big")
+    get_output(alice)
+
+    send(alice, "WHO", "#BIG")
+    first = get_lines(alice)
+    assert len(first) == constants.STREAMED_REPLIES_PER_REFILL
+    assert first[0].startswith(b":pyircd 352 alice #big alice ")
+
+    # A member that leaves before its reply was queued is left out
+    send(members[-1], "PART", "#big")
+    get_output(alice)
+    alice.key.data.refill()
+    rest = get_lines(alice)
+    assert len(rest) == 4 + 1
+    assert rest[-1] == b":pyircd 315 alice #BIG :End of WHO list"
+    assert alice.key.data.refill is None
+
+
+def test_new_who_ends_the_one_in_progress():
+    alice = register(0, "alice")
+    for port in range(1, constants.STREAMED_REPLIES_PER_REFILL + 1):
+        register(port, f"m{port:04}")
+    get_output(alice)
+
+    send(alice, "WHO", "m*")
+    send(alice, "WHO", "alice")
+    lines = get_lines(alice)
+    assert lines[-3:] == [
+        b":pyircd 315 alice m* :End of WHO list",
+        b":pyircd 352 alice * alice 127.0.0.1 pyircd alice H :0 Real Name",
+        b":pyircd 315 alice alice :End of WHO list",
+    ]
+    assert alice.key.data.refill is None
+
+
+def test_whois():
+    alice, bob = register(1, "alice"), register(2, "bob")
+    send(bob, "JOIN", "#a", "#b")
+    get_output(alice)
+
+    send(alice, "WHOIS", "BOB,nobody")
+    assert get_lines(alice) == [
+        b":pyircd 311 alice bob bob 127.0.0.1 * :Real Name",
+        b":pyircd 312 alice bob pyircd :pyircd",
+        b":pyircd 319 alice bob :#a #b",
+        b":pyircd 318 alice BOB :End of /WHOIS list",
+        b":pyircd 401 alice nobody :No such nick/channel",
+        b":pyircd 318 alice nobody :End of /WHOIS list",
+    ]
+
+
+def test_names_of_channels():
+    alice, bob = register(1, "alice"), register(2, "bob")
+    send(bob, "JOIN", "#Chan")
+    get_output(alice)
+
+    send(alice, "NAMES", "#chan,#none")
+    assert get_lines(alice) == [
+        b":pyircd 353 alice = #Chan :bob",
+        b":pyircd 366 alice #Chan :End of /NAMES list",
+        b":pyircd 366 alice #none :End of /NAMES list",
+    ]
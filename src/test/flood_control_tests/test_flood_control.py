@@ -0,0 +1,89 @@
+"""Tests the flood_control module (src/daemon/flood_control.py)"""
+from types import SimpleNamespace
+
+import config
+import flood_control
+import pytest
+from constants import SERVER_EVENTS
+from flood_control import FloodControl, FloodState, get_cost
+from message import Message
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces time.monotonic with a clock that only moves when told to"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(flood_control.time, "monotonic", lambda: clock.now)
+    monkeypatch.setattr(config, "FLOOD_BURST", 4)
+    monkeypatch.setattr(config, "FLOOD_RATE", 2)
+    monkeypatch.setattr(config, "FLOOD_MAX_HELD", 3)
+    return clock
+
+
+def make_key():
+    data = SimpleNamespace(
+        address=("127.0.0.1", 1),
+        flood=FloodState(),
+        unregister_socket=False,
+        is_server_link=False,
+    )
+    return SimpleNamespace(data=data)
+
+
+def make_message(key, command: str, *parameters) -> Message:
+    # Servers make events of connections with the event as action too
+    events = (SERVER_EVENTS.CONNECT, SERVER_EVENTS.DISCONNECT)
+    action = command if command in events else "HANDLE"
+    return Message(key.data.address, action, b"", key, command, list(parameters))
+
+
+def test_cost_counts_every_target():
+    key = make_key()
+    assert get_cost(make_message(key, "PING", "x")) == ("command", 1)
+    assert get_cost(make_message(key, "PRIVMSG", "a,b", "c", "hi")) == ("message", 3)
+    assert get_cost(make_message(key, "JOIN", "#a,#b")) == ("command", 4)
+    assert get_cost(make_message(key, "LIST")) == ("command", 5)
+
+
+def test_holds_and_releases_in_order(clock):
+    dispatched = []
+    control = FloodControl(dispatched.append)
+    key = make_key()
+
+    for i in range(6):
+        control.dispatch(make_message(key, "PING", str(i)))
+    assert [m.parameters[0] for m in dispatched] == ["0", "1", "2", "3"]
+    assert control.release_held() == pytest.approx(0.5)
+
+    # A command of another class must not overtake the held ones
+    control.dispatch(make_message(key, "PRIVMSG", "a", "hi"))
+    assert len(dispatched) == 4
+
+    clock.now += 1
+    assert control.release_held() is None
+    assert [m.parameters[0] for m in dispatched[4:]] == ["4", "5", "a"]
+    assert key.data.flood.num_throttled == 3
+
+
+def test_drops_once_held_is_full(clock):
+    dispatched = []
+    control = FloodControl(dispatched.append)
+    key = make_key()
+
+    for i in range(10):
+        control.dispatch(make_message(key, "PING", str(i)))
+    assert len(dispatched) == 4
+    assert len(key.data.flood.held) == 3
+    assert key.data.flood.num_dropped == control.num_dropped == 3
+
+
+def test_disconnect_is_never_held(clock):
+    dispatched = []
+    control = FloodControl(dispatched.append)
+    key = make_key()
+
+    for i in range(5):
+        control.dispatch(make_message(key, "PING", str(i)))
+    control.dispatch(make_message(key, "DISCONNECT", "Disconnected"))
+    assert dispatched[-1].command == "DISCONNECT"
+    assert control.release_held() is None
@@ -0,0 +1,40 @@
+"""Tests the channel history (src/daemon/history.py)"""
+import constants
+from history import ChannelHistory, HistoryStore
+
+
+def get_ids(events) -> list:
+    return [msgid for msgid, _, _ in events]
+
+
+def test_selectors_find_events_in_a_wrapped_ring():
+    history = ChannelHistory(5)
+    for msgid in range(1, 9):
+        history.append(msgid, msgid * 10, f"line {msgid}".encode())
+
+    # 1 to 3 were replaced, 6 to 8 sit before the oldest event in the lists
+    assert len(history) == 5
+    assert get_ids(history.latest(None, 3)) == [6, 7, 8]
+    assert get_ids(history.latest(("msgid", 7), 3)) == [8]
+    assert get_ids(history.before(("msgid", 7), 10)) == [4, 5, 6]
+    assert get_ids(history.after(("msgid", 4), 2)) == [5, 6]
+    assert get_ids(history.before(("timestamp", 55), 2)) == [4, 5]
+    assert get_ids(history.after(("timestamp", 60), 5)) == [7, 8]
+    assert history.before(("msgid", 2), 5) == []
+    assert history.after(("msgid", 9), 5) == []
+
+
+def test_coldest_channels_are_evicted_within_budget():
+    event_size = len(b"x" * 10) + constants.HISTORY_ENTRY_OVERHEAD
+    channel_size = constants.HISTORY_CHANNEL_OVERHEAD
+    store = HistoryStore(capacity=2, budget=2 * channel_size + 4 * event_size)
+    for key in ["#a", "#a", "#a", "#b", "#b"]:
+        store.record(key, b"x" * 10)
+    assert store.num_bytes == 2 * channel_size + 4 * event_size
+
+    store.get("#a")  # Reading warms #a, #b is colder now
+    store.record("#c", b"x" * 10)
+    assert store.get("#b") is None
+    assert len(store.get("#a")) == 2 and len(store.get("#c")) == 1
+    assert store.num_bytes == 2 * channel_size + 3 * event_size
+    assert store.num_evicted == 1
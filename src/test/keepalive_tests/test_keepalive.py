@@ -0,0 +1,82 @@
+"""Tests the keepalive module (src/daemon/keepalive.py)"""
+from types import SimpleNamespace
+
+import config
+import keepalive
+import pytest
+from buffers import OutputQueue
+from constants import SERVER_EVENTS
+from keepalive import Keepalive
+from message import Message
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces time.monotonic with a clock that only moves when told to"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(keepalive.time, "monotonic", lambda: clock.now)
+    monkeypatch.setattr(config, "REGISTRATION_TIMEOUT", 10)
+    monkeypatch.setattr(config, "PING_INTERVAL", 30)
+    monkeypatch.setattr(config, "PING_TIMEOUT", 20)
+    return clock
+
+
+def connect(control: Keepalive, closed: list):
+    data = SimpleNamespace(
+        address=("127.0.0.1", 1),
+        out_queue=OutputQueue(),
+        unregister_socket=False,
+        is_dirty=False,
+        mark_dirty=lambda key: None,
+        close_connection=lambda key, reason: closed.append(reason),
+        connected_at=control._wheel.now,
+        is_registered=False,
+        timer=None,
+    )
+    key = SimpleNamespace(data=data)
+    send(control, key, SERVER_EVENTS.CONNECT)
+    return key
+
+
+def send(control: Keepalive, key, command: str):
+    control.dispatch(Message(key.data.address, command, b"", key, command))
+
+
+def run_until(control: Keepalive, clock, now: float):
+    """Advance the clock to now, stopping wherever the wheel asks to"""
+    while clock.now < now:
+        delay = control.tick()
+        clock.now = now if delay is None else min(now, clock.now + max(delay, 0.1))
+    control.tick()
+
+
+def test_unregistered_connection_times_out(clock):
+    closed = []
+    control = Keepalive(lambda message: None)
+    key = connect(control, closed)
+    send(control, key, "NICK")
+
+    run_until(control, clock, 1009)
+    assert closed == []
+    run_until(control, clock, 1011)
+    assert closed == ["Registration timeout"]
+
+
+def test_silent_client_is_pinged_then_disconnected(clock):
+    closed = []
+    control = Keepalive(lambda message: None)
+    key = connect(control, closed)
+    key.data.is_registered = True
+
+    # Activity postpones the PING
+    run_until(control, clock, 1025)
+    send(control, key, "PONG")
+    run_until(control, clock, 1050)
+    assert not key.data.out_queue
+
+    run_until(control, clock, 1057)
+    assert key.data.out_queue.drain() == [b"PING :pyircd\r\n"]
+    run_until(control, clock, 1074)
+    assert closed == []
+    run_until(control, clock, 1076)
+    assert closed == ["Ping timeout: 50 seconds"]
@@ -0,0 +1,55 @@
+"""Tests the listener module (src/daemon/listener.py)"""
+import socket
+
+import pytest
+from listener import Listener
+
+
+def test_parse_addresses_and_options():
+    listener = Listener.parse("[::1]:6697,nodelay,keepalive=30,sndbuf=65536", 128)
+    assert listener.family == socket.AF_INET6
+    assert listener.address == ("::1", 6697)
+    assert listener.backlog == 128
+    assert listener.nodelay and listener.keepalive
+    assert (listener.keepalive_idle, listener.sndbuf) == (30, 65536)
+
+    listener = Listener.parse("unix:/run/pyircd.sock,backlog=16")
+    assert listener.family == socket.AF_UNIX
+    assert listener.address == "/run/pyircd.sock"
+    assert listener.backlog == 16
+    assert str(listener) == "unix:/run/pyircd.sock"
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "6667",
+        "host:port",
+        "h:²",
+        "h:65536",
+        "unix:",
+        "unix:/a,nodelay",
+        "h:1,rcvbuf=0",
+        "h:1,backlog=²",
+        "h:1,x",
+    ],
+)
+def test_parse_rejects_malformed_values(value):
+    with pytest.raises(ValueError):
+        Listener.parse(value)
+
+
+def test_unix_socket_clients_are_numbered(tmp_path):
+    path = str(tmp_path / "pyircd.sock")
+    listener = Listener.parse(f"unix:{path}")
+    listener.listen()
+    try:
+        assert listener.get_client_address("") == (path, 1)
+        listener.skip_client_numbers(41)
+        assert listener.get_client_address("") == (path, 42)
+    finally:
+        listener.close()
+    assert not (tmp_path / "pyircd.sock").exists()
+
+    listener = Listener.parse("127.0.0.1:6667")
+    assert listener.get_client_address(("127.0.0.1", 4000)) == ("127.0.0.1", 4000)
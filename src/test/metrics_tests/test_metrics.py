@@ -0,0 +1,36 @@
+"""Tests the metrics module (src/daemon/metrics.py)"""
+import pytest
+from metrics import Histogram, Metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    """Metrics are class level, start every test from scratch"""
+    yield
+    Metrics.commands.clear()
+    Metrics.gauges.clear()
+
+
+def test_histogram_quantile_reports_bucket_upper_bound():
+    histogram = Histogram(buckets=(1, 2, 4))
+    for value in (0.5, 1.5, 1.5, 3, 100):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.get_quantile(0.5) == 2
+    assert histogram.get_quantile(0.99) == 4
+
+
+def test_render_is_prometheus_text_format():
+    Metrics.observe_command("PING", 0.00002)
+    Metrics.observe_command("PING", 1)
+    Metrics.gauges["clients"] = ("Connected clients", lambda: 3)
+
+    lines = Metrics.render().splitlines()
+    assert "# TYPE pyircd_clients gauge" in lines
+    assert "pyircd_clients 3" in lines
+    name = "pyircd_command_duration_seconds"
+    assert f"# TYPE {name} histogram" in lines
+    assert f'{name}_bucket{{command="PING",le="2.5e-05"}} 1' in lines
+    assert f'{name}_bucket{{command="PING",le="0.1"}} 1' in lines
+    assert f'{name}_bucket{{command="PING",le="+Inf"}} 2' in lines
+    assert f'{name}_count{{command="PING"}} 2' in lines
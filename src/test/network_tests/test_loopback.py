@@ -0,0 +1,114 @@
+"""Links daemons on loopback and talks across them (src/daemon/network.py)"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+DAEMON = os.path.join(os.path.dirname(__file__), "..", "..", "daemon", "daemon.py")
+TIMEOUT = 5
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Node:
+    """A daemon of the network and a client connected to it"""
+
+    def __init__(self, name: str, peers: list = ()):
+        self.port = get_free_port()
+        options = ["--port", str(self.port), "--name", name, "--link-password", "pw"]
+        for peer in peers:
+            options += ["--connect", f"127.0.0.1:{peer.port}"]
+        self.proc = subprocess.Popen(
+            [sys.executable, DAEMON] + options,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.received = b""
+        # Peers started later find it listening, instead of retrying in 30 s
+        deadline = time.monotonic() + TIMEOUT
+        while True:
+            try:
+                self.client = socket.create_connection(("127.0.0.1", self.port))
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    self.proc.kill()
+                    raise
+                time.sleep(0.05)
+        self.client.settimeout(TIMEOUT)
+
+    def register(self, nick: str):
+        self.send(f"NICK {nick}", f"USER {nick} 0 * :{nick}")
+        self.expect(" 001 ")
+
+    def send(self, *lines: str):
+        self.client.sendall("".join(f"{line}\r\n" for line in lines).encode())
+
+    def expect(self, text: str) -> str:
+        """Return what was received up to and including the line with text"""
+        while text.encode() not in self.received:
+            data = self.client.recv(65536)
+            assert data, f"closed before {text!r} arrived"
+            self.received += data
+        end = self.received.index(b"\n", self.received.index(text.encode())) + 1
+        received, self.received = self.received[:end], self.received[end:]
+        return received.decode()
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+        self.client.close()
+
+
+@pytest.fixture
+def nodes():
+    """Three servers linked in a row: a.test - b.test - c.test"""
+    started = []
+    try:
+        for name in ("a.test", "b.test", "c.test"):
+            started.append(Node(name, started[-1:]))
+        yield started
+    finally:
+        for node in started:
+            node.stop()
+
+
+def wait_for_servers(node: Node, count: int):
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        node.send("LUSERS")
+        if f"on {count} servers" in node.expect(" 251 "):
+            return
+        assert time.monotonic() < deadline, "servers did not link"
+        time.sleep(0.1)
+
+
+def test_clients_talk_across_servers(nodes):
+    a, b, c = nodes
+    a.register("alice")
+    a.send("JOIN #net")
+    a.expect(" 366 ")
+    c.register("carol")
+    wait_for_servers(c, 3)
+
+    c.send("JOIN #net")
+    assert "alice" in c.expect(" 353 ")
+    a.expect(":carol JOIN #net")
+
+    c.send("PRIVMSG #net :hi", "PRIVMSG alice :psst")
+    a.expect(":carol PRIVMSG #net :hi")
+    a.expect(":carol PRIVMSG alice :psst")
+
+    b.register("bob")
+    b.send("NICK alice")
+    b.expect(" 432 ")
+
+    b.stop()
+    a.expect(":carol PART #net :a.test b.test")
@@ -0,0 +1,199 @@
+"""Tests the network module (src/daemon/network.py)"""
+from types import SimpleNamespace
+
+import config
+import constants
+import pytest
+from buffers import InputBuffer, OutputQueue
+from client import Client
+from flood_control import FloodControl, FloodState
+from history import HistoryStore
+from message import Message
+from message_bus import MessageBus
+from network import Network, ServerLink
+from parser import Parser
+
+
+def make_client(port: int) -> Client:
+    """Returns a Client whose output is queued on a fake connection"""
+    data = SimpleNamespace(
+        address=("127.0.0.1", port),
+        in_buffer=InputBuffer(),
+        out_queue=OutputQueue(),
+        unregister_socket=False,
+        is_dirty=False,
+        mark_dirty=lambda key: None,
+        connected_at=0.0,
+        closed_with=None,
+        flood=FloodState(),
+        is_server_link=False,
+    )
+    key = SimpleNamespace(data=data)
+    data.close_connection = lambda key, reason: setattr(data, "closed_with", reason)
+    return Client(data.address, key)
+
+
+def send(client, line: str):
+    """Parse line and hand it to the client or link of the connection"""
+    key = client.key
+    parser = Parser(lambda message: client.handle_message(message))
+    parser.dispatch(Message(key.data.address, "PARSE", f"{line}\r\n".encode(), key))
+
+
+def get_output(client) -> bytes:
+    return b"".join(client.key.data.out_queue.drain())
+
+
+@pytest.fixture(autouse=True)
+def network():
+    """Client state is class level, start every test from scratch"""
+    config.NETWORK = Network("secret")
+    yield config.NETWORK
+    config.NETWORK = None
+    Client.clients.clear()
+    Client.nicks.clear()
+    Client.channels.clear()
+    Client.registered_count = 0
+
+
+def register(port: int, nick: str) -> Client:
+    client = make_client(port)
+    send(client, f"NICK {nick}")
+    send(client, f"USER {nick} 0 * :Real Name")
+    get_output(client)
+    return client
+
+
+def link(port: int, name: str = "peer") -> ServerLink:
+    connection = make_client(port)
+    send(connection, "PASS :secret")
+    send(connection, f"SERVER {name} 1 :pyircd")
+    # The link took the place of the client of its connection
+    return Client.clients[connection.address]
+
+
+def test_link_receives_burst():
+    alice = register(1, "alice")
+    send(alice, "JOIN #chan")
+
+    peer = link(2)
+    assert isinstance(peer, ServerLink)
+    burst = get_output(peer)
+    assert b"SERVER pyircd 1 :pyircd\r\n" in burst
+    assert f":pyircd NICK alice 1 alice {alice.nick_ts} :Real Name".encode() in burst
+    assert b":pyircd NJOIN #chan :alice\r\n" in burst
+
+
+def test_burst_of_many_users_passes_flood_control():
+    connection = make_client(2)
+    nicks = [f"user{number}" for number in range(300)]
+    lines = ["PASS :secret", "SERVER peer 1 :pyircd"] + [
+        f":peer NICK {nick} 1 {nick} 100 :User" for nick in nicks
+    ]
+    # The whole burst is read at once, without time for tokens to refill
+    parser = Parser(FloodControl(MessageBus().dispatch).dispatch)
+    key = connection.key
+    for line in lines:
+        parser.dispatch(Message(key.data.address, "PARSE", f"{line}\r\n".encode(), key))
+
+    assert key.data.is_server_link
+    assert key.data.flood.held is None
+    assert all(Client.get_client(nick) is not None for nick in nicks)
+
+
+def test_link_with_wrong_password_is_dropped():
+    connection = make_client(2)
+    send(connection, "PASS :wrong")
+    send(connection, "SERVER peer 1 :pyircd")
+    assert get_output(connection) == b"ERROR :Closing link: Bad password\r\n"
+    assert connection.key.data.unregister_socket
+    assert connection.address not in Client.clients
+
+
+def test_remote_user_talks_to_local_members():
+    alice = register(1, "alice")
+    send(alice, "JOIN #chan")
+    peer = link(2)
+    send(peer, ":peer NICK bob 1 bob 100 :Bob")
+    send(peer, ":bob JOIN #chan")
+    get_output(alice)
+    get_output(peer)
+
+    send(peer, ":bob PRIVMSG #chan :hi")
+    assert get_output(alice) == b":bob PRIVMSG #chan :hi\r\n"
+    send(alice, "PRIVMSG #chan :hello")
+    assert get_output(peer) == b":alice PRIVMSG #chan :hello\r\n"
+    send(alice, "PRIVMSG bob :psst")
+    assert get_output(peer) == b":alice PRIVMSG bob :psst\r\n"
+
+
+def test_lines_of_remote_users_are_kept_in_history(monkeypatch):
+    monkeypatch.setattr(config, "HISTORY", HistoryStore(10, 1024 * 1024))
+    alice = register(1, "alice")
+    send(alice, "JOIN #chan")
+    peer = link(2)
+    send(peer, ":peer NICK bob 1 bob 100 :Bob")
+    send(peer, ":bob JOIN #chan")
+    send(peer, ":bob PRIVMSG #chan :hi")
+
+    events = config.HISTORY.get("#chan").latest(None, 10)
+    assert [line for _, _, line in events] == [
+        b":alice JOIN #chan\r\n",
+        b":bob JOIN #chan\r\n",
+        b":bob PRIVMSG #chan :hi\r\n",
+    ]
+
+
+def test_connect_rejects_invalid_ports(monkeypatch):
+    monkeypatch.setattr(config, "OPERATORS", {"root": "secret"})
+    alice = register(1, "alice")
+    send(alice, "OPER root secret")
+    get_output(alice)
+
+    for port in ["²", "99999"]:
+        send(alice, f"CONNECT 127.0.0.1 {port}")
+        assert get_output(alice) == (
+            b":pyircd 461 alice CONNECT :Not enough parameters\r\n"
+        )
+    assert list(Client.clients) == [alice.address]
+
+
+def test_malformed_lines_of_a_link_are_ignored():
+    peer = link(2)
+    send(peer, ":peer SERVER far ² :pyircd")
+    send(peer, ":peer NICK bob 1 bob ² :Bob")
+    send(peer, ":peer NICK carol 1 carol 100 :Carol")
+    send(peer, ":carol NICK dave ²")
+
+    assert config.NETWORK.get_servers() == [("peer", "pyircd", 1)]
+    assert Client.get_client("bob") is None
+    assert Client.get_client("dave") is not None
+
+
+def test_older_nick_wins_collision():
+    alice = register(1, "alice")
+    peer = link(2)
+
+    send(peer, f":peer NICK alice 1 alice {alice.nick_ts + 1} :Other")
+    assert Client.get_client("alice") is alice
+
+    send(peer, f":peer NICK alice 1 alice {alice.nick_ts - 1} :Other")
+    assert Client.get_client("alice") is not alice
+    assert alice.key.data.closed_with == constants.NICK_COLLISION
+
+
+def test_netsplit_parts_users_behind_link():
+    alice = register(1, "alice")
+    send(alice, "JOIN #chan")
+    peer = link(2)
+    send(peer, ":peer SERVER leaf 2 :pyircd")
+    send(peer, ":leaf NICK bob 2 bob 100 :Bob")
+    send(peer, ":bob JOIN #chan")
+    get_output(alice)
+
+    peer.handle_message(
+        Message(peer.address, "DISCONNECT", b"", peer.key, "DISCONNECT", ["gone"])
+    )
+    assert get_output(alice) == b":bob PART #chan :pyircd peer\r\n"
+    assert Client.get_client("bob") is None
+    assert config.NETWORK.get_server_count() == 0
@@ -1,6 +1,7 @@
 """Tests the parsing module (src/daemon/parser.py)"""
 import pytest
 import yaml
+from constants import IRC_COMMANDS
 from message import Message
 from message_bus import MessageBus
 from parser import Parser
@@ -42,3 +43,31 @@ def parser():
 def tests_from_yaml(parser, message, parsed_message):
     for message, parsed_message in DATA:
         assert parsed_message == parser._parse_message(message)
+
+
+def parse(parser, line: bytes) -> Message:
+    return parser._parse_message(Message("localhost", "PARSE", line + b"\r\n", "key"))
+
+
+def test_tags_and_source(parser):
+    message = parse(parser, rb"@id=1;+draft/x=a\sb\:c;flag :nick!u@h privmsg #a :hi")
+    assert message.tags == {"id": "1", "+draft/x": "a b;c", "flag": ""}
+    assert message.source == "nick!u@h"
+    assert message.command == "PRIVMSG"
+    assert message.parameters == ["#a", "hi"]
+
+
+def test_colon_inside_middle_parameter(parser):
+    message = parse(parser, b"PRIVMSG a:b c :d :e")
+    assert message.parameters == ["a:b", "c", "d :e"]
+
+
+def test_command_token_is_handler_key(parser):
+    assert parse(parser, b"privmsg a b").command is IRC_COMMANDS.PRIVMSG
+
+
+def test_drops_invalid_messages(parser):
+    assert parse(parser, b"NOTACOMMAND a") is None
+    assert parse(parser, b"PRIVMSG a\0b :c") is None
+    assert parse(parser, b"PRIVMSG a :\xff") is None
+    assert parse(parser, b"   ") is None
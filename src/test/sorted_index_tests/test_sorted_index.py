@@ -0,0 +1,35 @@
+"""Tests the sorted index (src/daemon/sorted_index.py)"""
+from sorted_index import SortedIndex, compile_mask, get_prefix
+
+
+def test_matching_keys_are_found_by_prefix():
+    index = SortedIndex()
+    for key in ["carol", "bot2", "alice", "bot1", "bob"]:
+        index[key] = None
+
+    assert list(index.iter_matching(["bo*"])) == ["bob", "bot1", "bot2"]
+    assert list(index.iter_matching(["bot?", "b*"])) == ["bob", "bot1", "bot2"]
+    assert list(index.iter_matching(["*o*"])) == ["bob", "bot1", "bot2", "carol"]
+    del index["bot1"]
+    assert index.pop("bob") is None
+    assert list(index.iter_matching(["b*"])) == ["bot2"]
+
+
+def test_search_resumes_after_keys_change():
+    index = SortedIndex()
+    for key in ["a1", "a3", "a5"]:
+        index[key] = None
+
+    search = index.iter_prefixes(["a"])
+    assert next(search) == "a1"
+    index.pop("a1")
+    index.pop("a3")
+    index["a2"] = None
+    assert list(search) == ["a2", "a5"]
+
+
+def test_masks():
+    assert get_prefix("#py*n") == "#py"
+    assert get_prefix("?x") == ""
+    assert compile_mask("a.b*")("a.bcd")
+    assert not compile_mask("a.b*")("axbcd")
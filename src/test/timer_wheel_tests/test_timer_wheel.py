@@ -0,0 +1,38 @@
+"""Tests the timer_wheel module (src/daemon/timer_wheel.py)"""
+from timer_wheel import TimerWheel
+
+
+def test_timers_expire_in_order_and_never_early():
+    wheel = TimerWheel(now=0.0)
+    expired = []
+    for delay in (5000, 3, 70, 0.2, 300000, 64):
+        wheel.schedule(delay, expired.append, delay)
+
+    now = 0.0
+    while wheel.num_timers:
+        now += wheel.get_delay()
+        wheel.advance(now)
+        assert all(delay <= now for delay in expired)
+
+    assert expired == [0.2, 3, 64, 70, 5000, 300000]
+
+
+def test_advance_catches_up_on_missed_ticks():
+    wheel = TimerWheel(now=10.0)
+    expired = []
+    wheel.schedule(100, expired.append, "late")
+    wheel.advance(500.0)
+    assert expired == ["late"]
+    assert wheel.get_delay() is None
+
+
+def test_cancelled_timer_does_not_expire():
+    wheel = TimerWheel(now=0.0)
+    expired = []
+    timer = wheel.schedule(10, expired.append, "cancelled")
+    wheel.schedule(10, expired.append, "kept")
+    wheel.cancel(timer)
+    wheel.cancel(timer)
+    wheel.advance(10.0)
+    assert expired == ["kept"]
+    assert wheel.num_timers == 0
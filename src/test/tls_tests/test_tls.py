@@ -0,0 +1,88 @@
+"""Tests the tls module (src/daemon/tls.py)"""
+import shutil
+import ssl
+import subprocess
+
+import pytest
+from tls import TlsContext
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("openssl") is None, reason="Needs the openssl command line tool"
+)
+
+
+def create_certificate(path, name: str) -> str:
+    """Write a self-signed certificate of name and its key to path"""
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt"]
+        + ["ec_paramgen_curve:prime256v1", "-nodes", "-subj", f"/CN={name}"]
+        + ["-days", "1", "-keyout", str(path), "-out", str(path) + ".crt"],
+        check=True,
+        capture_output=True,
+    )
+    with open(str(path) + ".crt") as f:
+        certificate = f.read()
+    with open(path, "a") as f:
+        f.write(certificate)
+    return str(path)
+
+
+# Sessions only resume with the client context they were created by
+CLIENT_CONTEXT = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+CLIENT_CONTEXT.check_hostname = False
+CLIENT_CONTEXT.verify_mode = ssl.CERT_NONE
+
+
+def handshake(tls: TlsContext, session=None) -> ssl.SSLObject:
+    """Run a handshake with tls over memory BIOs, return the client side"""
+    client_in, client_out = ssl.MemoryBIO(), ssl.MemoryBIO()
+    server_in, server_out = ssl.MemoryBIO(), ssl.MemoryBIO()
+    client = CLIENT_CONTEXT.wrap_bio(
+        client_in, client_out, server_hostname="localhost", session=session
+    )
+    server = tls.context.wrap_bio(server_in, server_out, server_side=True)
+
+    for _ in range(10):
+        for side in (client, server):
+            try:
+                side.do_handshake()
+            except ssl.SSLWantReadError:
+                pass
+        server_in.write(client_out.read())
+        client_in.write(server_out.read())
+    # Session tickets arrive after the handshake
+    with pytest.raises(ssl.SSLWantReadError):
+        client.read()
+    return client
+
+
+def get_certificate(client: ssl.SSLObject) -> str:
+    return ssl.DER_cert_to_PEM_cert(client.getpeercert(binary_form=True))
+
+
+def test_sessions_resume_across_reloads(tmp_path):
+    path = tmp_path / "cert.pem"
+    tls = TlsContext(create_certificate(path, "old"))
+    client = handshake(tls)
+    assert not client.session_reused
+    old_certificate = get_certificate(client)
+
+    path.unlink()
+    create_certificate(path, "new")
+    tls.reload()
+    resumed = handshake(tls, client.session)
+    assert resumed.session_reused
+
+    client = handshake(tls)
+    assert not client.session_reused
+    assert get_certificate(client) != old_certificate
+
+
+def test_failed_reload_keeps_certificate(tmp_path):
+    path = tmp_path / "cert.pem"
+    tls = TlsContext(create_certificate(path, "old"))
+    old_certificate = get_certificate(handshake(tls))
+
+    path.write_text("not a certificate")
+    tls.reload()
+    assert get_certificate(handshake(tls)) == old_certificate